@@ -0,0 +1,86 @@
+"""
+Per-session semantic answer cache.
+
+Stores each answered question's embedding next to its answer. A later question
+in the same session whose embedding has cosine similarity at or above the
+threshold (and the same extra context) gets the stored answer back without
+retrieval or generation. The same question, up to case and whitespace, is
+matched exactly without an embedding; questions answered by lexical-only
+retrieval are stored without one. RAGAgent drops a session's cache whenever
+the session's documents change.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", 0.92))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("RAG_ANSWER_CACHE_MAX_ENTRIES", 64))
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # normalized question -> (unit embedding or None, context, answer)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def lookup_exact(self, question: str, context: str) -> Optional[str]:
+        """Return the answer stored for the same question and context, if any."""
+        key = self._key(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != context:
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def lookup(self, embedding: List[float], context: str) -> Optional[str]:
+        """Return the answer of the most similar cached question above the threshold, if any."""
+        with self._lock:
+            if not self._entries:
+                return None
+            query = self._unit(embedding)
+            best_question, best_similarity = None, self.threshold
+            for question, (vector, cached_context, _) in self._entries.items():
+                if vector is None or cached_context != context or vector.shape != query.shape:
+                    continue
+                similarity = float(vector @ query)
+                if similarity >= best_similarity:
+                    best_question, best_similarity = question, similarity
+            if best_question is None:
+                return None
+            self._entries.move_to_end(best_question)
+            return self._entries[best_question][2]
+
+    def store(self, question: str, embedding: Optional[List[float]], context: str, answer: str) -> None:
+        """Store an answer; without an embedding it is only found by lookup_exact."""
+        if not self.enabled:
+            return
+        key = self._key(question)
+        vector = self._unit(embedding) if embedding is not None else None
+        with self._lock:
+            self._entries[key] = (vector, context, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
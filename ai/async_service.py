@@ -0,0 +1,508 @@
+"""
+asyncio serving mode for the RAG service (RAG_SERVER=async).
+
+The LLM-bound endpoints (/upload, /chat, /query, /analyze/financial, /payment,
+/validation, /comprehensive and /extract-text) run natively on an aiohttp
+event loop: Gemini calls and embeddings go through the models' async APIs, so
+an in-flight LLM call holds no thread. CPU work (text extraction, docx
+parsing, OCR, FAISS indexing and retrieval under the session locks) runs on a
+bounded thread pool (RAG_ASYNC_WORKERS).
+
+Every other endpoint (health, metrics, admin, cache stats, clear-context,
+/analyze/batch and /jobs) is served by the Flask app in python_service on a
+separate pool (RAG_ASYNC_WSGI_THREADS), so both modes answer the same API.
+Native endpoints keep the request metrics, traces, CORS headers and cassette
+recording of the Flask ones; /admin/profile only profiles Flask-served
+requests, as native requests share the event loop thread.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import sys
+import tempfile
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from aiohttp import BodyPartReader, web #@UnresolvedImport
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics #@UnresolvedImport
+import python_service as service #@UnresolvedImport
+import tracing #@UnresolvedImport
+from metrics import stage_timer #@UnresolvedImport
+
+logger = logging.getLogger(__name__)
+
+# Threads for CPU work of native endpoints, and for requests served by the Flask app
+ASYNC_WORKERS = int(os.getenv('RAG_ASYNC_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
+WSGI_THREADS = int(os.getenv('RAG_ASYNC_WSGI_THREADS', 8))
+# Pending connections the listening socket queues before refusing new ones
+LISTEN_BACKLOG = 1024
+
+# analyze endpoint -> (RAGAgent coroutine, log label, error prefix)
+ANALYSIS_ENDPOINTS = {
+    '/analyze/financial': ('agenerate_financial_insights', "financial analysis", "Analysis failed"),
+    '/analyze/payment': ('aextract_payment_details', "payment analysis", "Analysis failed"),
+    '/analyze/validation': ('avalidate_document', "document validation", "Validation failed"),
+}
+
+# A file part of a multipart upload; file is a spooled stream positioned at its start
+UploadedFile = namedtuple('UploadedFile', ['filename', 'file'])
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="rag-wsgi")
+
+def error(message, status):
+    return web.json_response({"error": message}, status=status)
+
+async def ensure_agent():
+    """The RAG agent; built on a worker thread when the warm-up has not done it yet"""
+    if service.rag_agent is None:
+        await asyncio.to_thread(service.ensure_agent)
+    return service.rag_agent
+
+async def json_body(request):
+    """The request's JSON object, or None when the body is not one"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def get_session_id(request, data=None, form=None):
+    """Session ID from the JSON body, form field or X-Session-ID header; 'default' when absent"""
+    if data and data.get('sessionId'):
+        return str(data['sessionId'])
+    return (form or {}).get('sessionId') or request.headers.get('X-Session-ID') or 'default'
+
+async def read_form(request):
+    """
+    The multipart body's (fields, files), parsed once per request. A failed parse is
+    remembered too, so the handler reports the same error as the cassette recorder.
+    """
+    if 'form' not in request:
+        try:
+            with stage_timer("read_upload"):
+                request['form'] = await parse_form(request)
+        except service.UploadError as e:
+            request['form'] = e
+    if isinstance(request['form'], service.UploadError):
+        raise request['form']
+    return request['form']
+
+async def parse_form(request):
+    """
+    Read the multipart parts into form fields and UploadedFile entries. File parts
+    go into a SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES), so, as in Flask
+    mode, small documents never touch the disk.
+    """
+    if request.content_length is not None and request.content_length > service.MAX_UPLOAD_BYTES:
+        raise service.UploadError(f"File too large (limit {service.MAX_UPLOAD_BYTES} bytes)", 413)
+    fields, files = {}, {}
+    if request.content_type != 'multipart/form-data':
+        return fields, files
+    size = 0
+    try:
+        async for part in await request.multipart():
+            if not isinstance(part, BodyPartReader):
+                continue
+            if part.filename is None:
+                buffer = bytearray()
+                sink = buffer.extend
+            else:
+                stream = tempfile.SpooledTemporaryFile(max_size=service.UPLOAD_SPOOL_BYTES)
+                files[part.name] = UploadedFile(part.filename, stream)
+                sink = stream.write
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > service.MAX_UPLOAD_BYTES:
+                    raise service.UploadError(f"File too large (limit {service.MAX_UPLOAD_BYTES} bytes)", 413)
+                sink(chunk)
+            if part.filename is None:
+                fields[part.name] = buffer.decode(part.get_charset('utf-8'))
+            else:
+                stream.seek(0)
+    except BaseException:
+        for upload in files.values():
+            upload.file.close()
+        raise
+    return fields, files
+
+async def read_upload(request):
+    """Validate the multipart upload and return (form fields, UploadedFile, file extension)"""
+    form, files = await read_form(request)
+    file = files.get('file')
+    if file is None:
+        raise service.UploadError("No file part", 400)
+    if not file.filename:
+        raise service.UploadError("No selected file", 400)
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    file.file.seek(0, os.SEEK_END)
+    logger.info(f"Received {file.filename}, size={file.file.tell()} bytes")
+    file.file.seek(0)
+    return form, file, file_extension
+
+async def stream_answer(request, tokens, data, extra):
+    """Async python_service.stream_answer: the same token events, written as the LLM produces them"""
+    sse = service.wants_sse(data, request.headers)
+    response = web.StreamResponse(headers={
+        "Content-Type": 'text/event-stream' if sse else 'application/x-ndjson',
+        "Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    answer = []
+    try:
+        async for token in tokens:
+            answer.append(token)
+            await response.write(service.encode_event({"token": token}, sse).encode())
+        await response.write(service.encode_event(
+            {"done": True, "response": {"answer": "".join(answer)}, **extra}, sse).encode())
+    except Exception as e:
+        logger.error(f"Error while streaming answer: {str(e)}")
+        logger.error(traceback.format_exc())
+        await response.write(service.encode_event({"error": f"Streaming failed: {str(e)}"}, sse).encode())
+    finally:
+        await tokens.aclose()
+    await response.write_eof()
+    return response
+
+async def live(request):
+    """Liveness, answered on the event loop so it never queues behind Flask-served requests"""
+    return web.json_response({"status": "alive"})
+
+async def upload_document(request):
+    """Upload a document for analysis - supports text files, Word documents, and images"""
+    try:
+        rag_agent = await ensure_agent()
+        if not rag_agent:
+            return error("RAG Agent not initialized", 500)
+
+        form, file, file_extension = await read_upload(request)
+        session_id = get_session_id(request, form=form)
+        try:
+            with stage_timer("extract", file_type=file_extension):
+                file_content = await asyncio.to_thread(service.extract_document_text, file.file, file_extension)
+        finally:
+            file.file.close()
+
+        summary = await rag_agent.asummarize_text(file_content)
+        await asyncio.to_thread(rag_agent.set_document, file_content, session_id)
+        return web.json_response({
+            "summary": summary,
+            "file_type": file_extension,
+            "content_length": len(file_content),
+            "sessionId": session_id
+        })
+    except service.UploadError as e:
+        return error(str(e), e.status_code)
+    except Exception as e:
+        logger.error(f"Error in document upload: {str(e)}")
+        logger.error(traceback.format_exc())
+        return error(f"Upload failed: {str(e)}", 500)
+
+async def chat_with_document(request):
+    """Chat with the uploaded document"""
+    try:
+        rag_agent = await ensure_agent()
+        if not rag_agent:
+            return error("RAG Agent not initialized", 500)
+
+        data = await json_body(request)
+        if not data or 'message' not in data:
+            return error("message is required", 400)
+
+        message = data['message']
+        session_id = get_session_id(request, data)
+
+        # Use the session's last uploaded document for context (no-op once it is indexed)
+        ingestion = None
+        document_content = await asyncio.to_thread(rag_agent.get_document, session_id)
+        if document_content:
+            ingestion = await rag_agent.aadd_documents([document_content], session_id)
+
+        if service.wants_stream(data, request.headers):
+            return await stream_answer(request, rag_agent.aquery_stream(message, session_id=session_id), data,
+                                       {"ingestion": ingestion, "sessionId": session_id})
+
+        response = await rag_agent.aquery(message, session_id=session_id)
+        return web.json_response({"response": response, "ingestion": ingestion, "sessionId": session_id})
+    except Exception as e:
+        logger.error(f"Error in chat: {str(e)}")
+        logger.error(traceback.format_exc())
+        return error(f"Chat failed: {str(e)}", 500)
+
+async def query_documents(request):
+    """Query document knowledge base"""
+    try:
+        rag_agent = await ensure_agent()
+        if not rag_agent:
+            return error("RAG Agent not initialized", 500)
+
+        data = await json_body(request)
+        if not data or 'question' not in data:
+            return error("question is required", 400)
+
+        question = data['question']
+        context = data.get('context', '')
+        session_id = get_session_id(request, data)
+
+        ingestion = None
+        if 'documents' in data:
+            ingestion = await rag_agent.aadd_documents(data['documents'], session_id)
+
+        if service.wants_stream(data, request.headers):
+            return await stream_answer(request, rag_agent.aquery_stream(question, context, session_id), data,
+                                       {"ingestion": ingestion, "sessionId": session_id})
+
+        results = await rag_agent.aquery(question, context, session_id)
+        return web.json_response({"response": results, "ingestion": ingestion, "sessionId": session_id})
+    except Exception as e:
+        logger.error(f"Error in document querying: {str(e)}")
+        logger.error(traceback.format_exc())
+        return error(f"Query failed: {str(e)}", 500)
+
+async def analyze(request):
+    """Financial, payment, validation or comprehensive analysis of document_text"""
+    path = request.match_info.route.resource.canonical
+    method, label, failure = ANALYSIS_ENDPOINTS.get(path, (None, "comprehensive analysis", "Analysis failed"))
+    try:
+        rag_agent = await ensure_agent()
+        if not rag_agent:
+            return error("RAG Agent not initialized", 500)
+
+        data = await json_body(request)
+        if not data or 'document_text' not in data:
+            return error("document_text is required", 400)
+
+        document_text = data['document_text']
+        if method:
+            results = await getattr(rag_agent, method)(document_text)
+        else:
+            results = await rag_agent.aanalyze_document(document_text, data.get('analysis_types'))
+        return web.json_response(results)
+    except Exception as e:
+        logger.error(f"Error in {label}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return error(f"{failure}: {str(e)}", 500)
+
+def ocr_file(file, file_extension):
+    with file:
+        return service.ocr_image_upload(file.read(), file_extension)
+
+async def extract_text_from_image(request):
+    """Extract text from image files using OCR"""
+    try:
+        rag_agent = await ensure_agent()
+        if not rag_agent:
+            return error("RAG Agent not initialized", 500)
+
+        _, file, file_extension = await read_upload(request)
+        if file_extension not in service.IMAGE_EXTENSIONS:
+            return error(f"Unsupported image type: {file_extension}", 400)
+        # The first call imports the OCR stack, so keep it off the event loop
+        if not await asyncio.to_thread(service.ocr_available):
+            return error("OCR processing not available (PIL or pytesseract not installed)", 500)
+
+        from ocr_engine import OCRBusyError #@UnresolvedImport
+        try:
+            extracted_text = await asyncio.to_thread(ocr_file, file.file, file_extension)
+        except OCRBusyError as e:
+            return error(str(e), 503)
+
+        if not extracted_text.strip():
+            return web.json_response({"text": "", "message": "No text found in image", "file_type": file_extension})
+
+        summary = await rag_agent.asummarize_text(extracted_text)
+        return web.json_response({
+            "text": extracted_text,
+            "summary": summary,
+            "file_type": file_extension,
+            "text_length": len(extracted_text)
+        })
+    except service.UploadError as e:
+        return error(str(e), e.status_code)
+    except Exception as e:
+        logger.error(f"Error in text extraction: {str(e)}")
+        logger.error(traceback.format_exc())
+        return error(f"Text extraction failed: {str(e)}", 500)
+
+async def read_body(request):
+    """
+    Read a request body for the Flask app into a SpooledTemporaryFile(max_size=
+    UPLOAD_SPOOL_BYTES), rejecting it with a 413 UploadError from its
+    Content-Length or as soon as it passes MAX_UPLOAD_BYTES. Returns (stream, size).
+    """
+    if request.content_length is not None and request.content_length > service.MAX_UPLOAD_BYTES:
+        raise service.UploadError(f"File too large (limit {service.MAX_UPLOAD_BYTES} bytes)", 413)
+    stream = tempfile.SpooledTemporaryFile(max_size=service.UPLOAD_SPOOL_BYTES)
+    size = 0
+    try:
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > service.MAX_UPLOAD_BYTES:
+                raise service.UploadError(f"File too large (limit {service.MAX_UPLOAD_BYTES} bytes)", 413)
+            stream.write(chunk)
+    except BaseException:
+        stream.close()
+        raise
+    stream.seek(0)
+    return stream, size
+
+def wsgi_environ(request, body, size):
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': request.path,
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': request.url.host or 'localhost',
+        'SERVER_PORT': str(request.url.port or 80),
+        'SERVER_PROTOCOL': f"HTTP/{request.version.major}.{request.version.minor}",
+        'REMOTE_ADDR': request.remote or '',
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if 'Content-Type' in request.headers:
+        environ['CONTENT_TYPE'] = request.headers['Content-Type']
+    for name, value in request.headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            continue
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def call_flask(request):
+    """
+    Serve the request with the Flask app on the WSGI pool, streaming its body as it is
+    produced. All calls for one request share a context, as on a Waitress thread.
+    """
+    try:
+        body, size = await read_body(request)
+    except service.UploadError as e:
+        return error(str(e), e.status_code)
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'], started['headers'] = int(status.split(' ', 1)[0]), headers
+
+    def run(fn, *args):
+        return loop.run_in_executor(wsgi_executor, partial(context.run, fn, *args))
+
+    try:
+        chunks = await run(service.app, wsgi_environ(request, body, size), start_response)
+        try:
+            response = web.StreamResponse(status=started['status'])
+            for name, value in started['headers']:
+                response.headers.add(name, value)
+            await response.prepare(request)
+            iterator = iter(chunks)
+            while True:
+                chunk = await run(next, iterator, None)
+                if chunk is None:
+                    break
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+        finally:
+            if hasattr(chunks, 'close'):
+                await run(chunks.close)
+    finally:
+        body.close()
+
+async def record_request(request, cassette):
+    """Record a native request in the cassette, like python_service.record_request"""
+    headers = {name: request.headers[name] for name in ('X-Session-ID', 'Accept') if name in request.headers}
+    try:
+        if request.content_type == 'multipart/form-data':
+            form, uploads = await read_form(request)
+            files = {}
+            for field, upload in uploads.items():
+                files[field] = (upload.filename, upload.file.read())
+                upload.file.seek(0)
+            cassette.record_request(request.method, request.path, headers, form=form, files=files)
+        else:
+            cassette.record_request(request.method, request.path, headers, json_body=await json_body(request))
+    except service.UploadError:
+        # The handler reports it
+        pass
+
+@web.middleware
+async def request_metrics(request, handler):
+    """Request metrics, traces and cassette recording for native endpoints (Flask hooks cover the rest)"""
+    if request.match_info.route.handler is call_flask:
+        return await handler(request)
+    endpoint = request.match_info.route.resource.canonical
+    request['started'], request['endpoint'] = time.perf_counter(), endpoint
+    metrics.REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+    trace, exc = None, None
+    try:
+        if endpoint not in service.UNTRACED_ENDPOINTS:
+            trace = request['trace'] = tracing.start_trace(
+                f"{request.method} {endpoint}", **{"http.method": request.method, "http.route": endpoint})
+            if service.rag_agent and service.rag_agent.cassette and request.method == 'POST':
+                await record_request(request, service.rag_agent.cassette)
+        response = await handler(request)
+        if trace:
+            trace.root.set(**{"http.status_code": response.status})
+        return response
+    except BaseException as e:
+        exc = e
+        raise
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+        tracing.end_trace(trace, exc)
+
+async def on_response_prepare(request, response):
+    # Like the Flask after_request hook: streams are timed until their first byte, not their end
+    if 'endpoint' not in request:
+        return
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - request['started'], endpoint=request['endpoint'],
+                                    method=request.method, status=str(response.status))
+    if request.get('trace'):
+        response.headers['X-Trace-Id'] = request['trace'].trace_id
+    origin = request.headers.get('Origin')
+    if origin and service.cors_origin in ('*', origin):
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers.add('Vary', 'Origin')
+
+async def use_worker_pool(app):
+    # asyncio.to_thread (the agent's and this module's CPU work) runs on the default executor
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="rag-async"))
+
+def build_app():
+    app = web.Application(middlewares=[request_metrics], client_max_size=service.MAX_UPLOAD_BYTES)
+    app.on_startup.append(use_worker_pool)
+    app.on_response_prepare.append(on_response_prepare)
+    app.router.add_get('/health/live', live)
+    app.router.add_post('/upload', upload_document)
+    app.router.add_post('/chat', chat_with_document)
+    app.router.add_post('/query', query_documents)
+    for path in (*ANALYSIS_ENDPOINTS, '/analyze/comprehensive'):
+        app.router.add_post(path, analyze)
+    app.router.add_post('/extract-text', extract_text_from_image)
+    # Everything else, including CORS preflights for the routes above, is answered by Flask
+    app.router.add_route('*', '/{tail:.*}', call_flask)
+    return app
+
+def run(port):
+    """Serve until interrupted"""
+    logger.info(f"Starting async Python RAG Service on port {port} "
+                f"({ASYNC_WORKERS} worker threads, {WSGI_THREADS} WSGI threads)")
+    web.run_app(build_app(), host='0.0.0.0', port=port, backlog=LISTEN_BACKLOG, access_log=None, print=None)
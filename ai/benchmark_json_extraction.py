@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for json_extractor.extract_json.
+
+Times well-formed, fenced, prose-wrapped and truncated LLM responses of
+increasing size, and compares against the old recursive-regex fallback when
+the third-party `regex` package is installed (stdlib `re` rejects `(?R)`).
+
+Usage: python benchmark_json_extraction.py [--repeat N]
+"""
+
+import argparse
+import json
+import re
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from json_extractor import SCHEMAS, extract_json
+
+try:
+    import regex  # Supports recursive patterns
+except ImportError:
+    regex = None
+
+RECURSIVE_PATTERN = r'\{(?:[^{}]|(?R))*\}'
+
+
+def make_response(size: int) -> str:
+    """A financial insights payload of roughly size characters."""
+    trends = []
+    while len(json.dumps(trends)) < size:
+        trends.append(f"Fee payment {len(trends)} received on time, note: \"brace {{ inside\" string")
+    return json.dumps({
+        "financial_metrics": {"total_paid": 1250.0, "outstanding": 0},
+        "trends": trends,
+        "risk_assessment": "low",
+        "recommendations": ["Keep paying on time"],
+        "payment_behavior": {"on_time_ratio": 1.0},
+    })
+
+
+def cases(size: int):
+    payload = make_response(size)
+    return {
+        "plain": payload,
+        "fenced": f"Here is the analysis:\n```json\n{payload}\n```\nLet me know if you need more.",
+        "prose": f"Sure! The result is {payload} as requested.",
+        "truncated": "Result: " + payload[: len(payload) // 2],
+    }
+
+
+def old_extract(text: str):
+    """The previous implementation, run with `regex` in place of `re`."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        match = regex.search(RECURSIVE_PATTERN, text, regex.DOTALL)
+        if match:
+            try:
+                return json.loads(match.group())
+            except ValueError:
+                pass
+    return {"raw_response": text}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=20, help="calls per measurement")
+    args = parser.parse_args()
+
+    try:
+        re.search(RECURSIVE_PATTERN, "{}")
+    except re.error as e:
+        print(f"stdlib re cannot run the old fallback: {e}\n")
+
+    schema = SCHEMAS["generate_financial_insights"]
+    print(f"{'size':>9} {'case':>10} {'new (ms)':>10} {'old (ms)':>10}  result")
+    for size in (1_000, 100_000, 1_000_000):
+        for name, text in cases(size).items():
+            new = timeit.timeit(lambda: extract_json(text, schema), number=args.repeat) / args.repeat * 1000
+            old = "n/a"
+            if regex is not None:
+                old = f"{timeit.timeit(lambda: old_extract(text), number=args.repeat) / args.repeat * 1000:.3f}"
+            result = extract_json(text, schema)
+            outcome = "raw_response" if "raw_response" in result else f"{len(result)} keys"
+            print(f"{len(text):>9} {name:>10} {new:>10.3f} {old:>10}  {outcome}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""
+Offline load benchmark for the RAG service.
+
+Runs python_service.app in-process behind Flask test clients, with a stub LLM
+and stub embeddings that sleep for a configurable latency instead of calling
+Gemini, so it needs no network or API key. Each scenario drives one endpoint
+at the given concurrency and reports p50/p95/p99 latency, throughput and peak
+RSS, then compares them against stored baselines (exit status 1 on a regression).
+
+With --cassette, the stubs are replaced by a recorded cassette (see cassette)
+and the recorded API requests are re-sent instead of the synthetic scenarios.
+
+With --server async, requests go over a local socket to the asyncio serving
+mode (async_service) instead of the Flask app, so --concurrency can be set to
+hundreds of clients.
+
+Usage: python benchmark_service.py [--requests N] [--concurrency C]
+           [--llm-latency-ms MS] [--embed-latency-ms MS] [--scenarios upload,chat,...]
+           [--cassette FILE [--cassette-latency-scale S]] [--server flask|async]
+           [--baseline FILE] [--save-baseline] [--tolerance 0.25] [--json]
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import math
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines.json")
+SCENARIOS = ("upload", "chat", "query", "analyze_financial", "analyze_payment", "analyze_validation",
+             "analyze_comprehensive")
+# Results recorded per scenario and compared against the baseline (metric -> higher is better)
+COMPARED_METRICS = {"p95_ms": False, "throughput_rps": True, "peak_rss_mb": False}
+
+INSIGHTS = {
+    "financial_metrics": {"total_paid": 1250.0, "outstanding": 0},
+    "trends": ["Payments received on time"],
+    "risk_assessment": "low",
+    "recommendations": ["Keep current payment schedule"],
+    "payment_behavior": {"on_time_ratio": 1.0},
+}
+VALIDATION = {
+    "is_valid": True,
+    "confidence_score": 0.9,
+    "validation_checks": {"format_check": "pass", "content_completeness": "pass"},
+    "issues_found": [],
+    "recommendations": [],
+    "document_type": "invoice",
+    "extraction_summary": {},
+}
+PAYMENT = {
+    "payment_amount": "1250.00", "payment_method": "bank transfer", "payment_date": "2024-03-15",
+    "transaction_id": "TXN-000000", "recipient": "Acme Corp", "sender": "Jane Doe", "currency": "USD",
+    "status": "completed", "description": "Invoice payment", "additional_details": {},
+}
+ANSWER = "The invoice total is USD 1,250.00, paid by bank transfer on 2024-03-15."
+
+
+def configure_environment(workdir: str) -> None:
+    """Point every on-disk cache and store at workdir before the service is imported."""
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    os.environ["RAG_EMBEDDING_BACKEND"] = "hashing"
+    os.environ["RAG_SESSION_DIR"] = os.path.join(workdir, "sessions")
+    os.environ["RAG_EMBEDDING_CACHE_DIR"] = os.path.join(workdir, "embeddings")
+    os.environ["RAG_CACHE_DB_PATH"] = ""
+    # Repeated benchmark questions would otherwise be answered from the answer cache
+    os.environ.setdefault("RAG_ANSWER_CACHE_MAX_ENTRIES", "0")
+    os.environ.pop("RAG_TRACE_DIR", None)
+
+
+def build_stubs(llm_latency_ms: float, embed_latency_ms: float, jitter: float, seed: int):
+    """Stub chat model and embeddings; imported lazily so configure_environment runs first."""
+    from langchain_core.language_models.chat_models import BaseChatModel #@UnresolvedImport
+    from langchain_core.messages import AIMessage, AIMessageChunk #@UnresolvedImport
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult #@UnresolvedImport
+    from embedding_backends import HashingEmbeddings
+
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    def pause(latency_ms: float) -> None:
+        with rng_lock:
+            factor = 1.0 + rng.uniform(-jitter, jitter)
+        time.sleep(max(0.0, latency_ms * factor) / 1000.0)
+
+    async def apause(latency_ms: float) -> None:
+        with rng_lock:
+            factor = 1.0 + rng.uniform(-jitter, jitter)
+        await asyncio.sleep(max(0.0, latency_ms * factor) / 1000.0)
+
+    def respond(prompt: str) -> str:
+        if "Analyze the following financial data" in prompt:
+            return json.dumps(INSIGHTS)
+        if "Validate the following document" in prompt:
+            return json.dumps(VALIDATION)
+        if "Extract payment details" in prompt:
+            return json.dumps(PAYMENT)
+        if "summar" in prompt.lower():
+            return "Invoice from Acme Corp to Jane Doe for USD 1,250.00, paid on 2024-03-15."
+        return ANSWER
+
+    class StubLLM(BaseChatModel):
+        """Canned responses after a simulated generation latency."""
+
+        model: str = "stub-llm"
+
+        @property
+        def _llm_type(self) -> str:
+            return "stub"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            pause(llm_latency_ms)
+            content = respond("\n".join(str(m.content) for m in messages))
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            pause(llm_latency_ms)
+            for word in respond("\n".join(str(m.content) for m in messages)).split(" "):
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            await apause(llm_latency_ms)
+            content = respond("\n".join(str(m.content) for m in messages))
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            await apause(llm_latency_ms)
+            for word in respond("\n".join(str(m.content) for m in messages)).split(" "):
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    class StubEmbeddings(HashingEmbeddings):
+        """Local hashing vectors after a simulated per-call embedding latency."""
+
+        def embed_documents(self, texts):
+            pause(embed_latency_ms)
+            return super().embed_documents(texts)
+
+        def embed_query(self, text):
+            pause(embed_latency_ms)
+            return super().embed_query(text)
+
+        async def aembed_documents(self, texts):
+            await apause(embed_latency_ms)
+            return super().embed_documents(texts)
+
+        async def aembed_query(self, text):
+            await apause(embed_latency_ms)
+            return super().embed_query(text)
+
+    return StubLLM(), StubEmbeddings()
+
+
+def make_document(n: int, size: int) -> str:
+    """A unique invoice of roughly size characters, so response caches never hit."""
+    header = (f"Invoice INV-{n:07d}\nFrom: Acme Corp\nBill to: Jane Doe\n"
+              f"Transaction ID: TXN-{n:07d}\nAmount: $1,250.00 USD\nPayment date: 2024-03-15\n"
+              f"Payment method: bank transfer\nStatus: Paid\n")
+    lines = [header]
+    line = 0
+    while sum(len(part) for part in lines) < size:
+        line += 1
+        lines.append(f"Line {line}: consulting services for project {n}-{line}, 10 hours at $12.50 per hour.\n")
+    return "".join(lines)
+
+
+QUESTIONS = [
+    "What is the total amount of the invoice?",
+    "When was the payment made?",
+    "Who issued this invoice?",
+    "Which payment method was used?",
+    "What is the transaction ID?",
+    "What services are billed on line {n}?",
+]
+
+
+class Scenario:
+    """One endpoint under load: setup() runs untimed per worker session, call(n) is timed."""
+
+    def __init__(self, name: str, args):
+        self.name = name
+        self.args = args
+
+    def document(self, n: int) -> str:
+        # Offset by scenario so one scenario's documents are never in another's response cache
+        return make_document(SCENARIOS.index(self.name) * 1_000_000 + n, self.args.doc_chars)
+
+    def session(self, worker: int) -> str:
+        return f"bench-{self.name}-{worker}"
+
+    def setup(self, client, worker: int) -> None:
+        if self.name == "chat":
+            document = self.document(500_000 + worker)
+            client.post("/upload", data={"file": (io.BytesIO(document.encode("utf-8")), "invoice.txt"),
+                                         "sessionId": self.session(worker)},
+                        content_type="multipart/form-data")
+            client.post("/chat", json={"message": "warm up", "sessionId": self.session(worker)})
+        elif self.name == "query":
+            client.post("/query", json={"question": "warm up", "sessionId": self.session(worker),
+                                        "documents": [self.document(500_000 + worker)]})
+
+    def call(self, client, n: int, worker: int):
+        question = QUESTIONS[n % len(QUESTIONS)].format(n=n)
+        if self.name == "upload":
+            document = self.document(n)
+            return client.post("/upload", data={"file": (io.BytesIO(document.encode("utf-8")), "invoice.txt"),
+                                                "sessionId": f"bench-upload-{n}"},
+                               content_type="multipart/form-data")
+        if self.name == "chat":
+            return client.post("/chat", json={"message": question, "sessionId": self.session(worker)})
+        if self.name == "query":
+            return client.post("/query", json={"question": question, "sessionId": self.session(worker)})
+        analysis = self.name.split("_", 1)[1]
+        return client.post(f"/analyze/{analysis}", json={"document_text": self.document(n)})
+
+
+class ReplayScenario(Scenario):
+    """Re-sends the API requests recorded in a cassette, in recorded order."""
+
+    def __init__(self, recorded: List[Dict[str, Any]], args):
+        super().__init__("replay", args)
+        self.recorded = recorded
+
+    def setup(self, client, worker: int) -> None:
+        pass
+
+    def call(self, client, n: int, worker: int):
+        entry = self.recorded[n % len(self.recorded)]
+        kwargs = {"method": entry["method"], "headers": entry.get("headers", {})}
+        if "json" in entry:
+            kwargs["json"] = entry["json"]
+        elif "form" in entry or "files" in entry:
+            data = dict(entry.get("form", {}))
+            for field, upload in entry.get("files", {}).items():
+                data[field] = (io.BytesIO(base64.b64decode(upload["data"])), upload["filename"])
+            kwargs["data"] = data
+            kwargs["content_type"] = "multipart/form-data"
+        return client.open(entry["path"], **kwargs)
+
+
+class AsyncServiceClient:
+    """
+    Sends the Flask test client calls the scenarios make to async_service over a
+    local socket. The service and the HTTP client each run their own event loop
+    thread; calls block the calling benchmark thread until the response is read.
+    """
+
+    def __init__(self):
+        import async_service
+        self.server_loop = self._start_loop("bench-server")
+        self.client_loop = self._start_loop("bench-client")
+        self.port = self._call(self.server_loop, self._serve(async_service.build_app()))
+        self.session = self._call(self.client_loop, self._open_session())
+
+    @staticmethod
+    def _start_loop(name: str) -> asyncio.AbstractEventLoop:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name=name, daemon=True).start()
+        return loop
+
+    @staticmethod
+    def _call(loop, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def _serve(self, app) -> int:
+        from aiohttp import web
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        await web.TCPSite(self.runner, "127.0.0.1", port, backlog=1024).start()
+        return port
+
+    async def _open_session(self):
+        import aiohttp
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+
+    async def _send(self, path, method, headers, json_body, data):
+        import aiohttp
+        body = None
+        if data is not None:
+            body = aiohttp.FormData()
+            for field, value in data.items():
+                if isinstance(value, tuple):
+                    stream, filename = value
+                    body.add_field(field, stream.read(), filename=filename)
+                else:
+                    body.add_field(field, value)
+        async with self.session.request(method, f"http://127.0.0.1:{self.port}{path}", headers=headers,
+                                        json=json_body, data=body) as response:
+            return BenchResponse(response.status, await response.read())
+
+    def open(self, path, method="GET", headers=None, json=None, data=None, content_type=None):
+        return self._call(self.client_loop, self._send(path, method, headers, json, data))
+
+    def post(self, path, **kwargs):
+        return self.open(path, method="POST", **kwargs)
+
+    def close(self) -> None:
+        self._call(self.client_loop, self.session.close())
+        self._call(self.server_loop, self.runner.cleanup())
+
+
+class BenchResponse:
+    """The parts of a Flask test response that run_scenario reads."""
+
+    def __init__(self, status_code: int, data: bytes):
+        self.status_code = status_code
+        self.data = data
+
+    def get_data(self) -> bytes:
+        return self.data
+
+    def close(self) -> None:
+        pass
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_scenario(make_client, scenario: Scenario, requests: int, concurrency: int) -> Dict[str, Any]:
+    clients = [make_client() for _ in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(scenario.setup, clients, range(concurrency)))
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(index: int) -> None:
+        nonlocal errors
+        client = clients[index]
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            start = time.perf_counter()
+            try:
+                response = scenario.call(client, n, index)
+                # Streamed answers are only complete once read
+                response.get_data()
+                response.close()
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of results against baseline beyond the relative tolerance."""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get("results", {}).get(name)
+        if not expected:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in expected or not expected[metric]:
+                continue
+            ratio = result[metric] / expected[metric]
+            if (higher_is_better and ratio < 1 - tolerance) or (not higher_is_better and ratio > 1 + tolerance):
+                regressions.append(f"{name}: {metric} {result[metric]} vs baseline {expected[metric]} ({ratio - 1:+.0%})")
+    return regressions
+
+
+def failures(results: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Failed requests and cassette misses, reported with or without a baseline."""
+    problems = []
+    for name, result in results.items():
+        if result["errors"]:
+            problems.append(f"{name}: {result['errors']} failed requests")
+        if result.get("cassette_misses"):
+            problems.append(f"{name}: {result['cassette_misses']} calls missing from the cassette")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=None,
+                        help="timed requests per scenario (default 100, or every recorded request with --cassette)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="simulated LLM call latency")
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0, help="simulated embedding call latency")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative +/- jitter on simulated latencies")
+    parser.add_argument("--doc-chars", type=int, default=3000, help="size of generated documents")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of scenarios")
+    parser.add_argument("--cassette", help="replay this recorded cassette instead of the stubs")
+    parser.add_argument("--cassette-latency-scale", type=float, default=1.0,
+                        help="multiplier on recorded latencies (0 replays without delays)")
+    parser.add_argument("--server", choices=("flask", "async"), default="flask",
+                        help="serve with the Flask app (threads) or async_service (event loop)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--seed", type=int, default=0, help="seed for latency jitter")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix="rag_benchmark_")
+    configure_environment(workdir)
+    if args.cassette:
+        os.environ["RAG_CASSETTE_MODE"] = "replay"
+        os.environ["RAG_CASSETTE_PATH"] = args.cassette
+        os.environ["RAG_CASSETTE_LATENCY_SCALE"] = str(args.cassette_latency_scale)
+    import logging
+    import python_service
+    from rag_agent import RAGAgent
+    logging.getLogger().setLevel(logging.WARNING)
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    agent = RAGAgent(api_key=os.environ["GOOGLE_API_KEY"])
+    python_service.rag_agent = agent
+    if args.cassette:
+        if not agent.cassette.requests:
+            parser.error(f"{args.cassette} contains no recorded requests")
+        runs = [ReplayScenario(agent.cassette.requests, args)]
+        args.requests = args.requests or len(agent.cassette.requests)
+        config = {key: getattr(args, key) for key in
+                  ("requests", "concurrency", "server", "cassette", "cassette_latency_scale")}
+    else:
+        llm, embeddings = build_stubs(args.llm_latency_ms, args.embed_latency_ms, args.jitter, args.seed)
+        agent.llm = llm
+        agent.embeddings.embeddings = embeddings
+        runs = [Scenario(name, args) for name in scenarios]
+        args.requests = args.requests or 100
+        config = {key: getattr(args, key) for key in
+                  ("requests", "concurrency", "server", "llm_latency_ms", "embed_latency_ms", "jitter", "doc_chars")}
+
+    if args.server == "async":
+        async_client = AsyncServiceClient()
+        make_client = lambda: async_client
+    else:
+        make_client = python_service.app.test_client
+
+    results = {}
+    for scenario in runs:
+        name = scenario.name
+        results[name] = run_scenario(make_client, scenario, args.requests, args.concurrency)
+        if agent.cassette:
+            results[name]["cassette_misses"] = agent.cassette.stats()["misses"]
+        if not args.json:
+            result = results[name]
+            if len(results) == 1:
+                print(f"{'scenario':<22} {'reqs':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+                      f"{'req/s':>8} {'rss MB':>8}")
+            print(f"{name:<22} {result['requests']:>5} {result['errors']:>4} {result['p50_ms']:>9.1f} "
+                  f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['throughput_rps']:>8.1f} "
+                  f"{result['peak_rss_mb']:>8.1f}")
+
+    if args.server == "async":
+        async_client.close()
+
+    regressions = failures(results)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"Baseline was recorded with {baseline.get('config')}; not comparing", file=sys.stderr)
+        else:
+            regressions += compare(results, baseline, args.tolerance)
+
+    if args.json:
+        print(json.dumps({"config": config, "results": results, "regressions": regressions}, indent=2))
+    else:
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if args.save_baseline:
+            print(f"Baseline written to {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
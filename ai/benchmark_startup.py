@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the RAG service.
+
+Starts python_service.py in a fresh interpreter on a free port and measures:
+
+- import: time to import python_service (in a separate interpreter)
+- live: time until GET /health/live answers
+- ready: time until GET /health/ready answers 200
+- first request: latency of the first /analyze/payment call after readiness
+  (payment details resolved locally, so no Gemini call is made)
+
+Each run uses fresh session and embedding cache directories. With
+--no-warmup the service is started with RAG_WARMUP=0, so the first request
+also pays for initializing the agent. Needs no network; a placeholder
+GOOGLE_API_KEY is used when none is set.
+
+Usage: python benchmark_startup.py [--runs N] [--no-warmup] [--timeout S] [--json]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE = os.path.join(HERE, "python_service.py")
+SAMPLE_INVOICE = ("Invoice INV-1001\nTransaction ID: TXN-1001\nAmount: $1,250.00 USD\n"
+                  "Payment date: 2024-03-15\nStatus: Paid\n")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def child_env(workdir: str, port: int, warmup: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    env.update({
+        "PORT": str(port),
+        "RAG_WARMUP": "1" if warmup else "0",
+        "RAG_SESSION_DIR": os.path.join(workdir, "sessions"),
+        "RAG_EMBEDDING_CACHE_DIR": os.path.join(workdir, "embeddings"),
+        "RAG_CACHE_DB_PATH": "",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+
+def status(url: str, data: Optional[bytes] = None) -> Optional[int]:
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def wait_for(url: str, wanted: int, started: float, deadline: float) -> float:
+    """Poll url until it answers with the wanted status; seconds since started."""
+    while time.perf_counter() < deadline:
+        if status(url) == wanted:
+            return time.perf_counter() - started
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} did not answer {wanted} in time")
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    code = ("import sys, time; sys.path.insert(0, %r); t = time.perf_counter(); "
+            "import python_service; print(time.perf_counter() - t)" % HERE)
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=HERE, capture_output=True,
+                            text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_run(warmup: bool, timeout: float) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory(prefix="rag_startup_") as workdir:
+        port = free_port()
+        env = child_env(workdir, port, warmup)
+        result = {"import_s": measure_import(env)}
+        base = f"http://127.0.0.1:{port}"
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, SERVICE], env=env, cwd=HERE,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = started + timeout
+            result["live_s"] = wait_for(f"{base}/health/live", 200, started, deadline)
+            result["ready_s"] = wait_for(f"{base}/health/ready", 200, started, deadline)
+            body = json.dumps({"document_text": SAMPLE_INVOICE}).encode("utf-8")
+            request_started = time.perf_counter()
+            code = status(f"{base}/analyze/payment", body)
+            result["first_request_s"] = time.perf_counter() - request_started
+            if code != 200:
+                raise RuntimeError(f"/analyze/payment answered {code}")
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        return result
+
+
+def summarize(runs: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        metric: {
+            "median_ms": round(statistics.median(run[metric] for run in runs) * 1000, 1),
+            "min_ms": round(min(run[metric] for run in runs) * 1000, 1),
+            "max_ms": round(max(run[metric] for run in runs) * 1000, 1),
+        }
+        for metric in runs[0]
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3, help="service starts to measure")
+    parser.add_argument("--no-warmup", action="store_true", help="start with RAG_WARMUP=0 (lazy initialization)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for readiness per run")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    runs = [measure_run(not args.no_warmup, args.timeout) for _ in range(args.runs)]
+    summary = summarize(runs)
+    if args.json:
+        print(json.dumps({"warmup": not args.no_warmup, "runs": args.runs, "results": summary}, indent=2))
+        return 0
+    print(f"{'metric':<18} {'median ms':>10} {'min ms':>10} {'max ms':>10}   (warm-up {'off' if args.no_warmup else 'on'})")
+    for metric, values in summary.items():
+        print(f"{metric[:-2]:<18} {values['median_ms']:>10.1f} {values['min_ms']:>10.1f} {values['max_ms']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
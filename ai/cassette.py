@@ -0,0 +1,347 @@
+"""
+Record/replay of LLM and embedding calls.
+
+With RAG_CASSETTE_MODE=record, RAGAgent's chat model and embedding backend are
+wrapped so every call is appended to a gzip-compressed JSON Lines cassette
+(RAG_CASSETTE_PATH) with the prompt, the response and the observed latency.
+Embedding vectors are stored as base64 float32. python_service also records
+the incoming API requests, so a traffic sample can be re-sent later
+(benchmark_service.py --cassette).
+
+With RAG_CASSETTE_MODE=replay, calls are answered from the cassette and never
+reach Gemini. Each response is delayed by its recorded latency multiplied by
+RAG_CASSETTE_LATENCY_SCALE (1 = as recorded, 0 = no delay). A call missing
+from the cassette raises CassetteMissError.
+"""
+
+import asyncio
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings #@UnresolvedImport
+from langchain_core.language_models.chat_models import BaseChatModel #@UnresolvedImport
+from langchain_core.messages import AIMessage, AIMessageChunk #@UnresolvedImport
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult #@UnresolvedImport
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ("off", "record", "replay")
+CASSETTE_VERSION = 1
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode for a call that was not recorded."""
+
+
+def _key(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def _messages_text(messages) -> str:
+    return "\n".join(f"{message.type}: {message.content}" for message in messages)
+
+
+def _encode_vector(vector: List[float]) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(data: str) -> List[float]:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).tolist()
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "replay", latency_scale: float = 1.0, record_requests: bool = True):
+        if mode not in CASSETTE_MODES[1:]:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.record_requests = record_requests and mode == "record"
+        self.requests = []  # API requests loaded for replay, in arrival order
+        self.recorded = 0
+        self.recorded_requests = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = defaultdict(deque)  # key -> recorded responses, replayed round-robin
+        self._lock = threading.Lock()
+        self._file = None
+        if mode == "replay":
+            self._load()
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._file = gzip.open(path, "at", encoding="utf-8")
+            self._write({"type": "header", "version": CASSETTE_VERSION, "created": datetime.now().isoformat()})
+            atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        """Build a cassette from RAG_CASSETTE_* environment variables; None when the mode is off."""
+        mode = os.getenv("RAG_CASSETTE_MODE", "off").lower()
+        if mode == "off":
+            return None
+        path = os.getenv("RAG_CASSETTE_PATH", os.path.join(tempfile.gettempdir(), "rag_cassette.jsonl.gz"))
+        logger.info(f"Cassette {mode} mode using {path}")
+        return cls(
+            path,
+            mode=mode,
+            latency_scale=float(os.getenv("RAG_CASSETTE_LATENCY_SCALE", 1.0)),
+            record_requests=os.getenv("RAG_CASSETTE_RECORD_REQUESTS", "1") != "0",
+        )
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["type"] == "request":
+                    self.requests.append(entry)
+                elif entry["type"] in ("llm", "embedding"):
+                    self._entries[entry["key"]].append(entry)
+        logger.info(f"Loaded {sum(len(v) for v in self._entries.values())} calls and "
+                    f"{len(self.requests)} requests from cassette {self.path}")
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            # Flushed per entry so a cassette stays readable if the process dies
+            self._file.flush()
+            if entry["type"] == "request":
+                self.recorded_requests += 1
+            elif entry["type"] != "header":
+                self.recorded += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        self._write(entry)
+
+    def replay(self, key: str, description: str) -> Dict[str, Any]:
+        """Next recorded response for key; repeated calls cycle through its recordings."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise CassetteMissError(f"No recorded response for {description} ({key})")
+            self.hits += 1
+            entry = entries[0]
+            entries.rotate(-1)
+        return entry
+
+    def delay(self, latency_ms: float) -> None:
+        if self.latency_scale > 0 and latency_ms > 0:
+            time.sleep(latency_ms * self.latency_scale / 1000.0)
+
+    async def adelay(self, latency_ms: float) -> None:
+        if self.latency_scale > 0 and latency_ms > 0:
+            await asyncio.sleep(latency_ms * self.latency_scale / 1000.0)
+
+    def record_request(self, method: str, path: str, headers: Dict[str, str], json_body: Any = None,
+                       form: Optional[Dict[str, str]] = None, files: Optional[Dict[str, Any]] = None) -> None:
+        """Record an API request; files maps field name to (filename, bytes)."""
+        if not self.record_requests:
+            return
+        entry = {"type": "request", "method": method, "path": path, "headers": headers}
+        if json_body is not None:
+            entry["json"] = json_body
+        if form:
+            entry["form"] = form
+        if files:
+            entry["files"] = {field: {"filename": filename, "data": base64.b64encode(data).decode("ascii")}
+                              for field, (filename, data) in files.items()}
+        self._write(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path,
+                "recorded": self.recorded,
+                "hits": self.hits,
+                "misses": self.misses,
+                "requests": self.recorded_requests if self.mode == "record" else len(self.requests),
+            }
+
+    def wrap_llm(self, llm) -> "CassetteLLM":
+        return CassetteLLM(inner=llm, cassette=self, model=getattr(llm, "model", "unknown"))
+
+    def wrap_embeddings(self, embeddings: Embeddings) -> "CassetteEmbeddings":
+        return CassetteEmbeddings(embeddings, self)
+
+
+class CassetteLLM(BaseChatModel):
+    """Chat model that records the wrapped model's responses or replays them from a cassette."""
+
+    inner: Any
+    cassette: Any
+    model: str
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cassette-{self.cassette.mode}"
+
+    def _key(self, messages) -> str:
+        return _key("llm", self.model, _messages_text(messages))
+
+    def _record(self, key: str, messages, content: str, start: float, **extra) -> None:
+        self.cassette.record({
+            "type": "llm", "key": key, "model": self.model, "prompt": _messages_text(messages),
+            "content": content, "latency_ms": round((time.perf_counter() - start) * 1000, 1), **extra,
+        })
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self._key(messages)
+        if self.cassette.mode == "replay":
+            entry = self.cassette.replay(key, "LLM prompt")
+            self.cassette.delay(entry["latency_ms"])
+            content = entry["content"]
+        else:
+            start = time.perf_counter()
+            content = self.inner.invoke(messages, stop=stop, **kwargs).content
+            self._record(key, messages, content, start)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self._key(messages)
+        if self.cassette.mode == "replay":
+            entry = self.cassette.replay(key, "LLM prompt")
+            await self.cassette.adelay(entry["latency_ms"])
+            content = entry["content"]
+        else:
+            start = time.perf_counter()
+            content = (await self.inner.ainvoke(messages, stop=stop, **kwargs)).content
+            self._record(key, messages, content, start)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    @staticmethod
+    def _replay_timing(entry: Dict[str, Any]):
+        """Recorded chunks, the delay before the first and the delay before each later one."""
+        chunks = entry.get("chunks") or [entry["content"]]
+        first_token_ms = entry.get("first_token_ms", entry["latency_ms"])
+        # The rest of the recorded latency is spread over the remaining chunks
+        per_chunk_ms = (entry["latency_ms"] - first_token_ms) / max(1, len(chunks) - 1)
+        return chunks, first_token_ms, per_chunk_ms
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        key = self._key(messages)
+        if self.cassette.mode == "replay":
+            chunks, first_token_ms, per_chunk_ms = self._replay_timing(self.cassette.replay(key, "LLM prompt"))
+            self.cassette.delay(first_token_ms)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    self.cassette.delay(per_chunk_ms)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+            return
+
+        start = time.perf_counter()
+        chunks, first_token_ms = [], None
+        for chunk in self.inner.stream(messages, stop=stop, **kwargs):
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - start) * 1000, 1)
+            chunks.append(chunk.content)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk.content))
+        self._record(key, messages, "".join(chunks), start, chunks=chunks, first_token_ms=first_token_ms or 0.0)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._key(messages)
+        if self.cassette.mode == "replay":
+            chunks, first_token_ms, per_chunk_ms = self._replay_timing(self.cassette.replay(key, "LLM prompt"))
+            await self.cassette.adelay(first_token_ms)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await self.cassette.adelay(per_chunk_ms)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+            return
+
+        start = time.perf_counter()
+        chunks, first_token_ms = [], None
+        async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - start) * 1000, 1)
+            chunks.append(chunk.content)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk.content))
+        self._record(key, messages, "".join(chunks), start, chunks=chunks, first_token_ms=first_token_ms or 0.0)
+
+
+class CassetteEmbeddings(Embeddings):
+    """
+    Embeddings that record the wrapped backend's vectors or replay them. Vectors
+    are recorded per text, so replay works however the texts are batched; a
+    batch's latency is split evenly across its texts.
+    """
+
+    def __init__(self, embeddings: Optional[Embeddings], cassette: Cassette):
+        self.embeddings = embeddings
+        self.cassette = cassette
+
+    def _replay_entries(self, task: str, texts: List[str]) -> List[Dict[str, Any]]:
+        return [self.cassette.replay(_key("embedding", task, text), f"{task} embedding") for text in texts]
+
+    def _replay(self, task: str, texts: List[str]) -> List[List[float]]:
+        entries = self._replay_entries(task, texts)
+        self.cassette.delay(sum(entry["latency_ms"] for entry in entries))
+        return [_decode_vector(entry["vector"]) for entry in entries]
+
+    async def _areplay(self, task: str, texts: List[str]) -> List[List[float]]:
+        entries = self._replay_entries(task, texts)
+        await self.cassette.adelay(sum(entry["latency_ms"] for entry in entries))
+        return [_decode_vector(entry["vector"]) for entry in entries]
+
+    def _record(self, task: str, texts: List[str], vectors: List[List[float]], elapsed_ms: float) -> None:
+        per_text_ms = round(elapsed_ms / max(1, len(texts)), 2)
+        for text, vector in zip(texts, vectors):
+            self.cassette.record({
+                "type": "embedding", "key": _key("embedding", task, text), "task": task,
+                "vector": _encode_vector(vector), "latency_ms": per_text_ms,
+            })
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cassette.mode == "replay":
+            return self._replay("document", texts)
+        start = time.perf_counter()
+        vectors = self.embeddings.embed_documents(texts)
+        self._record("document", texts, vectors, (time.perf_counter() - start) * 1000)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.cassette.mode == "replay":
+            return self._replay("query", [text])[0]
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        self._record("query", [text], [vector], (time.perf_counter() - start) * 1000)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cassette.mode == "replay":
+            return await self._areplay("document", texts)
+        start = time.perf_counter()
+        vectors = await self.embeddings.aembed_documents(texts)
+        self._record("document", texts, vectors, (time.perf_counter() - start) * 1000)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.cassette.mode == "replay":
+            return (await self._areplay("query", [text]))[0]
+        start = time.perf_counter()
+        vector = await self.embeddings.aembed_query(text)
+        self._record("query", [text], [vector], (time.perf_counter() - start) * 1000)
+        return vector
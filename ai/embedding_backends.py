@@ -0,0 +1,168 @@
+"""
+Embedding backends for RAGAgent.
+
+RAG_EMBEDDING_BACKEND selects how chunks and questions are embedded:
+
+- google (default): Gemini text-embedding-004 over the network
+- hashing: a local NumPy feature-hashing projection of word unigrams and
+  bigrams; needs no model, network or API quota
+- local: a sentence-transformers model stored on disk (RAG_EMBEDDING_MODEL_PATH)
+
+Also provides VectorMatrix, the NumPy brute-force stand-in for a faiss index
+that small sessions use instead of building one.
+"""
+
+import logging
+import math
+import os
+import re
+import zlib
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings #@UnresolvedImport
+from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings #@UnresolvedImport
+
+try:
+    from sentence_transformers import SentenceTransformer  # For locally stored embedding models
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_EMBEDDING_MODEL = "models/text-embedding-004"
+# Sessions with at most this many vectors keep a NumPy VectorMatrix instead of a faiss index
+BRUTE_FORCE_MAX_VECTORS = int(os.getenv("RAG_BRUTE_FORCE_MAX_VECTORS", 2048))
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Stateless CPU embeddings: word unigrams and bigrams are hashed into dim
+    signed buckets, weighted by sublinear term frequency and L2-normalized.
+    Vectors never depend on the corpus, so cached vectors stay valid forever.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        words = _WORD_RE.findall(text.lower())
+        features = Counter(words)
+        features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in features.items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.dim] += sign * (1.0 + math.log(count))
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class LocalModelEmbeddings(Embeddings):
+    """Embeddings from a sentence-transformers model loaded from a local path."""
+
+    def __init__(self, model_path: str, batch_size: int = 32):
+        if SentenceTransformer is None:
+            raise RuntimeError("Local embedding backend not available (sentence-transformers not installed)")
+        self.model = SentenceTransformer(model_path, device="cpu")
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.encode([text], normalize_embeddings=True)[0].tolist()
+
+
+def build_embeddings(api_key: str) -> Tuple[Embeddings, str]:
+    """
+    Build the backend selected by RAG_EMBEDDING_BACKEND. Returns the embeddings
+    and the model name used to key the embedding cache.
+    """
+    backend = os.getenv("RAG_EMBEDDING_BACKEND", "google").lower()
+    if backend == "hashing":
+        dim = int(os.getenv("RAG_HASHING_DIM", 512))
+        logger.info(f"Using local hashing embeddings ({dim} dimensions)")
+        return HashingEmbeddings(dim), f"hashing-{dim}"
+    if backend == "local":
+        model_path = os.getenv("RAG_EMBEDDING_MODEL_PATH")
+        if not model_path:
+            raise ValueError("RAG_EMBEDDING_MODEL_PATH is required for the local embedding backend")
+        logger.info(f"Using local embedding model at {model_path}")
+        return LocalModelEmbeddings(model_path), f"local-{os.path.basename(os.path.normpath(model_path))}"
+    if backend != "google":
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    return GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL, google_api_key=api_key), GOOGLE_EMBEDDING_MODEL
+
+
+def exact_search(matrix: np.ndarray, query: np.ndarray, k: int, norms: np.ndarray = None) -> np.ndarray:
+    """
+    Row indices of the k rows of matrix nearest to query by L2 distance, nearest
+    first. norms are the rows' squared lengths when the caller already has them.
+    """
+    k = min(k, matrix.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if norms is None:
+        norms = np.einsum("ij,ij->i", matrix, matrix)
+    distances = norms - 2.0 * (matrix @ query)
+    nearest = np.argpartition(distances, k - 1)[:k]
+    return nearest[np.argsort(distances[nearest])]
+
+
+class VectorMatrix:
+    """
+    Exact NumPy search behind the subset of the faiss index interface that
+    LangChain's FAISS store and HybridRetriever use (add, search, reconstruct,
+    ntotal, d), so small sessions never build a faiss index.
+    """
+
+    def __init__(self, matrix: np.ndarray = None):
+        self.matrix = matrix
+
+    @property
+    def ntotal(self) -> int:
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    @property
+    def d(self) -> int:
+        return 0 if self.matrix is None else self.matrix.shape[1]
+
+    def add(self, vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        # Always a new array, so a memory-mapped matrix is never written to
+        self.matrix = vectors.copy() if self.matrix is None else np.concatenate([self.matrix, vectors])
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """faiss-style (distances, positions) of shape (len(queries), k), padded with -1."""
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.matrix is None:
+            return distances, positions
+        norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        for row, query in enumerate(np.asarray(queries, dtype=np.float32)):
+            nearest = exact_search(self.matrix, query, k, norms)
+            positions[row, :len(nearest)] = nearest
+            distances[row, :len(nearest)] = norms[nearest] - 2.0 * (self.matrix[nearest] @ query) + query @ query
+        return distances, positions
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        return np.array(self.matrix[position])
+
+    def to_faiss(self):
+        """A faiss flat L2 index holding the same vectors, for sessions that outgrow brute force."""
+        import faiss #@UnresolvedImport
+        index = faiss.IndexFlatL2(self.d)
+        index.add(np.ascontiguousarray(self.matrix))
+        return index
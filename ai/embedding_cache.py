@@ -0,0 +1,247 @@
+"""
+Persistent chunk-level embedding cache.
+
+Vectors are appended to a raw float32 matrix file that is read back through a
+NumPy memory map; a companion index file lists the chunk hash stored in each
+row. One pair of files is kept per embedding model, so the cache key is
+effectively (embedding model, chunk hash).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings #@UnresolvedImport
+
+from metrics import stage_timer
+
+try:
+    import fcntl  # Serialises appends between processes sharing the cache directory
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_SIZE = 256
+# A SHA-256 hex digest plus newline; index lines are fixed width so the row count follows from the file size
+_LINE_BYTES = 65
+
+
+def chunk_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of a chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model: str):
+        """
+        Open (or create) the cache files for model inside cache_dir.
+
+        <model>.idx holds a "dim=<n>" header followed by one chunk hash per line;
+        <model>.f32 holds the matching rows as native float32. Several processes
+        may share the files; appends are serialised by a lock on <model>.lock.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.index_path = os.path.join(cache_dir, f"{name}.idx")
+        self.matrix_path = os.path.join(cache_dir, f"{name}.f32")
+        self.lock_path = os.path.join(cache_dir, f"{name}.lock")
+        self.dim = None
+        self._rows = {}
+        self._end = 0  # rows this process may map: one past the highest row it knows
+        self._matrix = None
+        self._lock = threading.Lock()
+        with self._lock, self._file_lock():
+            self._load()
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        """Read the index, first trimming both files to their common length. Callers hold both locks."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="ascii") as f:
+            header = f.readline().strip()
+            if not header.startswith("dim="):
+                logger.warning(f"Ignoring malformed embedding cache index {self.index_path}")
+                return
+            self.dim = int(header[4:])
+            body = f.read()
+        hashes = [body[i:i + _LINE_BYTES - 1] for i in range(0, len(body) - _LINE_BYTES + 1, _LINE_BYTES)]
+
+        # A crash between the two appends leaves the matrix longer than the index
+        rows = self._sync_files()
+        hashes = hashes[:rows]
+        self._rows = {h: i for i, h in enumerate(hashes)}
+        self._end = len(hashes)
+        logger.info(f"Loaded {len(self._rows)} cached embeddings from {self.matrix_path}")
+
+    def _sync_files(self) -> int:
+        """
+        Truncate the matrix and the index to the rows both of them hold and return
+        that count, so the next append lands on the same row in each file.
+        Callers hold both locks.
+        """
+        header_bytes = len(f"dim={self.dim}\n")
+        index_rows = (os.path.getsize(self.index_path) - header_bytes) // _LINE_BYTES
+        matrix_bytes = os.path.getsize(self.matrix_path) if os.path.exists(self.matrix_path) else 0
+        rows = min(index_rows, matrix_bytes // (self.dim * 4))
+        if matrix_bytes != rows * self.dim * 4:
+            os.truncate(self.matrix_path, rows * self.dim * 4)
+        if index_rows != rows or os.path.getsize(self.index_path) != header_bytes + rows * _LINE_BYTES:
+            os.truncate(self.index_path, header_bytes + rows * _LINE_BYTES)
+        return rows
+
+    def _map(self) -> np.ndarray:
+        """Return a read-only memory map covering every row this process knows."""
+        if self._matrix is None or self._matrix.shape[0] < self._end:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(self._end, self.dim))
+        return self._matrix
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def lookup(self, hashes: List[str]) -> List:
+        """Return a memory-mapped row view for each hash, or None where the hash is unknown."""
+        with self._lock:
+            if not self._rows:
+                return [None] * len(hashes)
+            matrix = self._map()
+            return [matrix[self._rows[h]] if h in self._rows else None for h in hashes]
+
+    def store(self, hashes: List[str], vectors: List[List[float]]) -> None:
+        """Append new vectors, skipping hashes that are already stored."""
+        if not hashes:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            if self.dim is None:
+                # Another process may have created the files since this one opened them
+                self._load()
+            if self.dim is None:
+                self.dim = array.shape[1]
+                with open(self.index_path, "w", encoding="ascii") as f:
+                    f.write(f"dim={self.dim}\n")
+            elif array.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {array.shape[1]} does not match cache dimension {self.dim}")
+
+            new_rows, new_hashes = [], []
+            for h, row in zip(hashes, array):
+                if h not in self._rows and h not in new_hashes:
+                    new_rows.append(row)
+                    new_hashes.append(h)
+            if not new_hashes:
+                return
+
+            # Other processes append too: the new rows start at the files' real end
+            start = self._sync_files()
+            with open(self.matrix_path, "ab") as f:
+                np.vstack(new_rows).astype(np.float32, copy=False).tofile(f)
+            with open(self.index_path, "a", encoding="ascii") as f:
+                f.write("".join(f"{h}\n" for h in new_hashes))
+            for offset, h in enumerate(new_hashes):
+                self._rows[h] = start + offset
+            self._end = start + len(new_hashes)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends chunks missing from the EmbeddingCache to the backend."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        # Recent query embeddings, so a question embedded for the answer cache is not sent twice
+        self._queries = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, serving cached chunks as memory-mapped row views.
+        Only the chunks never seen before are sent to the wrapped backend.
+        """
+        vectors, missing = self._lookup(texts)
+        if missing:
+            missing_hashes = list(missing)
+            with stage_timer("embedding", texts=len(missing_hashes), cached=len(texts) - len(missing_hashes)):
+                fresh = self.embeddings.embed_documents([texts[missing[h][0]] for h in missing_hashes])
+            self._fill(vectors, missing, fresh)
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """embed_documents through the wrapped backend's async API."""
+        vectors, missing = self._lookup(texts)
+        if missing:
+            missing_hashes = list(missing)
+            with stage_timer("embedding", texts=len(missing_hashes), cached=len(texts) - len(missing_hashes)):
+                fresh = await self.embeddings.aembed_documents([texts[missing[h][0]] for h in missing_hashes])
+            self._fill(vectors, missing, fresh)
+        return vectors
+
+    def _lookup(self, texts: List[str]):
+        """Cached vectors for texts (None where missing) and missing hash -> positions in texts."""
+        hashes = [chunk_hash(t) for t in texts]
+        vectors = self.cache.lookup(hashes)
+
+        missing = {}
+        for i, (h, vector) in enumerate(zip(hashes, vectors)):
+            if vector is None:
+                missing.setdefault(h, []).append(i)
+        with self._stats_lock:
+            self.hits += len(texts) - sum(len(v) for v in missing.values())
+            self.misses += len(missing)
+        return vectors, missing
+
+    def _fill(self, vectors: List, missing, fresh: List[List[float]]) -> None:
+        """Store freshly embedded vectors and put them in place of the missing ones."""
+        self.cache.store(list(missing), fresh)
+        for h, vector in zip(missing, fresh):
+            for i in missing[h]:
+                vectors[i] = vector
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._cached_query(text)
+        if vector is None:
+            with stage_timer("embedding", texts=1):
+                vector = self.embeddings.embed_query(text)
+            self._remember_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._cached_query(text)
+        if vector is None:
+            with stage_timer("embedding", texts=1):
+                vector = await self.embeddings.aembed_query(text)
+            self._remember_query(text, vector)
+        return vector
+
+    def _cached_query(self, text: str):
+        with self._queries_lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+            return vector
+
+    def _remember_query(self, text: str, vector: List[float]) -> None:
+        with self._queries_lock:
+            self._queries[text] = vector
+            while len(self._queries) > QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
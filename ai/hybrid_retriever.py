@@ -0,0 +1,188 @@
+"""
+Hybrid lexical + vector retrieval for session knowledge bases.
+
+A BM25 inverted index is kept next to each session's FAISS store. Queries are
+scored lexically first; short keyword questions ("transaction ID", "due date")
+whose terms are all found in the best chunk are answered from BM25 alone,
+skipping the query embedding call. Other queries fuse the BM25 and FAISS
+rankings with reciprocal rank fusion.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun #@UnresolvedImport
+from langchain_core.documents import Document #@UnresolvedImport
+from langchain_core.retrievers import BaseRetriever #@UnresolvedImport
+from pydantic import ConfigDict, PrivateAttr
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# "hybrid" (lexical-only when confident, fused otherwise), "vector" or "lexical"
+RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid").lower()
+# Lexical-only answers need a query of at most this many terms ...
+LEXICAL_MAX_TERMS = int(os.getenv("RAG_LEXICAL_MAX_TERMS", 4))
+# ... and at least this fraction of them present in the top chunk
+LEXICAL_MIN_COVERAGE = float(os.getenv("RAG_LEXICAL_MIN_COVERAGE", 1.0))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_STOPWORDS = frozenset("""
+    a an and are as at be by did do does for from give how i in is it its me my of on or
+    please show tell that the this to was were what when where which who with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms without stopwords; compound IDs like txn-123 also yield their parts."""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-_./]", token) if part and part not in _STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """Incremental Okapi BM25 index over docstore IDs."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []  # position -> docstore id
+        self.doc_lengths = []
+        self.total_length = 0
+        self.postings = {}  # term -> {position: term frequency}
+
+    @classmethod
+    def from_vector_store(cls, vector_store) -> "BM25Index":
+        """Build an index over every chunk already in a FAISS store's docstore."""
+        index = cls()
+        doc_ids = list(vector_store.index_to_docstore_id.values())
+        index.add(doc_ids, [vector_store.docstore.search(doc_id).page_content for doc_id in doc_ids])
+        return index
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def add(self, doc_ids: List[str], texts: List[str]) -> None:
+        for doc_id, text in zip(doc_ids, texts):
+            terms = tokenize(text)
+            position = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, {})[position] = frequency
+
+    def search(self, query: str, k: int) -> Tuple[List[Tuple[str, float]], int, float]:
+        """
+        Return (top k (doc_id, score) pairs, number of query terms, fraction of
+        query terms present in the top result).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.doc_ids:
+            return [], len(terms), 0.0
+
+        count = len(self.doc_ids)
+        average_length = self.total_length / count or 1.0
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / average_length)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+                matched[position] += 1
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        coverage = matched[ranked[0][0]] / len(terms) if ranked else 0.0
+        return [(self.doc_ids[position], score) for position, score in ranked], len(terms), coverage
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever fusing a session's BM25 index with its FAISS store."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: Any
+    bm25: BM25Index
+    k: int = 4
+    fetch_k: int = 20
+    mode: str = RETRIEVAL_MODE
+    lexical_max_terms: int = LEXICAL_MAX_TERMS
+    lexical_min_coverage: float = LEXICAL_MIN_COVERAGE
+    rrf_k: int = 60
+    lexical_only_queries: int = 0
+    fused_queries: int = 0
+    _stats_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def add_texts(self, doc_ids: List[str], texts: List[str]) -> None:
+        """Index chunks that were just added to the vector store under doc_ids."""
+        self.bm25.add(doc_ids, texts)
+
+    def _documents(self, doc_ids: List[str]) -> List[Document]:
+        return [self.vector_store.docstore.search(doc_id) for doc_id in doc_ids]
+
+    def _vector_search(self, query: str, k: int) -> List[str]:
+        """
+        Docstore IDs of the k chunks nearest to query, nearest first. Small sessions'
+        indexes are NumPy VectorMatrix scans, larger ones faiss flat indexes.
+        """
+        index = self.vector_store.index
+        embedding = np.asarray(self.vector_store.embeddings.embed_query(query), dtype=np.float32)
+        _, found = index.search(embedding[None, :], min(k, index.ntotal))
+        positions = [p for p in found[0] if p >= 0]
+        return [self.vector_store.index_to_docstore_id[int(p)] for p in positions]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with stage_timer("retrieval", mode=self.mode):
+            return self._retrieve(query)
+
+    def _confident(self, lexical: List[Tuple[str, float]], term_count: int, coverage: float) -> bool:
+        return self.mode == "lexical" or (
+            bool(lexical) and term_count <= self.lexical_max_terms and coverage >= self.lexical_min_coverage
+        )
+
+    def lexical_only(self, query: str) -> bool:
+        """Whether retrieving query skips the vector search, and so never embeds the query."""
+        if self.mode == "vector":
+            return False
+        return self._confident(*self.bm25.search(query, self.fetch_k))
+
+    def _retrieve(self, query: str) -> List[Document]:
+        if self.mode == "vector":
+            return self._documents(self._vector_search(query, self.k))
+
+        lexical, term_count, coverage = self.bm25.search(query, self.fetch_k)
+        if self._confident(lexical, term_count, coverage):
+            with self._stats_lock:
+                self.lexical_only_queries += 1
+            logger.info(f"Lexical-only retrieval ({term_count} terms, coverage {coverage:.2f})")
+            return self._documents([doc_id for doc_id, _ in lexical[:self.k]])
+
+        with self._stats_lock:
+            self.fused_queries += 1
+        # Reciprocal rank fusion: rank positions only, so BM25 and L2 scores need no calibration
+        fused: Dict[str, float] = defaultdict(float)
+        for rank, (doc_id, _) in enumerate(lexical):
+            fused[doc_id] += 1.0 / (self.rrf_k + rank + 1)
+        for rank, doc_id in enumerate(self._vector_search(query, self.fetch_k)):
+            fused[doc_id] += 1.0 / (self.rrf_k + rank + 1)
+
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:self.k]
+        return self._documents([doc_id for doc_id, _ in ranked])
+
@@ -0,0 +1,140 @@
+"""
+Bounded background job queue for long-running service work.
+
+Jobs run on a fixed worker pool; submissions beyond max_pending are rejected
+with QueueFullError so callers can answer 429 instead of piling up work.
+Finished jobs are kept for result_ttl_seconds and then purged. Each job runs
+as its own trace, linked to the trace of the request that queued it.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while max_pending jobs are already queued or running."""
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.request_trace_id = tracing.current_trace_id()
+        self.done = threading.Event()
+        self.changed = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def _set_status(self, status: str) -> None:
+        with self.changed:
+            self.status = status
+            if self.finished:
+                self.done.set()
+            self.changed.notify_all()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "jobId": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == SUCCEEDED:
+            data["result"] = self.result
+        elif self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    def __init__(self, max_workers: int = 4, max_pending: int = 32, result_ttl_seconds: float = 900):
+        self.max_pending = max_pending
+        self.result_ttl_seconds = result_ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        """Build a queue from RAG_JOB_* environment variables."""
+        return cls(
+            max_workers=int(os.getenv("RAG_JOB_WORKERS", 4)),
+            max_pending=int(os.getenv("RAG_JOB_MAX_PENDING", 32)),
+            result_ttl_seconds=float(os.getenv("RAG_JOB_RESULT_TTL_SECONDS", 900)),
+        )
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """Queue fn(*args, **kwargs) and return its Job. Raises QueueFullError when saturated."""
+        with self._lock:
+            self._purge_expired()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+            job = Job(kind)
+            self._jobs[job.id] = job
+            self._pending += 1
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs) -> None:
+        job.started_at = time.time()
+        job._set_status(RUNNING)
+        try:
+            with tracing.trace(f"job {job.kind}", job_id=job.id, request_trace_id=job.request_trace_id or ""):
+                job.result = fn(*args, **kwargs)
+            status = SUCCEEDED
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}", exc_info=True)
+            job.error = str(e)
+            status = FAILED
+        job.finished_at = time.time()
+        with self._lock:
+            self._pending -= 1
+        job._set_status(status)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def _purge_expired(self) -> None:
+        cutoff = time.time() - self.result_ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "stored_jobs": len(self._jobs),
+                "rejected": self.rejected,
+            }
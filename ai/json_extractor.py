@@ -0,0 +1,196 @@
+"""
+Linear-time JSON extraction from LLM responses.
+
+Models often wrap their JSON in prose or ```json fences, or stop mid-object.
+A single left-to-right scan finds fenced blocks and balanced top-level objects
+(tracking strings and escapes so braces inside values are ignored); only those
+candidates are handed to json.loads. Candidates are ranked against the calling
+method's expected schema.
+"""
+
+import json
+import re
+from typing import Any, Dict, Generator, Iterator, List, Optional, Tuple
+
+# Expected top-level keys and types of each analysis method's JSON response
+SCHEMAS = {
+    "generate_financial_insights": {
+        "financial_metrics": dict,
+        "trends": list,
+        "risk_assessment": (str, dict),
+        "recommendations": list,
+        "payment_behavior": (dict, str),
+    },
+    "extract_payment_details": {
+        "payment_amount": (str, int, float),
+        "payment_method": str,
+        "payment_date": str,
+        "transaction_id": str,
+        "recipient": str,
+        "sender": str,
+        "currency": str,
+        "status": str,
+        "description": str,
+        "additional_details": dict,
+    },
+    "validate_document": {
+        "is_valid": bool,
+        "confidence_score": (int, float),
+        "validation_checks": dict,
+        "issues_found": list,
+        "recommendations": list,
+        "document_type": str,
+        "extraction_summary": dict,
+    },
+}
+
+_FENCE = "```"
+_STRUCTURAL = re.compile(r'[{}"\\]')
+# Text rescanned after unclosed braces is capped at this multiple of the input length
+_RESCAN_FACTOR = 4
+
+
+def _fenced_blocks(text: str) -> Iterator[str]:
+    """Yield the bodies of ``` / ```json fenced blocks."""
+    position = 0
+    while True:
+        start = text.find(_FENCE, position)
+        if start < 0:
+            return
+        body_start = text.find("\n", start)
+        if body_start < 0:
+            return
+        end = text.find(_FENCE, body_start)
+        if end < 0:
+            return
+        language = text[start + len(_FENCE):body_start].strip().lower()
+        if language in ("", "json", "json5"):
+            yield text[body_start + 1:end]
+        position = end + len(_FENCE)
+
+
+def _balanced_objects(text: str) -> Iterator[str]:
+    """
+    Yield every balanced top-level {...} span. Only structural characters are
+    visited (found by a compiled regex, so plain text is skipped in C). String
+    state is only tracked inside an object, so stray quotes in surrounding prose
+    are harmless. A "{" that never closes (prose, or a truncated response) is
+    skipped and scanning resumes just after it, within a budget of
+    _RESCAN_FACTOR times the text length so the scan stays linear.
+    """
+    position = 0
+    budget = _RESCAN_FACTOR * len(text)
+    while True:
+        unclosed = yield from _scan_objects(text, position)
+        if unclosed is None:
+            return
+        position = unclosed + 1
+        budget -= len(text) - position
+        if budget < 0:
+            return
+
+
+def _scan_objects(text: str, position: int) -> Generator[str, None, Optional[int]]:
+    """Yield balanced top-level spans from position on; return the start of an unclosed one, if any."""
+    depth = 0
+    start = 0
+    in_string = False
+    skip = -1  # index of a character escaped by the preceding backslash
+    for match in _STRUCTURAL.finditer(text, position):
+        i = match.start()
+        if i == skip:
+            continue
+        char = text[i]
+        if depth == 0:
+            if char == "{":
+                depth, start = 1, i
+            continue
+        if in_string:
+            if char == "\\":
+                skip = i + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                yield text[start:i + 1]
+    return start if depth else None
+
+
+def _candidates(text: str) -> Iterator[Dict[str, Any]]:
+    """Yield parsed JSON objects found in text, fenced blocks first."""
+    seen = set()
+    sources = [text] if "```" not in text else list(_fenced_blocks(text)) + [text]
+    for source in sources:
+        for span in _balanced_objects(source):
+            if span in seen:
+                continue
+            seen.add(span)
+            try:
+                value = json.loads(span)
+            except ValueError:
+                # Balanced but invalid (trailing commas, single quotes, ...)
+                continue
+            if isinstance(value, dict):
+                yield value
+
+
+def schema_problems(value: Dict[str, Any], schema: Dict[str, Any]) -> List[str]:
+    """List missing or mistyped keys of value according to schema."""
+    problems = []
+    for key, expected in schema.items():
+        if key not in value:
+            problems.append(f"missing {key}")
+        elif value[key] is not None and not isinstance(value[key], expected):
+            problems.append(f"unexpected type for {key}: {type(value[key]).__name__}")
+    return problems
+
+
+def _score(value: Dict[str, Any], schema: Dict[str, Any]) -> Tuple[int, int]:
+    matched = sum(1 for key, expected in schema.items()
+                  if key in value and (value[key] is None or isinstance(value[key], expected)))
+    return matched, len(value)
+
+
+def extract_json(text: str, schema: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Return the JSON object in an LLM response, or {"raw_response": text} when there is none.
+
+    A response that is pure JSON is parsed directly; without a schema a top-level
+    array is returned as is. Otherwise fenced blocks and balanced objects are
+    tried; with a schema the candidate matching the most expected keys wins and
+    any remaining problems are listed under "schema_warnings".
+    """
+    stripped = text.strip()
+    best = None
+    if stripped[:1] in ("{", "[") and stripped[-1:] in ("}", "]"):
+        try:
+            best = json.loads(stripped)
+        except ValueError:
+            best = None
+        if isinstance(best, list) and schema is None:
+            return best
+        if not isinstance(best, dict):
+            best = None
+
+    if best is None or (schema and schema_problems(best, schema)):
+        for candidate in _candidates(text):
+            if schema is None:
+                best = candidate
+                break
+            if best is None or _score(candidate, schema) > _score(best, schema):
+                best = candidate
+            if not schema_problems(best, schema):
+                break
+
+    if best is None:
+        return {"raw_response": text}
+    if schema:
+        problems = schema_problems(best, schema)
+        if problems:
+            best["schema_warnings"] = problems
+    return best
@@ -0,0 +1,178 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+A small dependency-free registry of gauges and histograms shared by
+the service threads. python_service renders it at GET /metrics; the agent and
+its helpers record per-stage timings through stage_timer(), which also records
+each stage as a trace span (see tracing).
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from tracing import span
+
+# Seconds; spans cache hits (sub-millisecond) to long OCR and LLM calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Characters; prompt and response sizes
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 1000000)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        """Mirror a cumulative count kept elsewhere (it must only grow while the process runs)."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _render_sample(self, key, value) -> List[str]:
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_duration_seconds", "Time to produce an HTTP response", ("endpoint", "method", "status")
+)
+REQUESTS_IN_FLIGHT = Gauge("rag_http_requests_in_flight", "HTTP requests currently being handled", ("endpoint",))
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in a processing stage (read_upload, extract, ocr, docx_parse, pdf_extract, summarize, "
+    "text_split, embedding, index, retrieval, llm)",
+    ("stage",),
+)
+LLM_PROMPT_CHARS = Histogram("rag_llm_prompt_chars", "Prompt size sent to the LLM", ("method",), SIZE_BUCKETS)
+LLM_RESPONSE_CHARS = Histogram("rag_llm_response_chars", "Response size returned by the LLM", ("method",), SIZE_BUCKETS)
+SESSIONS = Gauge("rag_sessions", "Sessions stored on disk or resident")
+RESIDENT_SESSIONS = Gauge("rag_resident_sessions", "Sessions loaded in memory")
+RESIDENT_SESSION_BYTES = Gauge("rag_resident_session_bytes", "Approximate memory held by resident sessions")
+VECTOR_STORE_VECTORS = Gauge("rag_vector_store_vectors", "Vectors across resident session indexes")
+CACHE_HITS = Counter("rag_cache_hits_total", "Cache hits since start", ("cache",))
+CACHE_MISSES = Counter("rag_cache_misses_total", "Cache misses since start", ("cache",))
+
+
+@contextmanager
+def stage_timer(stage: str, **attributes) -> Iterator[None]:
+    """
+    Record the duration of the enclosed block under rag_stage_duration_seconds{stage=...}
+    and as a trace span named after the stage, carrying attributes.
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage, **attributes):
+            yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_llm(method: str, prompt: str, response: str) -> None:
+    LLM_PROMPT_CHARS.observe(len(prompt), method=method)
+    LLM_RESPONSE_CHARS.observe(len(response), method=method)
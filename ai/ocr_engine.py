@@ -0,0 +1,284 @@
+"""
+OCR engine for the Python RAG service.
+
+Images are preprocessed (downscaled to a target DPI, converted to grayscale,
+binarized with Otsu's threshold and deskewed) and then passed to Tesseract on a
+process pool sized to the host's cores, so a burst of receipt photos uses every
+core without tying up the HTTP threads. A semaphore caps how many images are
+in flight at once. Results are cached by image content hash and OCR settings,
+so a re-uploaded receipt never reaches Tesseract twice.
+"""
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    from PIL import Image, ImageOps  # For image processing and OCR
+except ImportError:
+    Image = None
+    ImageOps = None
+
+try:
+    import pytesseract  # For OCR functionality
+except ImportError:
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+
+class OCRBusyError(Exception):
+    """Raised when no OCR slot frees up within the engine's queue timeout."""
+
+
+def _otsu_threshold(gray: np.ndarray) -> int:
+    """Return the Otsu threshold of an 8-bit grayscale array."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    cumulative_mean = np.cumsum(hist * np.arange(256))
+    mean_bg = cumulative_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cumulative_mean[-1] - cumulative_mean) / np.maximum(weight_fg, 1)
+    between_variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between_variance))
+
+
+def _estimate_skew(image, max_angle: float = 5.0, step: float = 0.5) -> float:
+    """
+    Estimate text skew in degrees with a projection profile search: the angle
+    whose rotation gives the sharpest row-sum profile wins.
+    """
+    thumbnail = image.copy()
+    thumbnail.thumbnail((800, 800))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        rotated = thumbnail.rotate(float(angle), fillcolor=255)
+        profile = (np.asarray(rotated) < 128).sum(axis=1).astype(np.float64)
+        score = float(np.sum(np.diff(profile) ** 2))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_image(image, target_dpi: int = 300, max_dimension: int = 3500,
+                     binarize: bool = True, deskew: bool = True):
+    """
+    Prepare an image for Tesseract: downscale to target_dpi (or max_dimension
+    when the image carries no DPI), grayscale, Otsu binarization and deskew.
+    """
+    image = ImageOps.exif_transpose(image)
+    dpi = image.info.get("dpi")
+    scale = 1.0
+    if dpi and dpi[0] and dpi[0] > target_dpi:
+        scale = target_dpi / float(dpi[0])
+    longest = max(image.size) * scale
+    if longest > max_dimension:
+        scale *= max_dimension / longest
+    if scale < 1.0:
+        image = image.resize(
+            (max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS
+        )
+
+    image = image.convert("L")
+    if binarize:
+        gray = np.asarray(image)
+        image = Image.fromarray(np.where(gray > _otsu_threshold(gray), 255, 0).astype(np.uint8))
+    if deskew:
+        angle = _estimate_skew(image)
+        if angle:
+            image = image.rotate(angle, expand=True, fillcolor=255)
+    return image
+
+
+def ocr_image_bytes(data: bytes, lang: str = "eng", preprocess: bool = True, target_dpi: int = 300) -> str:
+    """Decode, preprocess and OCR an image. Runs inside the process pool workers."""
+    image = Image.open(io.BytesIO(data))
+    if preprocess:
+        image = preprocess_image(image, target_dpi=target_dpi)
+    return pytesseract.image_to_string(image, lang=lang)
+
+
+class OCRCache:
+    """Bounded LRU cache of OCR text keyed by image hash and OCR settings."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(data: bytes, lang: str, preprocess: bool, target_dpi: int) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest}:{lang}:{int(preprocess)}:{target_dpi}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def set(self, key: str, text: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+class OCREngine:
+    def __init__(self, max_workers: Optional[int] = None, max_concurrency: Optional[int] = None,
+                 lang: str = "eng", preprocess: bool = True, target_dpi: int = 300,
+                 queue_timeout: float = 30.0, cache: Optional[OCRCache] = None):
+        """
+        Initialize the engine. The process pool is created on first use.
+
+        max_workers defaults to the host's core count; max_concurrency caps the
+        images queued or running at once (default twice the workers).
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers * 2
+        self.lang = lang
+        self.preprocess = preprocess
+        self.target_dpi = target_dpi
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.cache = cache if cache is not None else OCRCache()
+
+    @classmethod
+    def from_env(cls) -> "OCREngine":
+        """Build an engine from RAG_OCR_* environment variables."""
+        return cls(
+            max_workers=int(os.getenv("RAG_OCR_WORKERS", 0)) or None,
+            max_concurrency=int(os.getenv("RAG_OCR_MAX_CONCURRENCY", 0)) or None,
+            lang=os.getenv("RAG_OCR_LANG", "eng"),
+            preprocess=os.getenv("RAG_OCR_PREPROCESS", "1") != "0",
+            target_dpi=int(os.getenv("RAG_OCR_TARGET_DPI", 300)),
+            queue_timeout=float(os.getenv("RAG_OCR_QUEUE_TIMEOUT_SECONDS", 30)),
+            cache=OCRCache(max_entries=int(os.getenv("RAG_OCR_CACHE_MAX_ENTRIES", 512))),
+        )
+
+    @property
+    def available(self) -> bool:
+        return Image is not None and pytesseract is not None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: forking a process that already runs server threads is unsafe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"Started OCR process pool with {self.max_workers} workers")
+            return self._pool
+
+    def submit(self, data: bytes) -> Future:
+        """
+        Queue an encoded image for OCR on the process pool and return its Future.
+        Cached images return an already completed Future without taking a slot.
+        Blocks while the concurrency cap is saturated and raises OCRBusyError
+        if no slot frees up within queue_timeout seconds.
+        """
+        key = OCRCache.make_key(data, self.lang, self.preprocess, self.target_dpi)
+        return self.submit_call(key, ocr_image_bytes, data, self.lang, self.preprocess, self.target_dpi)
+
+    def submit_call(self, key: str, fn, *args) -> Future:
+        """
+        Run fn(*args), which must return OCR text, on the process pool under the
+        same concurrency cap and cache as submit; key identifies the result in
+        the cache. fn must be a module-level function the workers can import.
+        """
+        text = self.cache.get(key)
+        if text is not None:
+            future = Future()
+            future.set_result(text)
+            return future
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise OCRBusyError(f"OCR engine busy ({self.max_concurrency} images in flight)")
+        with self._counter_lock:
+            self.in_flight += 1
+        try:
+            pool = self._get_pool()
+            future = pool.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda f: self._on_done(pool, key, f))
+        return future
+
+    def _on_done(self, pool: ProcessPoolExecutor, key: str, future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            self.cache.set(key, future.result())
+        elif not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            # A crashed worker poisons the whole pool; start a fresh one for later calls
+            with self._pool_lock:
+                if self._pool is pool:
+                    self._pool = None
+        self._release()
+
+    def _release(self) -> None:
+        with self._counter_lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def image_to_string(self, data: bytes) -> str:
+        """OCR an encoded image on the process pool and wait for the text."""
+        return self.submit(data).result()
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "preprocess": self.preprocess,
+            "cache": self.cache.stats(),
+        }
@@ -0,0 +1,142 @@
+"""
+Page-parallel text extraction for PDFs and multi-page TIFFs.
+
+PDF pages with an embedded text layer are read directly; only image-only pages
+are OCRed. Rendering and OCR of those pages both run on the OCR engine's
+process pool, which opens the PDF from a private temporary copy, so the request
+thread only reads text layers and reassembles results strictly in page order.
+Callers can consume a long statement as it is extracted.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Future
+from typing import Iterable, Iterator, Union
+
+try:
+    import pypdfium2 as pdfium  # For PDF text layers and page rendering
+except ImportError:
+    pdfium = None
+
+try:
+    from PIL import Image, ImageSequence  # For multi-page TIFF frames
+except ImportError:
+    Image = None
+    ImageSequence = None
+
+from ocr_engine import OCRCache, OCREngine, preprocess_image, pytesseract
+
+logger = logging.getLogger(__name__)
+
+# Pages whose text layer has fewer characters than this are treated as scans
+MIN_TEXT_LAYER_CHARS = int(os.getenv("RAG_PDF_MIN_TEXT_CHARS", 20))
+# Resolution used to rasterize image-only PDF pages for OCR
+PDF_RENDER_DPI = int(os.getenv("RAG_PDF_RENDER_DPI", 300))
+
+
+def _encode_png(image) -> bytes:
+    buffer = io.BytesIO()
+    dpi = image.info.get("dpi")
+    if dpi:
+        image.save(buffer, format="PNG", compress_level=1, dpi=dpi)
+    else:
+        image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def ocr_pdf_page(path: str, index: int, render_dpi: int, lang: str, preprocess: bool, target_dpi: int) -> str:
+    """Render one PDF page and OCR it. Runs inside the OCR engine's process pool workers."""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        page = pdf[index]
+        try:
+            image = page.render(scale=render_dpi / 72).to_pil()
+        finally:
+            page.close()
+    finally:
+        pdf.close()
+    image.info["dpi"] = (render_dpi, render_dpi)
+    if preprocess:
+        image = preprocess_image(image, target_dpi=target_dpi)
+    return pytesseract.image_to_string(image, lang=lang)
+
+
+def _in_order(pages: Iterable[Union[str, Future]], window: int) -> Iterator[str]:
+    """
+    Yield page texts in page order. OCR futures are kept at most window pages
+    ahead of the consumer so later pages keep the pool busy meanwhile.
+    """
+    pending = deque()
+    for page in pages:
+        pending.append(page)
+        while len(pending) > window:
+            head = pending.popleft()
+            yield head.result() if isinstance(head, Future) else head
+    while pending:
+        head = pending.popleft()
+        yield head.result() if isinstance(head, Future) else head
+
+
+def iter_pdf_pages(data: bytes, ocr_engine: OCREngine) -> Iterator[str]:
+    """Yield the text of each PDF page in order, OCRing only pages without a text layer."""
+    if pdfium is None:
+        raise RuntimeError("PDF processing not available (pypdfium2 not installed)")
+
+    pdf = pdfium.PdfDocument(data)
+    # Workers open the PDF from this file, written on the first image-only page
+    copy = {}
+
+    def submit_ocr(index):
+        if not copy:
+            fd, copy["path"] = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            copy["digest"] = hashlib.sha256(data).hexdigest()
+        key = OCRCache.make_key(f"{copy['digest']}:{index}:{PDF_RENDER_DPI}".encode(),
+                                ocr_engine.lang, ocr_engine.preprocess, ocr_engine.target_dpi)
+        return ocr_engine.submit_call(key, ocr_pdf_page, copy["path"], index, PDF_RENDER_DPI,
+                                      ocr_engine.lang, ocr_engine.preprocess, ocr_engine.target_dpi)
+
+    def pages():
+        ocr_pages = 0
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+            if len(text.strip()) >= MIN_TEXT_LAYER_CHARS or not ocr_engine.available:
+                yield text
+                continue
+            ocr_pages += 1
+            yield submit_ocr(index)
+        logger.info(f"Extracted {len(pdf)} PDF pages, {ocr_pages} via OCR")
+
+    try:
+        yield from _in_order(pages(), ocr_engine.max_concurrency)
+    finally:
+        pdf.close()
+        if copy:
+            os.remove(copy["path"])
+
+
+def iter_tiff_pages(data: bytes, ocr_engine: OCREngine) -> Iterator[str]:
+    """Yield the OCR text of every frame of a (possibly multi-page) TIFF in order."""
+    image = Image.open(io.BytesIO(data))
+
+    def pages():
+        for frame in ImageSequence.Iterator(image):
+            yield ocr_engine.submit(_encode_png(frame.copy()))
+
+    try:
+        yield from _in_order(pages(), ocr_engine.max_concurrency)
+    finally:
+        image.close()
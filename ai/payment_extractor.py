@@ -0,0 +1,282 @@
+"""
+Rule-based payment detail extraction.
+
+Parses amounts, currencies, dates, TXN-/INV- style identifiers, status keywords
+and labelled fields ("Payment Method:", "Recipient:", ...) out of invoice and
+receipt text without a model call. Every field carries a confidence in [0, 1];
+RAGAgent.extract_payment_details only asks the LLM for the required fields that
+stay below the confidence threshold.
+"""
+
+import os
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+# Fields whose absence (or low confidence) triggers the LLM fallback
+REQUIRED_FIELDS = ("payment_amount", "currency", "payment_date", "transaction_id", "status")
+MIN_CONFIDENCE = float(os.getenv("RAG_LOCAL_EXTRACT_MIN_CONFIDENCE", 0.8))
+
+PAYMENT_FIELDS = ("payment_amount", "payment_method", "payment_date", "transaction_id", "recipient",
+                  "sender", "currency", "status", "description")
+
+_CURRENCY_SYMBOLS = {"$": ("USD", 0.85), "₹": ("INR", 0.95), "€": ("EUR", 0.95), "£": ("GBP", 0.95), "¥": ("JPY", 0.85)}
+_CURRENCY_WORDS = {"rs": "INR", "rs.": "INR", "inr": "INR", "usd": "USD", "eur": "EUR", "gbp": "GBP",
+                   "jpy": "JPY", "aud": "AUD", "cad": "CAD", "sgd": "SGD", "aed": "AED"}
+
+_CURRENCY = r"(?P<cur>[$₹€£¥]|\brs\.|\b(?:rs|inr|usd|eur|gbp|jpy|aud|cad|sgd|aed)\b)"
+# 1,250.00 / 1,25,000.00, 1.250,00 and ungrouped 1250.00 / 1250,00. The boundaries keep
+# a match from starting or ending inside a longer number such as 1,234.567.
+_NUMBER = (r"(?<![\d.,])(?P<num>\d{1,3}(?:,\d{2,3})+(?:\.\d{1,2})?|\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?"
+           r"|\d+(?:[.,]\d{1,2})?)(?!\d|[.,]\d)")
+_AMOUNT_LABEL = r"(?P<label>\b(?:total\s+amount|amount\s+paid|amount\s+due|grand\s+total|total|amount|fee|paid)\b\s*[:\-]?\s*)?"
+_AMOUNT_RE = re.compile(
+    _AMOUNT_LABEL + r"(?:" + _CURRENCY + r"\s?" + _NUMBER + r"|" + _NUMBER.replace("num", "num2")
+    + r"\s?" + _CURRENCY.replace("cur", "cur2") + r")",
+    re.IGNORECASE,
+)
+_LABELLED_NUMBER_RE = re.compile(
+    r"\b(?:total\s+amount|amount\s+paid|amount\s+due|grand\s+total|total|amount)\b\s*[:\-]\s*" + _NUMBER + r"(?!\s*[/.-]\d)",
+    re.IGNORECASE,
+)
+
+_MONTHS = {name: i + 1 for i, name in enumerate(
+    ["january", "february", "march", "april", "may", "june", "july",
+     "august", "september", "october", "november", "december"])}
+_MONTHS.update({name[:3]: number for name, number in list(_MONTHS.items())})
+_MONTHS["sept"] = 9
+_MONTH = r"(?P<month>" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r")\.?"
+_DATE_PATTERNS = [
+    ("mdy_name", re.compile(r"\b" + _MONTH + r"\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?,?\s+(?P<year>\d{4})\b", re.IGNORECASE)),
+    ("dmy_name", re.compile(r"\b(?P<day>\d{1,2})(?:st|nd|rd|th)?\s+" + _MONTH + r",?\s+(?P<year>\d{4})\b", re.IGNORECASE)),
+    ("iso", re.compile(r"\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b")),
+    ("numeric", re.compile(r"\b(?P<a>\d{1,2})[/.-](?P<b>\d{1,2})[/.-](?P<year>\d{4})\b")),
+]
+_DATE_LABEL_RE = re.compile(r"\b(?:payment\s+date|transaction\s+date|paid\s+on|date)\b\s*[:\-]?\s*$", re.IGNORECASE)
+
+_TRANSACTION_LABEL_RE = re.compile(
+    r"\b(?:transaction\s+(?:id|no\.?|number|ref(?:erence)?)|txn\s+(?:id|no\.?)|payment\s+id|"
+    r"reference\s+(?:id|no\.?|number)|ref\s+no\.?|utr(?:\s+no\.?)?)\s*[:#\-]?\s*(?P<id>[A-Z0-9][A-Z0-9\-_/]{3,})",
+    re.IGNORECASE,
+)
+# The prefix must be followed by a separator or digit so words like "Invoice" do not match
+_TXN_RE = re.compile(r"\b(?P<id>TXN(?:[-_][A-Z0-9]|\d)[A-Z0-9\-_]*)\b", re.IGNORECASE)
+_INVOICE_RE = re.compile(r"\b(?P<id>INV(?:[-_][A-Z0-9]|\d)[A-Z0-9\-_]*)\b", re.IGNORECASE)
+
+_STATUSES = {
+    "Paid": ("paid", "completed", "complete", "successful", "success", "settled", "received"),
+    "Pending": ("pending", "processing", "unpaid", "due", "awaiting payment", "in progress"),
+    "Failed": ("failed", "declined", "rejected", "unsuccessful"),
+    "Refunded": ("refunded", "reversed"),
+    "Cancelled": ("cancelled", "canceled", "void"),
+}
+_STATUS_LABEL_RE = re.compile(r"\b(?:payment\s+status|status)\b\s*[:\-]\s*(?P<value>[^\n]+)", re.IGNORECASE)
+_STATUS_KEYWORDS = {keyword for keywords in _STATUSES.values() for keyword in keywords}
+# "Not paid", "no payment received", "yet to be settled"; un- words are checked separately
+_NEGATION_RE = re.compile(r"\b(?:not|no|never|non|yet\s+to)\b|n't\b", re.IGNORECASE)
+
+_PAYMENT_METHODS = {
+    "Credit Card": ("credit card",), "Debit Card": ("debit card",), "UPI": ("upi",),
+    "Net Banking": ("net banking", "netbanking"), "Bank Transfer": ("bank transfer", "neft", "rtgs", "imps", "wire transfer"),
+    "Cash": ("cash",), "Cheque": ("cheque", "check"), "PayPal": ("paypal",),
+}
+
+_LABELLED_FIELDS = {
+    "payment_method": r"payment\s+method|payment\s+mode|mode\s+of\s+payment|paid\s+via",
+    "recipient": r"recipient|payee|paid\s+to|beneficiary|billed\s+by",
+    "sender": r"sender|payer|paid\s+by|billed\s+to|student\s+name",
+    "description": r"description|purpose|memo|remarks|particulars",
+}
+
+
+def _labelled(pattern: str, text: str) -> Optional[str]:
+    match = re.search(r"^\s*(?:" + pattern + r")\s*[:\-]\s*(?P<value>[^\n]+?)\s*$", text, re.IGNORECASE | re.MULTILINE)
+    return match.group("value") if match else None
+
+
+def _parse_number(number: str) -> Tuple[str, bool]:
+    """
+    Normalise a matched number to "1234.56" and say whether the reading is ambiguous.
+    A trailing separator with one or two digits is the decimal point; any other
+    separator groups thousands. A single "." before three digits (99.999) may be
+    either, so it is read as grouping but flagged.
+    """
+    last = max(number.rfind(","), number.rfind("."))
+    if last == -1:
+        return f"{float(number):.2f}", False
+    integer, decimals = number, ""
+    if len(number) - last - 1 <= 2:
+        integer, decimals = number[:last], number[last + 1:]
+    ambiguous = not decimals and number.count(".") == 1 and "," not in number
+    value = re.sub(r"[.,]", "", integer) + ("." + decimals if decimals else "")
+    return f"{float(value):.2f}", ambiguous
+
+
+def _extract_amount(text: str) -> Tuple[Optional[str], float, Optional[str], float]:
+    """Return (amount, confidence, currency, currency confidence)."""
+    candidates = []
+    for match in _AMOUNT_RE.finditer(text):
+        amount, ambiguous = _parse_number(match.group("num") or match.group("num2"))
+        symbol = (match.group("cur") or match.group("cur2")).lower()
+        if symbol in _CURRENCY_SYMBOLS:
+            currency, currency_confidence = _CURRENCY_SYMBOLS[symbol]
+        else:
+            currency, currency_confidence = _CURRENCY_WORDS[symbol], 0.95
+        candidates.append((bool(match.group("label")), amount, currency, currency_confidence, ambiguous))
+
+    if not candidates:
+        # A labelled amount without a currency marker still gives the amount
+        match = _LABELLED_NUMBER_RE.search(text)
+        if match:
+            amount, ambiguous = _parse_number(match.group("num"))
+            return amount, 0.5 if ambiguous else 0.85, None, 0.0
+        return None, 0.0, None, 0.0
+
+    labelled = [c for c in candidates if c[0]]
+    if labelled:
+        _, amount, currency, currency_confidence, ambiguous = labelled[0]
+        confidence = 0.95 if len({c[1] for c in labelled}) == 1 else 0.8
+    else:
+        _, amount, currency, currency_confidence, ambiguous = candidates[0]
+        confidence = 0.85 if len({c[1] for c in candidates}) == 1 else 0.5
+    if ambiguous:
+        confidence = min(confidence, 0.5)
+    if len({c[2] for c in candidates}) > 1:
+        currency_confidence = min(currency_confidence, 0.5)
+    return amount, confidence, currency, currency_confidence
+
+
+def _extract_date(text: str) -> Tuple[Optional[str], float]:
+    found = []  # (position, iso date, labelled, ambiguous)
+    for kind, pattern in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            ambiguous = False
+            try:
+                year = int(match.group("year"))
+                if kind == "numeric":
+                    a, b = int(match.group("a")), int(match.group("b"))
+                    # Day-first unless that is impossible; both readings valid means ambiguous
+                    day, month = (a, b) if b <= 12 else (b, a)
+                    ambiguous = a <= 12 and b <= 12 and a != b
+                else:
+                    month_group = match.group("month")
+                    month = _MONTHS[month_group.lower()] if not month_group.isdigit() else int(month_group)
+                    day = int(match.group("day"))
+                parsed = date(year, month, day)
+            except (ValueError, KeyError):
+                continue
+            line_start = text.rfind("\n", 0, match.start()) + 1
+            labelled = bool(_DATE_LABEL_RE.search(text[line_start:match.start()]))
+            found.append((match.start(), parsed.isoformat(), labelled, ambiguous))
+
+    if not found:
+        return None, 0.0
+    found.sort()
+    labelled = [f for f in found if f[2]]
+    _, value, is_labelled, ambiguous = (labelled or found)[0]
+    if is_labelled:
+        confidence = 0.95
+    elif len({f[1] for f in found}) == 1:
+        confidence = 0.85
+    else:
+        confidence = 0.5
+    if ambiguous:
+        confidence = min(confidence, 0.6)
+    return value, confidence
+
+
+def _extract_transaction_id(text: str) -> Tuple[Optional[str], float, Optional[str]]:
+    """Return (transaction id, confidence, invoice number)."""
+    invoice = _INVOICE_RE.search(text)
+    invoice_number = invoice.group("id") if invoice else None
+
+    labelled = _TRANSACTION_LABEL_RE.search(text)
+    if labelled:
+        return labelled.group("id"), 0.95, invoice_number
+    txn = _TXN_RE.search(text)
+    if txn:
+        return txn.group("id"), 0.9, invoice_number
+    if invoice_number:
+        # An invoice number is a usable reference but not necessarily the payment's ID
+        return invoice_number, 0.6, invoice_number
+    return None, 0.0, invoice_number
+
+
+def _match_keyword(value: str, table: Dict[str, Tuple[str, ...]]) -> List[str]:
+    lowered = value.lower()
+    return [name for name, keywords in table.items()
+            if any(re.search(r"\b" + re.escape(k) + r"\b", lowered) for k in keywords)]
+
+
+def _negated(value: str) -> bool:
+    """True when a status keyword may be negated: "Not paid", "Payment not completed", "Unsettled"."""
+    if _NEGATION_RE.search(value):
+        return True
+    # "unpaid" and "unsuccessful" are statuses of their own; "unsettled" negates "settled"
+    return any(word not in _STATUS_KEYWORDS and word[2:] in _STATUS_KEYWORDS
+               for word in re.findall(r"\bun\w+", value.lower()))
+
+
+def _extract_status(text: str) -> Tuple[Optional[str], float]:
+    labelled = _STATUS_LABEL_RE.search(text)
+    if labelled:
+        value = labelled.group("value")
+        if _negated(value):
+            # Keyword matching cannot tell what a negated status means; leave it to the LLM
+            return value.strip(), 0.3
+        matches = _match_keyword(value, _STATUSES)
+        if len(matches) == 1:
+            return matches[0], 0.95
+        return value.strip(), 0.6
+    # Unlabelled keywords are weak evidence ("Amount Paid" says nothing about the status)
+    matches = {match for line in text.splitlines() if not _negated(line)
+               for match in _match_keyword(line, _STATUSES)}
+    if len(matches) == 1:
+        return matches.pop(), 0.6
+    return None, 0.0
+
+
+def extract_payment_fields(text: str) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Extract payment details locally. Returns (details, confidence) where details
+    uses the same keys as the LLM prompt and confidence maps each field to [0, 1].
+    """
+    details = {field: "" for field in PAYMENT_FIELDS}
+    details["additional_details"] = {}
+    confidence = {field: 0.0 for field in PAYMENT_FIELDS}
+
+    amount, amount_confidence, currency, currency_confidence = _extract_amount(text)
+    if amount:
+        details["payment_amount"], confidence["payment_amount"] = amount, amount_confidence
+    if currency:
+        details["currency"], confidence["currency"] = currency, currency_confidence
+
+    payment_date, date_confidence = _extract_date(text)
+    if payment_date:
+        details["payment_date"], confidence["payment_date"] = payment_date, date_confidence
+
+    transaction_id, id_confidence, invoice_number = _extract_transaction_id(text)
+    if transaction_id:
+        details["transaction_id"], confidence["transaction_id"] = transaction_id, id_confidence
+    if invoice_number:
+        details["additional_details"]["invoice_number"] = invoice_number
+
+    status, status_confidence = _extract_status(text)
+    if status:
+        details["status"], confidence["status"] = status, status_confidence
+
+    for field, pattern in _LABELLED_FIELDS.items():
+        value = _labelled(pattern, text)
+        if value:
+            details[field], confidence[field] = value, 0.9
+    if not details["payment_method"]:
+        methods = _match_keyword(text, _PAYMENT_METHODS)
+        if len(methods) == 1:
+            details["payment_method"], confidence["payment_method"] = methods[0], 0.75
+
+    return details, confidence
+
+
+def unresolved_fields(confidence: Dict[str, float], min_confidence: float = MIN_CONFIDENCE) -> List[str]:
+    """Required fields whose local confidence is below min_confidence."""
+    return [field for field in REQUIRED_FIELDS if confidence.get(field, 0.0) < min_confidence]
@@ -0,0 +1,162 @@
+"""
+On-demand profiling of service requests.
+
+POST /admin/profile arms the profiler for the next N requests. Each profiled
+request is written to RAG_PROFILE_DIR, named after the request's trace ID when
+tracing is on:
+
+- sample (default): a background thread samples the request thread's stack
+  every interval_ms and writes folded stacks (.folded), the input format of
+  flamegraph.pl, speedscope and inferno
+- cprofile: a deterministic cProfile dump (.prof) for pstats, snakeviz or
+  flameprof
+
+Only the request thread is profiled; work handed to executor threads shows up
+as waits here and as spans in the request's trace.
+"""
+
+import cProfile
+import logging
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("RAG_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "rag_profiles"))
+PROFILE_MODES = ("sample", "cprofile")
+# Bounds on what a single /admin/profile call may ask for
+MAX_PROFILED_REQUESTS = 100
+MIN_INTERVAL_MS = 1.0
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread and counts folded stacks."""
+
+    def __init__(self, thread_id: int, interval_ms: float):
+        self.thread_id = thread_id
+        self.interval = max(interval_ms, MIN_INTERVAL_MS) / 1000.0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rag-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+
+class RequestProfile:
+    """Profiles one request on the calling thread between start() and stop()."""
+
+    def __init__(self, mode: str, interval_ms: float):
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self._profile = None
+        self._sampler = None
+
+    def start(self) -> bool:
+        """Begin profiling; False when another cProfile session already owns the interpreter hook."""
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                return False
+        else:
+            self._sampler = StackSampler(threading.get_ident(), self.interval_ms)
+            self._sampler.start()
+        return True
+
+    def stop(self, name: str, directory: str = None) -> str:
+        """Stop profiling and write the profile as directory/<name>.folded or .prof."""
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        if self._profile is not None:
+            self._profile.disable()
+            path = os.path.join(directory, f"{name}.prof")
+            self._profile.dump_stats(path)
+            return path
+        stacks = self._sampler.stop()
+        path = os.path.join(directory, f"{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class Profiler:
+    """Hands out RequestProfiles to the next N requests after arm()."""
+
+    def __init__(self):
+        self.remaining = 0
+        self.mode = "sample"
+        self.interval_ms = 5.0
+        self.written = []  # paths of profiles written since the last arm()
+        self._lock = threading.Lock()
+
+    def arm(self, requests: int, mode: str = "sample", interval_ms: float = 5.0) -> None:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}. Use one of {', '.join(PROFILE_MODES)}")
+        if not 0 <= requests <= MAX_PROFILED_REQUESTS:
+            raise ValueError(f"requests must be between 0 and {MAX_PROFILED_REQUESTS}")
+        with self._lock:
+            self.remaining = requests
+            self.mode = mode
+            self.interval_ms = max(float(interval_ms), MIN_INTERVAL_MS)
+            self.written = []
+
+    def begin(self) -> Optional[RequestProfile]:
+        """Start profiling the current request if the profiler is armed."""
+        with self._lock:
+            if self.remaining <= 0:
+                return None
+            self.remaining -= 1
+            profile = RequestProfile(self.mode, self.interval_ms)
+        if profile.start():
+            return profile
+        logger.warning("Skipping profile: another cProfile session is active")
+        with self._lock:
+            self.remaining += 1
+        return None
+
+    def finish(self, profile: RequestProfile, name: str) -> Optional[str]:
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        try:
+            path = profile.stop(f"{stamp}-{name}")
+        except Exception as e:
+            logger.warning(f"Could not write profile {name}: {e}")
+            return None
+        logger.info(f"Wrote profile {path}")
+        with self._lock:
+            self.written.append(path)
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "remaining": self.remaining,
+                "mode": self.mode,
+                "interval_ms": self.interval_ms,
+                "directory": PROFILE_DIR,
+                "written": list(self.written),
+            }
@@ -6,9 +6,19 @@ Provides a REST API interface for the RAG Agent that can be called from Node.js
 
 import os
 import sys
+import hmac
+import json
 import logging
-from flask import Flask, request, jsonify
+import math
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache, partial
+from flask import Flask, Request, Response, g, request, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
 import traceback
 import tempfile
@@ -19,21 +29,6 @@ try:
 except ImportError:
     pass
 
-try:
-    from docx import Document  # For Word document processing
-except ImportError:
-    Document = None
-
-try:
-    from PIL import Image  # For image processing and OCR
-except ImportError:
-    Image = None
-
-try:
-    import pytesseract  # For OCR functionality
-except ImportError:
-    pytesseract = None
-
 try:
     from waitress import serve  # For production server
 except ImportError:
@@ -45,19 +40,59 @@ load_dotenv()
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from rag_agent import RAGAgent #@UnresolvedImport
+from job_queue import JobQueue, QueueFullError #@UnresolvedImport
+import metrics #@UnresolvedImport
+import tracing #@UnresolvedImport
+from metrics import stage_timer #@UnresolvedImport
+from profiling import Profiler #@UnresolvedImport
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upload size limit (larger requests get 413) and the size above which uploads spool to disk
+MAX_UPLOAD_BYTES = int(os.getenv('RAG_MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+UPLOAD_SPOOL_BYTES = int(os.getenv('RAG_UPLOAD_SPOOL_BYTES', 4 * 1024 * 1024))
+# Documents accepted by one /analyze/batch request
+MAX_BATCH_DOCUMENTS = int(os.getenv('RAG_MAX_BATCH_DOCUMENTS', 500))
+# Shared secret for /admin endpoints (sent as X-Admin-Token); admin endpoints are disabled when unset
+ADMIN_TOKEN = os.getenv('RAG_ADMIN_TOKEN')
+# "waitress" (one thread per request) or "async" (asyncio event loop for LLM-bound endpoints, see async_service)
+SERVER = os.getenv('RAG_SERVER', 'waitress').lower()
+# Polled endpoints that are neither traced nor profiled
+UNTRACED_ENDPOINTS = {'/health', '/health/live', '/health/ready', '/metrics', '/admin/profile'}
+
+class UploadRequest(Request):
+    """Keeps uploads up to UPLOAD_SPOOL_BYTES in memory instead of werkzeug's 500 KB default"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 # Get CORS origin from environment variable or use wildcard as fallback
 cors_origin = os.getenv('CORS_ORIGIN', '*')
 CORS(app, resources={r"/*": {"origins": cors_origin, "methods": ["GET", "POST", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization"]}})  # Enable CORS with environment variable
 
-# Global RAG Agent instance
+# Global RAG Agent instance, created on first use or by the startup warm-up
 rag_agent = None
+_agent_lock = threading.Lock()
+
+# Warm the agent, docx and OCR up on a background thread once the server starts
+WARMUP = os.getenv('RAG_WARMUP', '1') != '0'
+# Subsystem -> "pending", "ready", "unavailable" or "error: ..."; llm and embeddings gate readiness
+subsystems = {"llm": "pending", "embeddings": "pending", "ocr": "pending", "docx": "pending"}
+REQUIRED_SUBSYSTEMS = ("llm", "embeddings")
+
+# Background jobs for long uploads and analyses
+job_queue = JobQueue.from_env()
+
+# OCR engine (numpy, PIL, pytesseract), imported and built on first use
+_ocr_engine = None
+_ocr_lock = threading.Lock()
+
+# Request profiler, armed through /admin/profile
+profiler = Profiler()
 
 def initialize_agent():
     """Initialize the RAG Agent with API key from environment"""
@@ -66,102 +101,405 @@ def initialize_agent():
         api_key = os.getenv('GOOGLE_API_KEY')
         if not api_key:
             logger.error("GOOGLE_API_KEY not found in environment variables")
+            subsystems["llm"] = subsystems["embeddings"] = "error: GOOGLE_API_KEY not set"
             return False
         
+        # LangChain, Gemini and FAISS are only imported here, off the startup path
+        from rag_agent import RAGAgent #@UnresolvedImport
         rag_agent = RAGAgent(api_key=api_key)
+        subsystems["llm"] = subsystems["embeddings"] = "ready"
         logger.info("RAG Agent initialized successfully")
         return True
     except Exception as e:
         logger.error(f"Failed to initialize RAG Agent: {str(e)}")
+        subsystems["llm"] = subsystems["embeddings"] = f"error: {e}"
         return False
 
+def ensure_agent():
+    """The RAG agent, initialized on first use unless the warm-up already did; None if that fails"""
+    if rag_agent is None:
+        with _agent_lock:
+            if rag_agent is None:
+                initialize_agent()
+    return rag_agent
+
+@lru_cache(maxsize=None)
+def docx_document_class():
+    """python-docx's Document class, imported on first use; None when python-docx is not installed"""
+    try:
+        from docx import Document  # For Word document processing
+    except ImportError:
+        return None
+    return Document
+
+def get_ocr_engine():
+    """
+    The OCR engine, imported on first use so numpy, PIL and pytesseract stay off the
+    startup path; None when ocr_engine cannot be imported. Its process pool only
+    starts on the first image. An import that fails or lacks PIL/pytesseract
+    marks the "ocr" subsystem unavailable.
+    """
+    global _ocr_engine
+    if _ocr_engine is None:
+        with _ocr_lock:
+            if _ocr_engine is None:
+                try:
+                    from ocr_engine import OCREngine #@UnresolvedImport
+                except ImportError as e:
+                    logger.warning(f"OCR engine not importable: {e}")
+                    subsystems["ocr"] = "unavailable"
+                    return None
+                engine = OCREngine.from_env()
+                if not engine.available:
+                    subsystems["ocr"] = "unavailable"
+                _ocr_engine = engine
+    return _ocr_engine
+
+def ocr_available():
+    """Whether PIL and pytesseract could be imported for OCR"""
+    engine = get_ocr_engine()
+    return engine is not None and engine.available
+
+def check_ocr():
+    """Whether OCR can run: PIL and pytesseract importable and the tesseract binary present"""
+    if not ocr_available():
+        return False
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        logger.warning(f"Tesseract not usable: {e}")
+        return False
+    return True
+
+def warm_up():
+    """Initialize the agent and probe the optional subsystems so the first requests don't pay for it"""
+    started = time.perf_counter()
+    ensure_agent()
+    subsystems["docx"] = "ready" if docx_document_class() else "unavailable"
+    subsystems["ocr"] = "ready" if check_ocr() else "unavailable"
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s: {subsystems}")
+
+def get_session_id(data=None):
+    """Session ID from the JSON body, form field or X-Session-ID header; 'default' when absent"""
+    if data and data.get('sessionId'):
+        return str(data['sessionId'])
+    return request.form.get('sessionId') or request.headers.get('X-Session-ID') or 'default'
+
+def wants_stream(data, headers=None):
+    """Streaming is opt-in via a truthy "stream" field or an Accept: text/event-stream header"""
+    headers = request.headers if headers is None else headers
+    return bool(data.get('stream')) or 'text/event-stream' in headers.get('Accept', '')
+
+def wants_sse(data, headers=None):
+    """Streams are Server-Sent Events for "stream": "sse" or Accept: text/event-stream, NDJSON otherwise"""
+    headers = request.headers if headers is None else headers
+    return data.get('stream') == 'sse' or 'text/event-stream' in headers.get('Accept', '')
+
+def encode_event(event, sse):
+    line = json.dumps(event)
+    return f"data: {line}\n\n" if sse else line + "\n"
+
+def stream_answer(tokens, data, extra):
+    """
+    Stream answer tokens as Server-Sent Events ("stream": "sse" or Accept: text/event-stream)
+    or NDJSON. Each event is {"token": ...}; the last is {"done": true, "response": {"answer": ...}, ...extra}.
+    """
+    sse = wants_sse(data)
+    encode = partial(encode_event, sse=sse)
+
+    def generate():
+        answer = []
+        try:
+            for token in tokens:
+                answer.append(token)
+                yield encode({"token": token})
+            yield encode({"done": True, "response": {"answer": "".join(answer)}, **extra})
+        except Exception as e:
+            logger.error(f"Error while streaming answer: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield encode({"error": f"Streaming failed: {str(e)}"})
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def request_endpoint():
+    """The matched route pattern (e.g. /jobs/<job_id>) so metric labels stay bounded"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_endpoint = request_endpoint()
+    metrics.REQUESTS_IN_FLIGHT.inc(endpoint=g.request_endpoint)
+    g.trace, g.profile = None, None
+    if g.request_endpoint not in UNTRACED_ENDPOINTS:
+        g.trace = tracing.start_trace(f"{request.method} {g.request_endpoint}",
+                                      **{"http.method": request.method, "http.route": g.request_endpoint})
+        g.profile = profiler.begin()
+        if rag_agent and rag_agent.cassette and request.method == 'POST':
+            record_request(rag_agent.cassette)
+
+@app.after_request
+def record_request_metrics(response):
+    # Streaming responses are timed until their first byte is ready, not until the stream ends
+    if 'request_started' in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=g.request_endpoint,
+                                        method=request.method, status=str(response.status_code))
+    if g.get('trace'):
+        g.trace.root.set(**{"http.status_code": response.status_code})
+        response.headers['X-Trace-Id'] = g.trace.trace_id
+    if response.is_streamed and (g.get('trace') or g.get('profile')):
+        # Keep tracing and profiling until the stream has been sent
+        response.call_on_close(partial(finish_request_trace, g.trace, g.profile))
+        g.trace, g.profile = None, None
+    return response
+
+def record_request(cassette):
+    """Add the incoming API request to the cassette so the traffic can be replayed offline"""
+    headers = {name: request.headers[name] for name in ('X-Session-ID', 'Accept') if name in request.headers}
+    try:
+        files = {field: (storage.filename, storage.read()) for field, storage in request.files.items()}
+        for storage in request.files.values():
+            storage.stream.seek(0)
+        cassette.record_request(request.method, request.path, headers, json_body=request.get_json(silent=True),
+                                form=request.form.to_dict(), files=files)
+    except RequestEntityTooLarge:
+        # The handler reports the 413
+        pass
+
+def finish_request_trace(trace, profile, exc=None):
+    """Write the request's profile (if it was profiled) and export its trace"""
+    if profile is not None:
+        profiler.finish(profile, trace.trace_id if trace else uuid.uuid4().hex)
+    tracing.end_trace(trace, exc)
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    if 'request_endpoint' in g:
+        metrics.REQUESTS_IN_FLIGHT.dec(endpoint=g.request_endpoint)
+    finish_request_trace(g.get('trace'), g.get('profile'), exc)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
         "agent_initialized": rag_agent is not None,
-        "timestamp": os.getenv('GOOGLE_API_KEY') is not None
+        "api_key_configured": os.getenv('GOOGLE_API_KEY') is not None,
+        "subsystems": dict(subsystems),
+        "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness: the process is serving requests; never touches the agent"""
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 once the LLM and embeddings are initialized, 503 before; OCR and docx are informational"""
+    # Without warm-up the agent is only built by the first request, so "pending" must not block traffic
+    accepted = ("ready",) if WARMUP else ("ready", "pending")
+    ready = all(subsystems[name] in accepted for name in REQUIRED_SUBSYSTEMS)
+    return jsonify({"ready": ready, "subsystems": dict(subsystems)}), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics: request latency, in-flight requests, stage timings, LLM sizes, sessions and caches"""
+    if rag_agent:
+        session_stats = rag_agent.sessions.stats()
+        metrics.SESSIONS.set(session_stats["sessions"])
+        metrics.RESIDENT_SESSIONS.set(session_stats["resident_sessions"])
+        metrics.RESIDENT_SESSION_BYTES.set(session_stats["resident_bytes"])
+        metrics.VECTOR_STORE_VECTORS.set(rag_agent.sessions.resident_vectors())
+        response_stats = rag_agent.response_cache.stats()
+        cache_counts = {
+            "response": (response_stats["hits"], response_stats["misses"]),
+            "embedding": (rag_agent.embeddings.hits, rag_agent.embeddings.misses),
+            "answer": (rag_agent.answer_cache_stats["hits"], rag_agent.answer_cache_stats["misses"]),
+        }
+        for cache, (hits, misses) in cache_counts.items():
+            metrics.CACHE_HITS.set_total(hits, cache=cache)
+            metrics.CACHE_MISSES.set_total(misses, cache=cache)
+    if _ocr_engine is not None:
+        # Scrapes never import the OCR stack; there is nothing to count before the first image
+        ocr_stats = _ocr_engine.cache.stats()
+        metrics.CACHE_HITS.set_total(ocr_stats["hits"], cache="ocr")
+        metrics.CACHE_MISSES.set_total(ocr_stats["misses"], cache="ocr")
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Profile the next N requests: POST {"requests": N, "mode": "sample"|"cprofile", "interval_ms": 5}.
+    GET reports the profiler state and the files written. Requires the X-Admin-Token header.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled (RAG_ADMIN_TOKEN not set)"}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Invalid admin token"}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            profiler.arm(int(data.get('requests', 1)), str(data.get('mode', 'sample')),
+                         float(data.get('interval_ms', 5)))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(profiler.stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Response, OCR and answer cache hit/miss counters"""
+    if not rag_agent:
+        return jsonify({"error": "RAG Agent not initialized"}), 500
+    stats = rag_agent.response_cache.stats()
+    engine = get_ocr_engine()
+    stats["ocr"] = engine.cache.stats() if engine is not None else None
+    stats["answers"] = dict(rag_agent.answer_cache_stats)
+    if rag_agent.cassette:
+        stats["cassette"] = rag_agent.cassette.stats()
+    return jsonify(stats)
+
+class UploadError(Exception):
+    """Document processing failure carrying the HTTP status to report"""
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+def read_upload(detach=False):
+    """
+    Validate the multipart upload and return (stream, file_extension).
+    The stream is the in-memory (or spooled) upload itself; detach=True copies it
+    into a new spooled file that outlives the request, for background jobs.
+    """
+    try:
+        # Parsing the multipart body spools the upload into memory or a temp file
+        with stage_timer("read_upload"):
+            files = request.files
+    except RequestEntityTooLarge:
+        raise UploadError(f"File too large (limit {MAX_UPLOAD_BYTES} bytes)", 413)
+    if 'file' not in files:
+        raise UploadError("No file part", 400)
+    
+    file = files['file']
+    if file.filename == '':
+        raise UploadError("No selected file", 400)
+    
+    # Get file extension
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    
+    stream = file.stream
+    if detach:
+        stream = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+        shutil.copyfileobj(file.stream, stream)
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    logger.info(f"Received {file.filename}, size={size} bytes")
+    return stream, file_extension
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff']
+
+def ocr_image_upload(data, file_extension):
+    """OCR an uploaded image; every frame of a multi-page TIFF is OCRed in parallel"""
+    with stage_timer("ocr"):
+        if file_extension in ('.tif', '.tiff'):
+            from page_extractor import iter_tiff_pages #@UnresolvedImport
+            return '\n\n'.join(iter_tiff_pages(data, get_ocr_engine()))
+        return get_ocr_engine().image_to_string(data)
+
+def extract_document_text(stream, file_extension):
+    """Extract text from an upload stream based on its file type"""
+    file_content = ""
+    
+    # Process based on file type
+    if file_extension == '.txt':
+        file_content = stream.read().decode('utf-8', errors='ignore')
+
+    elif file_extension == '.docx':
+        Document = docx_document_class()
+        if Document is None:
+            file_content = "Word document processing not available (python-docx not installed)"
+        else:
+            try:
+                with stage_timer("docx_parse"):
+                    doc = Document(stream)
+                file_content = '\n'.join([p.text for p in doc.paragraphs])
+            except Exception as docx_error:
+                logger.error(f"Failed to read .docx file: {docx_error}")
+                raise UploadError(f"Failed to read Word file: {str(docx_error)}", 500)
+
+    elif file_extension == '.pdf':
+        # PDF and OCR libraries are only imported once a PDF arrives
+        from ocr_engine import OCRBusyError #@UnresolvedImport
+        from page_extractor import iter_pdf_pages #@UnresolvedImport
+        try:
+            # Text layer where present, OCR for image-only pages, in page order
+            with stage_timer("pdf_extract"):
+                file_content = '\n\n'.join(iter_pdf_pages(stream.read(), get_ocr_engine()))
+        except OCRBusyError as busy_error:
+            raise UploadError(str(busy_error), 503)
+        except Exception as pdf_error:
+            logger.error(f"Failed to read PDF file: {pdf_error}")
+            raise UploadError(f"Failed to read PDF file: {str(pdf_error)}", 500)
+
+    elif file_extension in IMAGE_EXTENSIONS:
+        if not ocr_available():
+            file_content = "OCR processing not available (PIL or pytesseract not installed)"
+        else:
+            from ocr_engine import OCRBusyError #@UnresolvedImport
+            try:
+                file_content = ocr_image_upload(stream.read(), file_extension)
+                if not file_content.strip():
+                    file_content = "No text found in image"
+            except OCRBusyError as busy_error:
+                raise UploadError(str(busy_error), 503)
+            except Exception as ocr_error:
+                logger.error(f"OCR processing failed: {ocr_error}")
+                file_content = f"OCR processing failed: {str(ocr_error)}"
+
+    else:
+        try:
+            file_content = stream.read().decode('utf-8', errors='ignore')
+        except:
+            raise UploadError(f"Unsupported file type: {file_extension}", 400)
+
+    return file_content
+
+def process_upload(stream, file_extension, session_id):
+    """Extract, summarize and record an upload for a session; the stream is always closed"""
+    try:
+        with stage_timer("extract", file_type=file_extension):
+            file_content = extract_document_text(stream, file_extension)
+    finally:
+        stream.close()
+
+    # Generate summary
+    summary = rag_agent.summarize_text(file_content)
+    rag_agent.set_document(file_content, session_id)
+
+    return {
+        "summary": summary,
+        "file_type": file_extension,
+        "content_length": len(file_content),
+        "sessionId": session_id
+    }
+
 @app.route('/upload', methods=['POST'])
 def upload_document():
     """Upload a document for analysis - supports text files, Word documents, and images"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
-        
-        if file:
-            # Get file extension
-            file_extension = os.path.splitext(file.filename)[1].lower()
-            
-            # ✅ Save file directly to /tmp to avoid NamedTemporaryFile issues on Render
-            tmp_path = os.path.join("/tmp", file.filename)
-            file.save(tmp_path)
-            logger.info(f"Saved file to {tmp_path}, size={os.path.getsize(tmp_path)} bytes")
-
-
-            # Double-check that file actually exists
-            if not os.path.exists(tmp_path):
-                return jsonify({"error": f"File not saved properly: {tmp_path}"}), 500
-
-            file_content = ""
-            
-            # Process based on file type
-            if file_extension == '.txt':
-                with open(tmp_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    file_content = f.read()
-
-            elif file_extension == '.docx':
-                if Document is None:
-                    file_content = "Word document processing not available (python-docx not installed)"
-                else:
-                    try:
-                        doc = Document(tmp_path)
-                        file_content = '\n'.join([p.text for p in doc.paragraphs])
-                    except Exception as docx_error:
-                        logger.error(f"Failed to read .docx file: {docx_error}")
-                        return jsonify({"error": f"Failed to read Word file: {str(docx_error)}"}), 500
-
-            elif file_extension in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
-                if Image is None or pytesseract is None:
-                    file_content = "OCR processing not available (PIL or pytesseract not installed)"
-                else:
-                    try:
-                        image = Image.open(tmp_path)
-                        file_content = pytesseract.image_to_string(image)
-                        if not file_content.strip():
-                            file_content = "No text found in image"
-                    except Exception as ocr_error:
-                        logger.error(f"OCR processing failed: {ocr_error}")
-                        file_content = f"OCR processing failed: {str(ocr_error)}"
-
-            else:
-                try:
-                    with open(tmp_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        file_content = f.read()
-                except:
-                    return jsonify({"error": f"Unsupported file type: {file_extension}"}), 400
-
-            # ✅ Clean up temporary file
-            os.remove(tmp_path)
-
-            # Generate summary
-            summary = rag_agent.summarize_text(file_content)
-            rag_agent.last_document_content = file_content
-
-            return jsonify({
-                "summary": summary,
-                "file_type": file_extension,
-                "content_length": len(file_content)
-            })
+        stream, file_extension = read_upload()
+        return jsonify(process_upload(stream, file_extension, get_session_id()))
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         logger.error(f"Error in document upload: {str(e)}")
         logger.error(traceback.format_exc())
@@ -172,7 +510,7 @@ def upload_document():
 def chat_with_document():
     """Chat with the uploaded document"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
         data = request.get_json()
@@ -180,14 +518,21 @@ def chat_with_document():
             return jsonify({"error": "message is required"}), 400
         
         message = data['message']
+        session_id = get_session_id(data)
+
+        # Use the session's last uploaded document for context (no-op once it is indexed)
+        ingestion = None
+        document_content = rag_agent.get_document(session_id)
+        if document_content:
+            ingestion = rag_agent.add_documents([document_content], session_id)
 
-        # Use the last uploaded document's content for context
-        if rag_agent.last_document_content:
-            rag_agent.add_documents([rag_agent.last_document_content])
+        if wants_stream(data):
+            return stream_answer(rag_agent.query_stream(message, session_id=session_id), data,
+                                 {"ingestion": ingestion, "sessionId": session_id})
 
-        response = rag_agent.query(message)
+        response = rag_agent.query(message, session_id=session_id)
         
-        return jsonify({"response": response})
+        return jsonify({"response": response, "ingestion": ingestion, "sessionId": session_id})
     except Exception as e:
         logger.error(f"Error in chat: {str(e)}")
         logger.error(traceback.format_exc())
@@ -205,23 +550,15 @@ def clear_context():
         return response
     
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
         # Get session ID if provided
-        data = request.get_json()
-        session_id = data.get('sessionId', 'default_session') if data else 'default_session'
-        
-        # Clear the document content
-        rag_agent.last_document_content = ""
-        
-        # Clear any stored documents in the vector store
-        if hasattr(rag_agent, 'clear_documents'):
-            rag_agent.clear_documents()
+        data = request.get_json(silent=True)
+        session_id = get_session_id(data)
         
-        # Clear memory if method exists
-        if hasattr(rag_agent, 'clear_memory'):
-            rag_agent.clear_memory()
+        # Drop the session's document, vector store and QA chain
+        rag_agent.clear_session(session_id)
         
         return jsonify({"status": "success", "message": "Context cleared successfully", "sessionId": session_id})
     except Exception as e:
@@ -233,7 +570,7 @@ def clear_context():
 def analyze_financial():
     """Analyze financial documents"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
         data = request.get_json()
@@ -253,7 +590,7 @@ def analyze_financial():
 def analyze_payment():
     """Extract payment details"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
         data = request.get_json()
@@ -273,7 +610,7 @@ def analyze_payment():
 def analyze_validation():
     """Validate documents"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
         data = request.get_json()
@@ -293,7 +630,7 @@ def analyze_validation():
 def analyze_comprehensive():
     """Comprehensive document analysis"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
         data = request.get_json()
@@ -301,7 +638,7 @@ def analyze_comprehensive():
             return jsonify({"error": "document_text is required"}), 400
         
         document_text = data['document_text']
-        results = rag_agent.analyze_document(document_text, analysis_type="comprehensive")
+        results = rag_agent.analyze_document(document_text, data.get('analysis_types'))
         
         return jsonify(results)
     except Exception as e:
@@ -309,11 +646,69 @@ def analyze_comprehensive():
         logger.error(traceback.format_exc())
         return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
 
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analyze many documents in one request. Each finished analysis is streamed as an
+    NDJSON line {"index", "id", "analysis", "result" | "error"}; the last line is
+    {"done": true, "count": ..., "ingestion": ...}. With "index": true all documents are
+    first added to the session's knowledge base in one batched embedding pass.
+    """
+    try:
+        if not ensure_agent():
+            return jsonify({"error": "RAG Agent not initialized"}), 500
+        
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('documents'), list) or not data['documents']:
+            return jsonify({"error": "documents must be a non-empty list"}), 400
+        if len(data['documents']) > MAX_BATCH_DOCUMENTS:
+            return jsonify({"error": f"Too many documents (limit {MAX_BATCH_DOCUMENTS})"}), 413
+        
+        ids, texts = [], []
+        for i, document in enumerate(data['documents']):
+            if isinstance(document, dict):
+                ids.append(document.get('id', i))
+                document = document.get('document_text')
+            else:
+                ids.append(i)
+            if not isinstance(document, str):
+                return jsonify({"error": f"documents[{i}] has no document_text"}), 400
+            texts.append(document)
+        
+        from rag_agent import ANALYSES #@UnresolvedImport
+        analysis_types = data.get('analysis_types') or list(ANALYSES)
+        unknown = [t for t in analysis_types if t not in ANALYSES]
+        if unknown:
+            return jsonify({"error": f"Unknown analysis types: {', '.join(map(str, unknown))}"}), 400
+        
+        session_id = get_session_id(data)
+        ingestion = rag_agent.add_documents(texts, session_id) if data.get('index') else None
+        
+        def generate():
+            count = 0
+            try:
+                for event in rag_agent.analyze_batch(texts, analysis_types):
+                    event["id"] = ids[event["index"]]
+                    count += 1
+                    yield json.dumps(event) + "\n"
+                yield json.dumps({"done": True, "count": count, "ingestion": ingestion, "sessionId": session_id}) + "\n"
+            except Exception as e:
+                logger.error(f"Error while streaming batch analysis: {str(e)}")
+                logger.error(traceback.format_exc())
+                yield json.dumps({"error": f"Batch analysis failed: {str(e)}"}) + "\n"
+        
+        return Response(generate(), mimetype='application/x-ndjson',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except Exception as e:
+        logger.error(f"Error in batch analysis: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
+
 @app.route('/query', methods=['POST'])
 def query_documents():
     """Query document knowledge base"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
         data = request.get_json()
@@ -322,19 +717,130 @@ def query_documents():
         
         question = data['question']
         context = data.get('context', '')
+        session_id = get_session_id(data)
         
         # Add documents if provided
+        ingestion = None
         if 'documents' in data:
-            rag_agent.add_documents(data['documents'])
+            ingestion = rag_agent.add_documents(data['documents'], session_id)
         
-        results = rag_agent.query(question, context)
+        if wants_stream(data):
+            return stream_answer(rag_agent.query_stream(question, context, session_id), data,
+                                 {"ingestion": ingestion, "sessionId": session_id})
+
+        results = rag_agent.query(question, context, session_id)
         
-        return jsonify({"response": results})
+        return jsonify({"response": results, "ingestion": ingestion, "sessionId": session_id})
     except Exception as e:
         logger.error(f"Error in document querying: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({"error": f"Query failed: {str(e)}"}), 500
 
+def run_analysis(analysis, document_text, analysis_types=None):
+    """Run one /analyze/* operation by name"""
+    if analysis == 'financial':
+        return rag_agent.generate_financial_insights(document_text)
+    if analysis == 'payment':
+        return rag_agent.extract_payment_details(document_text)
+    if analysis == 'validation':
+        return rag_agent.validate_document(document_text)
+    return rag_agent.analyze_document(document_text, analysis_types)
+
+def job_accepted(job):
+    """202 response pointing at the job's status URL"""
+    response = jsonify(job.to_dict())
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response, 202
+
+@app.route('/jobs/upload', methods=['POST'])
+def submit_upload_job():
+    """Queue an upload for background extraction and summarization"""
+    try:
+        if not ensure_agent():
+            return jsonify({"error": "RAG Agent not initialized"}), 500
+        
+        stream, file_extension = read_upload(detach=True)
+        try:
+            job = job_queue.submit("upload", process_upload, stream, file_extension, get_session_id())
+        except QueueFullError:
+            stream.close()
+            raise
+        return job_accepted(job)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    except Exception as e:
+        logger.error(f"Error queueing upload: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": f"Upload failed: {str(e)}"}), 500
+
+@app.route('/jobs/analyze/<analysis>', methods=['POST'])
+def submit_analysis_job(analysis):
+    """Queue a financial, payment, validation or comprehensive analysis"""
+    try:
+        if not ensure_agent():
+            return jsonify({"error": "RAG Agent not initialized"}), 500
+        
+        if analysis not in ('financial', 'payment', 'validation', 'comprehensive'):
+            return jsonify({"error": f"Unknown analysis type: {analysis}"}), 404
+        
+        data = request.get_json()
+        if not data or 'document_text' not in data:
+            return jsonify({"error": "document_text is required"}), 400
+        
+        job = job_queue.submit(f"analyze/{analysis}", run_analysis, analysis,
+                               data['document_text'], data.get('analysis_types'))
+        return job_accepted(job)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    except Exception as e:
+        logger.error(f"Error queueing analysis: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status and result; ?wait=<seconds> long-polls until the job finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    
+    try:
+        wait = float(request.args.get('wait', 0) or 0)
+    except ValueError:
+        wait = None
+    if wait is None or not math.isfinite(wait):
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    wait = min(wait, 60.0)
+    if wait > 0:
+        job.done.wait(wait)
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job(job_id):
+    """Server-Sent Events with the job's state on every status change, ending when it finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+
+    def generate():
+        last_status = None
+        while True:
+            with job.changed:
+                job.changed.wait_for(lambda: job.status != last_status, timeout=15)
+                status = job.status
+            if status == last_status:
+                yield ": keep-alive\n\n"
+                continue
+            last_status = status
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.errorhandler(404)
 def not_found(_error):
     return jsonify({"error": "Endpoint not found"}), 404
@@ -343,13 +849,19 @@ def not_found(_error):
 def extract_text_from_image():
     """Extract text from image files using OCR"""
     try:
-        if not rag_agent:
+        if not ensure_agent():
             return jsonify({"error": "RAG Agent not initialized"}), 500
         
-        if 'file' not in request.files:
+        try:
+            # Covers chunked uploads without a Content-Length, which only overflow while parsing
+            files = request.files
+        except RequestEntityTooLarge:
+            return jsonify({"error": f"File too large (limit {MAX_UPLOAD_BYTES} bytes)"}), 413
+        
+        if 'file' not in files:
             return jsonify({"error": "No file part"}), 400
         
-        file = request.files['file']
+        file = files['file']
         if file.filename == '':
             return jsonify({"error": "No selected file"}), 400
         
@@ -358,60 +870,68 @@ def extract_text_from_image():
             file_extension = os.path.splitext(file.filename)[1].lower()
             
             # Check if it's an image file
-            if file_extension not in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
+            if file_extension not in IMAGE_EXTENSIONS:
                 return jsonify({"error": f"Unsupported image type: {file_extension}"}), 400
             
-            # Save the file to a temporary location
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp:
-                file.save(tmp.name)
-                tmp_path = tmp.name
+            # Extract text using OCR directly from the upload stream
+            if not ocr_available():
+                return jsonify({
+                    "error": "OCR processing not available (PIL or pytesseract not installed)"
+                }), 500
             
+            from ocr_engine import OCRBusyError #@UnresolvedImport
             try:
-                # Extract text using OCR
-                if Image is None or pytesseract is None:
-                    return jsonify({
-                        "error": "OCR processing not available (PIL or pytesseract not installed)"
-                    }), 500
-                
-                image = Image.open(tmp_path)
-                extracted_text = pytesseract.image_to_string(image)
-                
-                if not extracted_text.strip():
-                    return jsonify({
-                        "text": "",
-                        "message": "No text found in image",
-                        "file_type": file_extension
-                    })
-                
-                # Generate a summary of the extracted text
-                summary = rag_agent.summarize_text(extracted_text)
-                
+                extracted_text = ocr_image_upload(file.stream.read(), file_extension)
+            except OCRBusyError as e:
+                return jsonify({"error": str(e)}), 503
+            
+            if not extracted_text.strip():
                 return jsonify({
-                    "text": extracted_text,
-                    "summary": summary,
-                    "file_type": file_extension,
-                    "text_length": len(extracted_text)
+                    "text": "",
+                    "message": "No text found in image",
+                    "file_type": file_extension
                 })
-            finally:
-                # Clean up the temporary file
-                os.remove(tmp_path)
+            
+            # Generate a summary of the extracted text
+            summary = rag_agent.summarize_text(extracted_text)
+            
+            return jsonify({
+                "text": extracted_text,
+                "summary": summary,
+                "file_type": file_extension,
+                "text_length": len(extracted_text)
+            })
     except Exception as e:
         logger.error(f"Error in text extraction: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({"error": f"Text extraction failed: {str(e)}"}), 500
 
+@app.errorhandler(413)
+def payload_too_large(_error):
+    return jsonify({"error": f"File too large (limit {MAX_UPLOAD_BYTES} bytes)"}), 413
+
 @app.errorhandler(500)
 def internal_error(_error):
     return jsonify({"error": "Internal server error"}), 500
 
 if __name__ == '__main__':
-    # Initialize the agent
-    if not initialize_agent():
-        logger.error("Failed to initialize RAG Agent. Exiting.")
+    if not os.getenv('GOOGLE_API_KEY'):
+        logger.error("GOOGLE_API_KEY not found in environment variables. Exiting.")
         sys.exit(1)
+
+    # Open the port first; the agent is initialized in the background or on first use
+    if WARMUP:
+        threading.Thread(target=warm_up, name="rag-warmup", daemon=True).start()
     
-    # Run the Flask app
     port = int(os.getenv('PORT', 5002))
+    if SERVER == 'async':
+        # async_service imports this module by name; hand it this instance rather than a second copy
+        sys.modules['python_service'] = sys.modules[__name__]
+        import async_service #@UnresolvedImport
+        async_service.run(port)
+        sys.exit(0)
+    
+    # Run the Flask app
     logger.info(f"Starting Python RAG Service on port {port}")
     print("Attempting to start Flask app with Waitress...")
     try:
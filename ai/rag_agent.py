@@ -1,40 +1,87 @@
+import asyncio
 import os
-import json
-import re
-from typing import List, Dict, Any, Optional
+import tempfile
+import threading
+import time
+import weakref
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional
 from datetime import datetime
 import logging
 
 from dotenv import load_dotenv
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI #@UnresolvedImport
-from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings #@UnresolvedImport
+from langchain_community.docstore.in_memory import InMemoryDocstore #@UnresolvedImport
 from langchain_community.vectorstores import FAISS #@UnresolvedImport
 from langchain.text_splitter import RecursiveCharacterTextSplitter #@UnresolvedImport
 from langchain.chains import RetrievalQA #@UnresolvedImport
 from langchain.prompts import PromptTemplate #@UnresolvedImport
 
+from json_extractor import SCHEMAS, extract_json
+from metrics import observe_llm, stage_timer
+from tracing import bind
+from answer_cache import SemanticAnswerCache
+from cassette import Cassette
+from embedding_backends import BRUTE_FORCE_MAX_VECTORS, VectorMatrix, build_embeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache, chunk_hash
+from hybrid_retriever import BM25Index, HybridRetriever
+from payment_extractor import PAYMENT_FIELDS, extract_payment_fields, unresolved_fields
+from response_cache import ResponseCache
+from session_store import SessionStore
+
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_json(text: str) -> Dict[str, Any]:
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        match = re.search(r'\{(?:[^{}]|(?R))*\}', text, re.DOTALL)  # recursive regex
-        if match:
-            try:
-                return json.loads(match.group())
-            except:
-                pass
-    return {"raw_response": text}
+# Bump a method's version whenever its prompt template changes so cached
+# responses produced by the old prompt are no longer served.
+PROMPT_VERSIONS = {
+    "summarize_text": "1",
+    "summarize_chunk": "1",
+    "summarize_reduce": "1",
+    "generate_financial_insights": "1",
+    "extract_payment_details": "1",
+    "validate_document": "1",
+}
+
+QA_PROMPT = PromptTemplate(
+    template="""
+        You are a precise assistant. Use only the context below to answer.
+        If the context does not contain enough information, say "I don't know."
+
+        Context:
+        {context}
+
+        Question:
+        {question}
+
+        Answer:
+        """,
+    input_variables=["context", "question"],
+)
+
+# Rough characters-per-token ratio used to turn token budgets into chunk sizes
+CHARS_PER_TOKEN = 4
+
+# analysis type -> (result key, RAGAgent method), in result order
+ANALYSES = {
+    "financial": ("financial_analysis", "generate_financial_insights"),
+    "payment": ("payment_analysis", "extract_payment_details"),
+    "validation": ("validation_analysis", "validate_document"),
+}
+
+def parse_for(method: str):
+    """Response parser for an analysis method, validating against its schema."""
+    return partial(extract_json, schema=SCHEMAS[method])
 
 class RAGAgent:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, response_cache: Optional[ResponseCache] = None):
         """
         Initialize the RAG Agent with LangChain and Google Generative AI.
+        Analysis results are cached in response_cache (built from RAG_CACHE_* env vars by default).
         """
         logger.info("Initializing RAGAgent...")
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
@@ -46,124 +93,608 @@ class RAGAgent:
             logger.info("Initializing ChatGoogleGenerativeAI...")
             self.llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=self.api_key, temperature=0.3, convert_system_message_to_human=True)
             logger.info("ChatGoogleGenerativeAI initialized.")
+            # Record or replay LLM and embedding calls (RAG_CASSETTE_MODE, see cassette)
+            self.cassette = Cassette.from_env()
+            if self.cassette:
+                self.llm = self.cassette.wrap_llm(self.llm)
 
-            logger.info("Initializing GoogleGenerativeAIEmbeddings...")
-            self.embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=self.api_key)
-            logger.info("GoogleGenerativeAIEmbeddings initialized.")
+            logger.info("Initializing embeddings...")
+            # Backend chosen by RAG_EMBEDDING_BACKEND (see embedding_backends)
+            embeddings, embedding_model = build_embeddings(self.api_key)
+            if self.cassette:
+                embeddings = self.cassette.wrap_embeddings(embeddings)
+            self.embeddings = CachedEmbeddings(
+                embeddings,
+                EmbeddingCache(
+                    os.getenv("RAG_EMBEDDING_CACHE_DIR", os.path.join(tempfile.gettempdir(), "rag_embedding_cache")),
+                    embedding_model,
+                ),
+            )
+            logger.info(f"Embeddings initialized ({embedding_model}).")
 
             self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-            # Dictionary to store session-specific vector stores
-            self.sessions = {}
-            self.documents = [] # Keep for compatibility
-            self.last_document_content = None
+            # Session-specific vector stores, persisted to disk and evicted from memory when idle
+            self.sessions = SessionStore.from_env(
+                self.embeddings, self._build_qa_chain, os.path.join(tempfile.gettempdir(), "rag_sessions")
+            )
+            # Per-session locks; entries disappear once no request holds them
+            self._session_locks = weakref.WeakValueDictionary()
+            self._session_locks_guard = threading.Lock()
+            self.answer_cache_stats = {"hits": 0, "misses": 0}
+            self._answer_stats_lock = threading.Lock()
+            self.response_cache = response_cache or ResponseCache.from_env()
+            # Bounded pool shared by all analyze_document calls
+            self.analysis_timeout = float(os.getenv("RAG_ANALYSIS_TIMEOUT_SECONDS", 60))
+            self.analysis_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("RAG_ANALYSIS_WORKERS", 6)), thread_name_prefix="rag-analysis"
+            )
+            # Texts longer than the token budget are summarized map-reduce style on this pool
+            self.summary_token_budget = int(os.getenv("RAG_SUMMARY_TOKEN_BUDGET", 3000))
+            self.summary_workers = int(os.getenv("RAG_SUMMARY_WORKERS", 8))
+            self.summary_executor = ThreadPoolExecutor(
+                max_workers=self.summary_workers, thread_name_prefix="rag-summary"
+            )
+            # Separate pool for bulk analyze_batch work so backfills cannot starve interactive analyses
+            self.batch_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("RAG_BATCH_WORKERS", 8)), thread_name_prefix="rag-batch"
+            )
             logger.info("RAGAgent initialized successfully.")
         except Exception as e:
             logger.error(f"Error during RAGAgent initialization: {e}", exc_info=True)
             raise
             
-    def clear_session(self, session_id: str) -> None:
+    def session_lock(self, session_id: str) -> threading.RLock:
+        """
+        Return the lock guarding a session's state. Requests for different
+        sessions never contend with each other.
+        """
+        with self._session_locks_guard:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = threading.RLock()
+                self._session_locks[session_id] = lock
+            return lock
+
+    def clear_session(self, session_id: str) -> bool:
         """
         Clear a specific session context
         """
-        if session_id in self.sessions:
-            logger.info(f"Clearing session: {session_id}")
-            del self.sessions[session_id]
-            return True
-        return False
+        with self.session_lock(session_id):
+            if session_id in self.sessions:
+                logger.info(f"Clearing session: {session_id}")
+                del self.sessions[session_id]
+                return True
+            return False
+
+    def set_document(self, document_text: str, session_id: str = "default") -> None:
+        """
+        Record the latest uploaded document for a session; it is indexed on the next chat turn.
+        """
+        with self.session_lock(session_id):
+            session = self.sessions.setdefault(session_id, {})
+            session['last_document_content'] = document_text
+            # Fallback answers are based on this document, so earlier ones are stale
+            session.pop('answer_cache', None)
+            self.sessions.persist(session_id, session)
+
+    def get_document(self, session_id: str = "default") -> Optional[str]:
+        """
+        Return the latest uploaded document for a session, if any.
+        """
+        with self.session_lock(session_id):
+            if session_id not in self.sessions:
+                return None
+            return self.sessions[session_id].get('last_document_content')
 
-    def add_documents(self, documents: List[str], session_id: str = "default") -> None:
+    def _invoke_cached(self, method: str, document_text: str, prompt: str, parse=None) -> Any:
+        """
+        Invoke the LLM for an analysis method, serving repeats from the response cache.
+        Exceptions propagate so that failed calls are never cached.
+        """
+        key = ResponseCache.make_key(method, PROMPT_VERSIONS[method], self.llm.model, document_text)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            logger.info(f"Response cache hit for {method}")
+            return cached
+
+        with stage_timer("llm", method=method):
+            response = self.llm.invoke(prompt)
+        observe_llm(method, prompt, response.content)
+        result = parse(response.content) if parse else response.content
+        self._store_response(key, result)
+        return result
+
+    def _store_response(self, key: str, result: Any) -> None:
+        """Cache a result unless parsing fell back to raw_response; a bad reply is not replayed for the TTL."""
+        if not (isinstance(result, dict) and "raw_response" in result):
+            self.response_cache.set(key, result)
+
+    async def _ainvoke_cached(self, method: str, document_text: str, prompt: str, parse=None) -> Any:
+        """Async _invoke_cached: the LLM call awaits the model's async API instead of holding a thread."""
+        key = ResponseCache.make_key(method, PROMPT_VERSIONS[method], self.llm.model, document_text)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            logger.info(f"Response cache hit for {method}")
+            return cached
+
+        with stage_timer("llm", method=method):
+            response = await self.llm.ainvoke(prompt)
+        observe_llm(method, prompt, response.content)
+        result = parse(response.content) if parse else response.content
+        self._store_response(key, result)
+        return result
+
+    def add_documents(self, documents: List[str], session_id: str = "default") -> Dict[str, int]:
         """
         Add documents to the knowledge base for a specific session.
+        Documents and chunks already indexed in the session are skipped, so repeated
+        calls with the same content leave the vector store unchanged.
         """
+        counts = {"documents_added": 0, "documents_skipped": 0, "chunks_added": 0, "chunks_skipped": 0}
         if not documents:
-            return
-        
-        self.documents.extend(documents)
-        texts = []
+            return counts
+
+        with self.session_lock(session_id):
+            session = self.sessions.setdefault(session_id, {})
+            document_hashes = session.setdefault('document_hashes', set())
+            chunk_hashes = session.setdefault('chunk_hashes', set())
+
+            # Fingerprints are only recorded once the chunks are actually indexed
+            new_documents, new_document_hashes, new_chunk_hashes, texts = self._split_new(
+                documents, document_hashes, chunk_hashes, counts
+            )
+            logger.info(f"Session {session_id}: added {counts['chunks_added']} chunks, skipped {counts['chunks_skipped']} chunks "
+                        f"and {counts['documents_skipped']} already indexed documents")
+
+            if not new_documents:
+                return counts
+
+            # Create or update session-specific vector store
+            if texts:
+                with stage_timer("index", chunks=len(texts)):
+                    if 'vector_store' in session:
+                        self.sessions.ensure_writable(session_id, session)
+                        vector_store = session['vector_store']
+                        ids = vector_store.add_texts(texts)
+                        if isinstance(vector_store.index, VectorMatrix) and vector_store.index.ntotal > BRUTE_FORCE_MAX_VECTORS:
+                            # Outgrew the NumPy scan; the faiss index is built once, from vectors already held
+                            vector_store.index = vector_store.index.to_faiss()
+                        session['qa_chain'].retriever.add_texts(ids, texts)
+                    else:
+                        if len(texts) <= BRUTE_FORCE_MAX_VECTORS:
+                            # Small sessions keep a NumPy matrix and never build a faiss index
+                            session['vector_store'] = FAISS(self.embeddings, VectorMatrix(), InMemoryDocstore(), {})
+                            session['vector_store'].add_texts(texts)
+                        else:
+                            session['vector_store'] = FAISS.from_texts(texts, self.embeddings)
+                        # The retriever reads the live vector store and is given new chunks' IDs
+                        # for its BM25 index, so the chain only needs building once
+                        session['qa_chain'] = self._build_qa_chain(session['vector_store'])
+
+            session.pop('answer_cache', None)
+            session.setdefault('document_content', new_documents[0])
+            document_hashes.update(new_document_hashes)
+            chunk_hashes.update(new_chunk_hashes)
+            self.sessions.persist(session_id, session)
+            return counts
+
+    def _split_new(self, documents: List[str], document_hashes, chunk_hashes, counts: Dict[str, int]):
+        """
+        Split the documents not in document_hashes into chunks not in chunk_hashes, updating counts.
+        Returns (new documents, their hashes, new chunk hashes, new chunk texts).
+        """
+        new_documents, new_document_hashes, new_chunk_hashes, texts = [], set(), set(), []
         for doc in documents:
-            texts.extend(self.text_splitter.split_text(doc))
-        
-        # Create or update session-specific vector store
-        if session_id in self.sessions and 'vector_store' in self.sessions[session_id]:
-            self.sessions[session_id]['vector_store'].add_texts(texts)
-        else:
-            # Initialize session if it doesn't exist
-            if session_id not in self.sessions:
-                self.sessions[session_id] = {}
-            
-            # Create new vector store for this session
-            self.sessions[session_id]['vector_store'] = FAISS.from_texts(texts, self.embeddings)
-            self.sessions[session_id]['document_content'] = documents[0] if documents else ""
-        
-        # Create retriever and QA chain for this session
-        retriever = self.sessions[session_id]['vector_store'].as_retriever()
+            doc_hash = chunk_hash(doc)
+            if doc_hash in document_hashes or doc_hash in new_document_hashes:
+                counts["documents_skipped"] += 1
+                continue
+            new_document_hashes.add(doc_hash)
+            new_documents.append(doc)
+            counts["documents_added"] += 1
 
-        prompt_template = """
-        You are a precise assistant. Use only the context below to answer.
-        If the context does not contain enough information, say "I don't know."
+            with stage_timer("text_split"):
+                doc_chunks = self.text_splitter.split_text(doc)
+            for text in doc_chunks:
+                text_hash = chunk_hash(text)
+                if text_hash in chunk_hashes or text_hash in new_chunk_hashes:
+                    counts["chunks_skipped"] += 1
+                    continue
+                new_chunk_hashes.add(text_hash)
+                texts.append(text)
+        counts["chunks_added"] = len(texts)
+        return new_documents, new_document_hashes, new_chunk_hashes, texts
 
-        Context:
-        {context}
+    def _unindexed_chunks(self, documents: List[str], session_id: str) -> List[str]:
+        """Chunks of documents that add_documents would still have to embed for the session."""
+        with self.session_lock(session_id):
+            session = self.sessions[session_id] if session_id in self.sessions else {}
+            counts = dict.fromkeys(("documents_added", "documents_skipped", "chunks_added", "chunks_skipped"), 0)
+            return self._split_new(documents, session.get('document_hashes', set()),
+                                   session.get('chunk_hashes', set()), counts)[3]
 
-        Question:
-        {question}
+    async def aadd_documents(self, documents: List[str], session_id: str = "default") -> Dict[str, int]:
+        """
+        Async add_documents. New chunks are embedded with the embeddings' async API
+        first; the indexing that follows on a worker thread then finds them in the
+        embedding cache, so no thread waits on the embedding backend.
+        """
+        texts = await asyncio.to_thread(self._unindexed_chunks, documents, session_id) if documents else []
+        if texts:
+            await self.embeddings.aembed_documents(texts)
+        return await asyncio.to_thread(self.add_documents, documents, session_id)
 
-        Answer:
+    def _build_qa_chain(self, vector_store) -> RetrievalQA:
         """
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
+        Create the retrieval QA chain for a session's vector store, retrieving with
+        BM25 and FAISS combined (see hybrid_retriever).
+        """
+        retriever = HybridRetriever(vector_store=vector_store, bm25=BM25Index.from_vector_store(vector_store))
 
-        self.sessions[session_id]['qa_chain'] = RetrievalQA.from_chain_type(
+        return RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff",
             retriever=retriever,
-            chain_type_kwargs={"prompt": PROMPT}
+            chain_type_kwargs={"prompt": QA_PROMPT}
         )
 
-    def query(self, question: str, context: Optional[str] = None, session_id: str = "default") -> Dict[str, Any]:
+    def _plan_answer(self, session_id: str, question: str, context: Optional[str]):
         """
-        Query the knowledge base with a question for a specific session.
+        Match the question exactly in the session's answer cache and list the texts
+        the rest of the query needs embedded. Returns (cache, answer, texts); cache is
+        None when there is nothing to cache into, answer is None on a miss, and texts
+        is empty when a lexical-only retrieval will answer, so a confident keyword
+        question makes no embedding call.
         """
-        if session_id not in self.sessions or 'qa_chain' not in self.sessions[session_id]:
-            # Fallback to old method if no documents are added yet for this session
-            prompt = f"""Based on the following documents and context, please answer the question:
-            Documents: {' '.join(self.documents[-5:])}
-            Context: {context or 'No additional context'}
-            Question: {question}
-            Please provide a comprehensive and accurate answer based on the available information."""
-            
+        with self.session_lock(session_id):
+            if session_id not in self.sessions:
+                return None, None, []
+            session = self.sessions[session_id]
+            cache = session.get('answer_cache')
+            if cache is None:
+                cache = session['answer_cache'] = SemanticAnswerCache()
+            if not cache.enabled:
+                cache = None
+            else:
+                answer = cache.lookup_exact(question, context or '')
+                if answer is not None:
+                    return cache, answer, []
+
+            qa_chain = session.get('qa_chain')
+            if qa_chain is None:
+                # The fallback prompt embeds nothing; only a semantic lookup would
+                return cache, None, [question] if cache is not None else []
+            query_text = self._query_text(question, context)
+            if qa_chain.retriever.lexical_only(query_text):
+                return cache, None, []
+            return cache, None, list(dict.fromkeys([query_text] + ([question] if cache is not None else [])))
+
+    def _match_answer(self, session_id: str, cache, question: str, context: Optional[str],
+                      answer: Optional[str], vectors: Dict[str, List[float]]):
+        """Look the question's embedding up when there was no exact match and count the outcome. Returns (embedding, answer)."""
+        embedding = vectors.get(question)
+        if cache is None:
+            return embedding, None
+        if answer is None and embedding is not None:
+            answer = cache.lookup(embedding, context or '')
+        with self._answer_stats_lock:
+            self.answer_cache_stats["hits" if answer is not None else "misses"] += 1
+        if answer is not None:
+            logger.info(f"Answer cache hit for session {session_id}")
+        return embedding, answer
+
+    def _lookup_answer(self, session_id: str, question: str, context: Optional[str]):
+        """
+        Check the session's answer cache. Returns (cache, embedding, answer).
+        Embeddings are computed outside the session lock; retrieval then finds the
+        query's in the query embedding cache.
+        """
+        cache, answer, texts = self._plan_answer(session_id, question, context)
+        vectors = {}
+        for text in texts:
             try:
-                response = self.llm.invoke(prompt)
-                return {"answer": response.content}
+                vectors[text] = self.embeddings.embed_query(text)
             except Exception as e:
-                logger.error(f"Error generating response: {e}", exc_info=True)
-                return {"answer": f"Error generating response: {str(e)}"}
-        
-        query_text = f"Context: {context}\n\nQuestion: {question}" if context else question
+                logger.warning(f"Skipping answer cache, could not embed question: {e}")
+                break
+        embedding, answer = self._match_answer(session_id, cache, question, context, answer, vectors)
+        return cache, embedding, answer
+
+    async def _alookup_answer(self, session_id: str, question: str, context: Optional[str]):
+        """Async _lookup_answer, embedding with the embeddings' async API."""
+        cache, answer, texts = await asyncio.to_thread(self._plan_answer, session_id, question, context)
+        vectors = {}
+        if texts:
+            try:
+                vectors = dict(zip(texts, await asyncio.gather(*(self.embeddings.aembed_query(t) for t in texts))))
+            except Exception as e:
+                logger.warning(f"Skipping answer cache, could not embed question: {e}")
+        embedding, answer = self._match_answer(session_id, cache, question, context, answer, vectors)
+        return cache, embedding, answer
+
+    def query(self, question: str, context: Optional[str] = None, session_id: str = "default") -> Dict[str, Any]:
+        """
+        Query the knowledge base with a question for a specific session.
+        Near-identical repeat questions are answered from the session's answer cache.
+        Retrieval happens under the session lock, generation outside it.
+        """
+        cache, embedding, cached = self._lookup_answer(session_id, question, context)
+        if cached is not None:
+            return {"answer": cached, "cached": True}
         try:
-            result = self.sessions[session_id]['qa_chain']({"query": query_text})
-            return {"answer": result.get("result", "No answer found.")}
+            # Retrieval holds the session lock; generation runs after it is released
+            prompt = self._build_prompt(question, context, session_id)
         except Exception as e:
             logger.error(f"Error during query: {e}", exc_info=True)
             return {"answer": f"Error during query: {str(e)}"}
+        try:
+            with stage_timer("llm", method="query"):
+                response = self.llm.invoke(prompt)
+            observe_llm("query", prompt, response.content)
+        except Exception as e:
+            logger.error(f"Error generating response: {e}", exc_info=True)
+            return {"answer": f"Error generating response: {str(e)}"}
+        # A cache dropped meanwhile by set_document/add_documents is detached, so this store is harmless
+        if cache is not None:
+            cache.store(question, embedding, context or '', response.content)
+        return {"answer": response.content}
+
+    def query_stream(self, question: str, context: Optional[str] = None, session_id: str = "default") -> Iterator[str]:
+        """
+        Stream the answer to a question token by token for a specific session.
+        Retrieval happens under the session lock; generation streams straight from the LLM.
+        A cached answer is yielded as a single token. Errors propagate to the caller.
+        """
+        cache, embedding, cached, prompt = self._prepare_prompt(question, context, session_id)
+        if cached is not None:
+            yield cached
+            return
+
+        answer = []
+        with stage_timer("llm", method="query_stream"):
+            for chunk in self.llm.stream(prompt):
+                if chunk.content:
+                    answer.append(chunk.content)
+                    yield chunk.content
+        observe_llm("query_stream", prompt, "".join(answer))
+        if cache is not None:
+            cache.store(question, embedding, context or '', "".join(answer))
+
+    async def aquery(self, question: str, context: Optional[str] = None, session_id: str = "default") -> Dict[str, Any]:
+        """
+        Async query. Retrieval runs on a worker thread under the session lock and the
+        answer is generated with the LLM's async API, using the same prompt the
+        RetrievalQA chain would build.
+        """
+        cache, embedding, cached, prompt = await self._aprepare_prompt(question, context, session_id)
+        if cached is not None:
+            return {"answer": cached, "cached": True}
+        try:
+            with stage_timer("llm", method="query"):
+                response = await self.llm.ainvoke(prompt)
+            observe_llm("query", prompt, response.content)
+        except Exception as e:
+            logger.error(f"Error generating response: {e}", exc_info=True)
+            return {"answer": f"Error generating response: {str(e)}"}
+        if cache is not None:
+            cache.store(question, embedding, context or '', response.content)
+        return {"answer": response.content}
+
+    async def aquery_stream(self, question: str, context: Optional[str] = None,
+                            session_id: str = "default") -> AsyncIterator[str]:
+        """Async query_stream, streaming tokens from the LLM's async API."""
+        cache, embedding, cached, prompt = await self._aprepare_prompt(question, context, session_id)
+        if cached is not None:
+            yield cached
+            return
+
+        answer = []
+        with stage_timer("llm", method="query_stream"):
+            async for chunk in self.llm.astream(prompt):
+                if chunk.content:
+                    answer.append(chunk.content)
+                    yield chunk.content
+        observe_llm("query_stream", prompt, "".join(answer))
+        if cache is not None:
+            cache.store(question, embedding, context or '', "".join(answer))
+
+    @staticmethod
+    def _query_text(question: str, context: Optional[str]) -> str:
+        return f"Context: {context}\n\nQuestion: {question}" if context else question
+
+    def _prepare_prompt(self, question: str, context: Optional[str], session_id: str):
+        """
+        Check the answer cache and, on a miss, retrieve and build the generation prompt
+        under the session lock. Returns (cache, embedding, cached answer, prompt).
+        """
+        cache, embedding, cached = self._lookup_answer(session_id, question, context)
+        if cached is not None:
+            return cache, embedding, cached, None
+        return cache, embedding, None, self._build_prompt(question, context, session_id)
+
+    async def _aprepare_prompt(self, question: str, context: Optional[str], session_id: str):
+        """Async _prepare_prompt; retrieval runs on a worker thread."""
+        cache, embedding, cached = await self._alookup_answer(session_id, question, context)
+        if cached is not None:
+            return cache, embedding, cached, None
+        return cache, embedding, None, await asyncio.to_thread(self._build_prompt, question, context, session_id)
+
+    def _build_prompt(self, question: str, context: Optional[str], session_id: str) -> str:
+        """Retrieve under the session lock and build the prompt the RetrievalQA chain would."""
+        with self.session_lock(session_id):
+            session = self.sessions[session_id] if session_id in self.sessions else {}
+            if 'qa_chain' in session:
+                query_text = self._query_text(question, context)
+                docs = session['qa_chain'].retriever.invoke(query_text)
+                return QA_PROMPT.format(
+                    context="\n\n".join(doc.page_content for doc in docs), question=query_text
+                )
+            return self._fallback_prompt(question, context, session.get('last_document_content') or '')
+
+    @staticmethod
+    def _fallback_prompt(question: str, context: Optional[str], session_document: str) -> str:
+        return f"""Based on the following documents and context, please answer the question:
+        Documents: {session_document}
+        Context: {context or 'No additional context'}
+        Question: {question}
+        Please provide a comprehensive and accurate answer based on the available information."""
 
     def summarize_text(self, text: str) -> str:
         """
         Summarize a given text using the LLM.
+        Texts over the summary token budget are summarized map-reduce style.
         """
-        prompt = f"""Please summarize the following text:
+        try:
+            with stage_timer("summarize", chars=len(text)):
+                if len(text) > self.summary_token_budget * CHARS_PER_TOKEN:
+                    return self._summarize_map_reduce(text)
+                return self._invoke_cached("summarize_text", text, self._summary_prompt(text))
+        except Exception as e:
+            return f"Error generating summary: {str(e)}"
+
+    async def asummarize_text(self, text: str) -> str:
+        """Async summarize_text."""
+        try:
+            with stage_timer("summarize", chars=len(text)):
+                if len(text) > self.summary_token_budget * CHARS_PER_TOKEN:
+                    return await self._asummarize_map_reduce(text)
+                return await self._ainvoke_cached("summarize_text", text, self._summary_prompt(text))
+        except Exception as e:
+            return f"Error generating summary: {str(e)}"
+
+    @staticmethod
+    def _summary_prompt(text: str) -> str:
+        return f"""Please summarize the following text:
         Text: {text}
         
         Summary:"""
+
+    @staticmethod
+    def _section_summary_prompt(group: str) -> str:
+        return f"""Summarize this section of a longer financial document. Keep every amount, date, party and reference ID.
+        Section: {group}
+
+        Summary:"""
+
+    def _pack(self, pieces: List[str]) -> List[str]:
+        """Join consecutive pieces into groups that fit the summary token budget."""
+        budget = self.summary_token_budget * CHARS_PER_TOKEN
+        groups, current = [], ""
+        for piece in pieces:
+            if current and len(current) + len(piece) + 2 > budget:
+                groups.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+        if current:
+            groups.append(current)
+        return groups
+
+    def _summarize_map_reduce(self, text: str) -> str:
+        """
+        Split text with the agent's text splitter, summarize the budget-sized groups
+        concurrently, then reduce the partial summaries (recursively while they
+        still exceed the budget) into one summary.
+        """
+        with stage_timer("text_split"):
+            groups = self._pack(self.text_splitter.split_text(text))
+        logger.info(f"Map-reduce summary over {len(groups)} groups ({len(text)} chars)")
+        # One deadline covers the map phase and every reduce round
+        deadline = time.monotonic() + self.analysis_timeout
+
+        def results(futures):
+            try:
+                return [f.result(timeout=max(0.0, deadline - time.monotonic())) for f in futures]
+            finally:
+                for f in futures:
+                    f.cancel()
+
+        partials = results([
+            self.summary_executor.submit(
+                bind(self._invoke_cached), "summarize_chunk", group, self._section_summary_prompt(group)
+            )
+            for group in groups
+        ])
+        while True:
+            groups = self._reduce_groups(partials)
+            if len(groups) == 1:
+                break
+            partials = results([self.summary_executor.submit(bind(self._reduce_summaries), group) for group in groups])
+        return results([self.summary_executor.submit(bind(self._reduce_summaries), groups[0])])[0]
+
+    async def _asummarize_map_reduce(self, text: str) -> str:
+        """
+        Async _summarize_map_reduce. At most RAG_SUMMARY_WORKERS section summaries
+        are in flight at once, as on the summary executor.
+        """
+        with stage_timer("text_split"):
+            groups = self._pack(await asyncio.to_thread(self.text_splitter.split_text, text))
+        logger.info(f"Map-reduce summary over {len(groups)} groups ({len(text)} chars)")
+        limit = asyncio.Semaphore(self.summary_workers)
+
+        async def limited(method, *args):
+            async with limit:
+                return await method(*args)
+
+        deadline = time.monotonic() + self.analysis_timeout
+
+        def remaining() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        partials = await asyncio.wait_for(
+            asyncio.gather(*(
+                limited(self._ainvoke_cached, "summarize_chunk", group, self._section_summary_prompt(group))
+                for group in groups
+            )),
+            remaining(),
+        )
+        while True:
+            groups = self._reduce_groups(partials)
+            if len(groups) == 1:
+                break
+            partials = await asyncio.wait_for(
+                asyncio.gather(*(limited(self._areduce_summaries, group) for group in groups)), remaining()
+            )
+        return await asyncio.wait_for(self._areduce_summaries(groups[0]), remaining())
+
+    def _reduce_groups(self, partials: List[str]) -> List[str]:
+        """Groups for the next reduce round over partial summaries; a single group ends the reduction."""
+        groups = self._pack(partials)
+        if 1 < len(groups) == len(partials):
+            # Each partial alone exceeds the budget; pair them up so every round shrinks
+            groups = ["\n\n".join(partials[i:i + 2]) for i in range(0, len(partials), 2)]
+        return groups
+
+    def _reduce_summaries(self, summaries: str) -> str:
+        return self._invoke_cached("summarize_reduce", summaries, self._reduce_prompt(summaries))
+
+    async def _areduce_summaries(self, summaries: str) -> str:
+        return await self._ainvoke_cached("summarize_reduce", summaries, self._reduce_prompt(summaries))
+
+    @staticmethod
+    def _reduce_prompt(summaries: str) -> str:
+        return f"""The following are summaries of consecutive sections of one document.
+        Combine them into a single coherent summary of the whole document.
+        Section summaries: {summaries}
+
+        Summary:"""
+
+    def generate_financial_insights(self, financial_data: str) -> Dict[str, Any]:
         try:
-            response = self.llm.invoke(prompt)
-            return response.content
+            return self._invoke_cached("generate_financial_insights", financial_data,
+                                       self._insights_prompt(financial_data), parse=parse_for("generate_financial_insights"))
         except Exception as e:
-            return f"Error generating summary: {str(e)}"
+            return {"error": f"Error generating financial insights: {str(e)}"}
 
-    def generate_financial_insights(self, financial_data: str) -> Dict[str, Any]:
-        prompt = f"""Analyze the following financial data and provide comprehensive insights:
+    async def agenerate_financial_insights(self, financial_data: str) -> Dict[str, Any]:
+        try:
+            return await self._ainvoke_cached("generate_financial_insights", financial_data,
+                                              self._insights_prompt(financial_data), parse=parse_for("generate_financial_insights"))
+        except Exception as e:
+            return {"error": f"Error generating financial insights: {str(e)}"}
+
+    @staticmethod
+    def _insights_prompt(financial_data: str) -> str:
+        return f"""Analyze the following financial data and provide comprehensive insights:
         Financial Data: {financial_data}
         Please provide insights on:
         1. Key financial metrics
@@ -177,15 +708,69 @@ class RAGAgent:
             "recommendations": [], "payment_behavior": {{}}
         }}
         """
-        
+
+    def extract_payment_details(self, document_text: str) -> Dict[str, Any]:
+        """
+        Extract payment details with the local rule-based extractor first. The LLM
+        is only called when a required field (amount, currency, date, transaction ID,
+        status) is missing or below the confidence threshold, and it only fills those gaps.
+        """
+        details, missing = self._extract_payment_details_local(document_text)
+        if not missing:
+            return details
+        return self._merge_payment_details(details, missing, self._extract_payment_details_llm(document_text))
+
+    async def aextract_payment_details(self, document_text: str) -> Dict[str, Any]:
+        """Async extract_payment_details; the rule-based extraction runs on a worker thread."""
+        details, missing = await asyncio.to_thread(self._extract_payment_details_local, document_text)
+        if not missing:
+            return details
+        return self._merge_payment_details(details, missing, await self._aextract_payment_details_llm(document_text))
+
+    @staticmethod
+    def _extract_payment_details_local(document_text: str):
+        """Rule-based payment details and the required fields they leave unresolved."""
+        details, confidence = extract_payment_fields(document_text)
+        details["field_confidence"] = confidence
+        details["extraction_method"] = "local"
+        return details, unresolved_fields(confidence)
+
+    @staticmethod
+    def _merge_payment_details(details: Dict[str, Any], missing, llm_details) -> Dict[str, Any]:
+        """Fill the locally unresolved fields from the LLM's extraction."""
+        if not isinstance(llm_details, dict) or "error" in llm_details:
+            details["llm_error"] = llm_details.get("error") if isinstance(llm_details, dict) else "Unexpected LLM response"
+            return details
+
+        filled = []
+        for field in PAYMENT_FIELDS:
+            value = llm_details.get(field)
+            if value and (field in missing or not details[field]):
+                details[field] = value
+                filled.append(field)
+        if isinstance(llm_details.get("additional_details"), dict):
+            details["additional_details"] = {**llm_details["additional_details"], **details["additional_details"]}
+        details["extraction_method"] = "local+llm"
+        details["llm_fields"] = filled
+        return details
+
+    def _extract_payment_details_llm(self, document_text: str) -> Dict[str, Any]:
         try:
-            response = self.llm.invoke(prompt)
-            return extract_json(response.content)
+            return self._invoke_cached("extract_payment_details", document_text,
+                                       self._payment_prompt(document_text), parse=parse_for("extract_payment_details"))
         except Exception as e:
-            return {"error": f"Error generating financial insights: {str(e)}"}
+            return {"error": f"Error extracting payment details: {str(e)}"}
 
-    def extract_payment_details(self, document_text: str) -> Dict[str, Any]:
-        prompt = f"""Extract payment details from the following document:
+    async def _aextract_payment_details_llm(self, document_text: str) -> Dict[str, Any]:
+        try:
+            return await self._ainvoke_cached("extract_payment_details", document_text,
+                                              self._payment_prompt(document_text), parse=parse_for("extract_payment_details"))
+        except Exception as e:
+            return {"error": f"Error extracting payment details: {str(e)}"}
+
+    @staticmethod
+    def _payment_prompt(document_text: str) -> str:
+        return f"""Extract payment details from the following document:
         Document: {document_text}
         Please extract and return the following information in JSON format:
         {{
@@ -194,15 +779,24 @@ class RAGAgent:
             "status": "", "description": "", "additional_details": {{}}
         }}
         If a field is not found, leave it empty. Be precise with amounts and dates."""
-        
+
+    def validate_document(self, document_text: str) -> Dict[str, Any]:
         try:
-            response = self.llm.invoke(prompt)
-            return extract_json(response.content)
+            return self._invoke_cached("validate_document", document_text,
+                                       self._validation_prompt(document_text), parse=parse_for("validate_document"))
         except Exception as e:
-            return {"error": f"Error extracting payment details: {str(e)}"}
+            return {"error": f"Error validating document: {str(e)}"}
 
-    def validate_document(self, document_text: str) -> Dict[str, Any]:
-        prompt = f"""Validate the following document for authenticity and completeness:
+    async def avalidate_document(self, document_text: str) -> Dict[str, Any]:
+        try:
+            return await self._ainvoke_cached("validate_document", document_text,
+                                              self._validation_prompt(document_text), parse=parse_for("validate_document"))
+        except Exception as e:
+            return {"error": f"Error validating document: {str(e)}"}
+
+    @staticmethod
+    def _validation_prompt(document_text: str) -> str:
+        return f"""Validate the following document for authenticity and completeness:
         Document: {document_text}
         Please analyze and return validation results in JSON format:
         {{
@@ -216,22 +810,89 @@ class RAGAgent:
             "extraction_summary": {{}}
         }}
         Be thorough in your validation and provide specific details about any issues found."""
-        
-        try:
-            response = self.llm.invoke(prompt)
-            return extract_json(response.content)
-        except Exception as e:
-            return {"error": f"Error validating document: {str(e)}"}
 
-    def analyze_document(self, document_text: str, analysis_types: List[str] = None) -> Dict[str, Any]:
+    def analyze_document(self, document_text: str, analysis_types: List[str] = None,
+                         timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Run the selected analyses concurrently on the analysis executor.
+        Each analysis gets its own timeout and a failure only affects its own result key.
+        """
+        analysis_types = analysis_types or ["financial", "payment", "validation"]
+        timeout = self.analysis_timeout if timeout is None else timeout
+
+        futures = {}
+        for analysis_type, (result_key, method) in ANALYSES.items():
+            if analysis_type in analysis_types:
+                futures[result_key] = self.analysis_executor.submit(bind(getattr(self, method)), document_text)
+
+        deadline = time.monotonic() + timeout
+        results = {}
+        for result_key, future in futures.items():
+            try:
+                results[result_key] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FuturesTimeoutError:
+                future.cancel()
+                logger.error(f"{result_key} timed out after {timeout}s")
+                results[result_key] = {"error": f"Analysis timed out after {timeout} seconds"}
+            except Exception as e:
+                logger.error(f"{result_key} failed: {e}", exc_info=True)
+                results[result_key] = {"error": f"Analysis failed: {str(e)}"}
+        results["timestamp"] = datetime.now().isoformat()
+        results["analysis_type"] = analysis_types
+        return results
+
+    async def aanalyze_document(self, document_text: str, analysis_types: List[str] = None,
+                                timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Async analyze_document: the analyses run as concurrent tasks sharing one deadline."""
         analysis_types = analysis_types or ["financial", "payment", "validation"]
+        timeout = self.analysis_timeout if timeout is None else timeout
+
+        tasks = {}
+        for analysis_type, (result_key, method) in ANALYSES.items():
+            if analysis_type in analysis_types:
+                tasks[result_key] = asyncio.ensure_future(getattr(self, f"a{method}")(document_text))
+
+        if tasks:
+            await asyncio.wait(tasks.values(), timeout=timeout)
         results = {}
-        if "financial" in analysis_types:
-            results["financial_analysis"] = self.generate_financial_insights(document_text)
-        if "payment" in analysis_types:
-            results["payment_analysis"] = self.extract_payment_details(document_text)
-        if "validation" in analysis_types:
-            results["validation_analysis"] = self.validate_document(document_text)
+        for result_key, task in tasks.items():
+            if not task.done():
+                task.cancel()
+                logger.error(f"{result_key} timed out after {timeout}s")
+                results[result_key] = {"error": f"Analysis timed out after {timeout} seconds"}
+                continue
+            try:
+                results[result_key] = task.result()
+            except Exception as e:
+                logger.error(f"{result_key} failed: {e}", exc_info=True)
+                results[result_key] = {"error": f"Analysis failed: {str(e)}"}
         results["timestamp"] = datetime.now().isoformat()
         results["analysis_type"] = analysis_types
-        return results
\ No newline at end of file
+        return results
+
+    def analyze_batch(self, documents: List[str], analysis_types: List[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Run the selected analyses on every document on the batch executor and yield
+        {"index", "analysis", "result" or "error"} events in completion order.
+        Closing the iterator early cancels the work that has not started yet.
+        """
+        analysis_types = analysis_types or list(ANALYSES)
+        futures = {}
+        for index, document_text in enumerate(documents):
+            for analysis_type in analysis_types:
+                _, method = ANALYSES[analysis_type]
+                futures[self.batch_executor.submit(bind(getattr(self, method)), document_text)] = (index, analysis_type)
+
+        try:
+            for future in as_completed(futures):
+                index, analysis_type = futures[future]
+                event = {"index": index, "analysis": analysis_type}
+                try:
+                    event["result"] = future.result()
+                except Exception as e:
+                    logger.error(f"Batch {analysis_type} analysis of document {index} failed: {e}", exc_info=True)
+                    event["error"] = f"Analysis failed: {str(e)}"
+                yield event
+        finally:
+            for future in futures:
+                future.cancel()
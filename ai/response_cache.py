@@ -0,0 +1,217 @@
+"""
+Content-addressed cache for RAGAgent LLM responses.
+
+Entries are keyed by (method, prompt template version, model name, normalized
+document hash). Lookups go through an in-process LRU first and then an optional
+SQLite file, so repeat analyses of the same document skip the Gemini round-trip.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Disk hits only rewrite accessed_at when the stored value is older than this;
+# LRU trimming does not need finer resolution and every rewrite is a commit
+ACCESS_WRITE_INTERVAL_SECONDS = 60
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so cosmetic differences map to the same cache entry."""
+    return _WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+def document_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of the normalized document text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 24 * 3600,
+                 db_path: Optional[str] = None, max_db_entries: int = 10000):
+        """
+        Initialize the cache.
+
+        max_entries bounds the in-memory LRU tier, ttl_seconds applies to both
+        tiers (0 disables expiry) and db_path enables the on-disk SQLite tier,
+        which is trimmed to max_db_entries least recently used rows.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None  # writes, under _lock
+        self._readers = threading.local()  # per-thread read connections, used without _lock
+        self._db_count = 0  # rows in the disk tier, kept in memory so set() never counts them
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                # WAL lets the read connections run while a write is in progress
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)"
+                )
+                self._db.commit()
+                self._db_count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                logger.info(f"Response cache disk tier enabled at {db_path}")
+            except sqlite3.Error as e:
+                logger.error(f"Failed to open response cache database {db_path}: {e}")
+                self._db = None
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """Build a cache from RAG_CACHE_* environment variables."""
+        return cls(
+            max_entries=int(os.getenv("RAG_CACHE_MAX_ENTRIES", 256)),
+            ttl_seconds=float(os.getenv("RAG_CACHE_TTL_SECONDS", 24 * 3600)),
+            db_path=os.getenv("RAG_CACHE_DB_PATH") or None,
+            max_db_entries=int(os.getenv("RAG_CACHE_MAX_DB_ENTRIES", 10000)),
+        )
+
+    @staticmethod
+    def make_key(method: str, prompt_version: str, model: str, text: str) -> str:
+        """Build the content-addressed key for a method call on a document."""
+        return f"{method}:{prompt_version}:{model}:{document_hash(text)}"
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached value for key, or None on a miss. The SQLite lookup runs
+        outside the cache lock on the calling thread's own connection.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, payload = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(payload)
+                del self._memory[key]
+            if self._db is None:
+                self.misses += 1
+                return None
+
+        row = self._read(key)
+
+        with self._lock:
+            if row is not None:
+                payload, created_at, accessed_at = row
+                try:
+                    if not self._expired(created_at, now):
+                        if now - accessed_at > ACCESS_WRITE_INTERVAL_SECONDS:
+                            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                            self._db.commit()
+                        self._remember(key, created_at, payload)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return json.loads(payload)
+                    self._db_count -= self._db.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Response cache write failed: {e}")
+            self.misses += 1
+            return None
+
+    def _read(self, key: str) -> Optional[tuple]:
+        """Fetch key's row with this thread's read connection, opened on first use."""
+        try:
+            reader = getattr(self._readers, "db", None)
+            if reader is None:
+                reader = self._readers.db = sqlite3.connect(self.db_path)
+            return reader.execute(
+                "SELECT value, created_at, accessed_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read failed: {e}")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value under key in every enabled tier."""
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, payload)
+            if self._db is None:
+                return
+            try:
+                inserted = self._db.execute(
+                    "INSERT OR IGNORE INTO responses (key, value, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, payload, now, now),
+                ).rowcount
+                if inserted:
+                    self._db_count += 1
+                else:
+                    self._db.execute(
+                        "UPDATE responses SET value = ?, created_at = ?, accessed_at = ? WHERE key = ?",
+                        (payload, now, now, key),
+                    )
+                if self._db_count > self.max_db_entries:
+                    removed = self._db.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        "SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                        (self._db_count - self.max_db_entries,),
+                    ).rowcount
+                    self._db_count -= removed
+                    self.evictions += removed
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Response cache write failed: {e}")
+
+    def _remember(self, key: str, created_at: float, payload: str) -> None:
+        self._memory[key] = (created_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM responses")
+                    self._db.commit()
+                    self._db_count = 0
+                except sqlite3.Error as e:
+                    logger.error(f"Response cache clear failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_enabled": self._db is not None,
+            }
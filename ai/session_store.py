@@ -0,0 +1,343 @@
+"""
+Disk-backed storage for RAGAgent session state.
+
+Each session's FAISS index, docstore and ingestion fingerprints are written to
+their own directory and reloaded lazily on first access. Everything but the
+index is stored as JSON, so reading a session never unpickles anything. Resident sessions are
+evicted least-recently-used first once they exceed the memory budget or sit
+idle for too long; evicted sessions stay on disk and come back on demand.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import faiss #@UnresolvedImport
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore #@UnresolvedImport
+from langchain_community.vectorstores import FAISS #@UnresolvedImport
+from langchain_core.documents import Document #@UnresolvedImport
+
+from embedding_backends import VectorMatrix
+
+logger = logging.getLogger(__name__)
+
+# Session keys written to session.json next to the index; everything else
+# (vector_store aside) is rebuilt by the chain factory on load.
+PERSISTED_KEYS = ("document_content", "last_document_content", "document_hashes", "chunk_hashes")
+_SET_KEYS = ("document_hashes", "chunk_hashes")
+
+# Flat indexes can be memory-mapped read-only on faiss >= 1.8
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+
+def private_dir(path: str) -> str:
+    """
+    A directory under path's name only the current user can use, for the default
+    location in the shared temp directory. The user ID is appended so other users
+    cannot claim the name first; an existing directory must be ours, not a
+    symlink and closed to group and others.
+    """
+    if not hasattr(os, "getuid"):
+        os.makedirs(path, exist_ok=True)
+        return path
+    path = f"{path}-{os.getuid()}"
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"Session directory {path} is not private to this user; set RAG_SESSION_DIR")
+    return path
+
+
+class SessionStore:
+    def __init__(self, storage_dir: str, embeddings, chain_factory: Callable[[FAISS], Any],
+                 memory_budget_bytes: int = 256 * 1024 * 1024, idle_seconds: float = 1800):
+        """
+        Initialize the store.
+
+        chain_factory(vector_store) rebuilds a session's QA chain after a reload.
+        idle_seconds of 0 disables idle eviction.
+        """
+        os.makedirs(storage_dir, exist_ok=True)
+        self.storage_dir = storage_dir
+        self.embeddings = embeddings
+        self.chain_factory = chain_factory
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_seconds = idle_seconds
+        self._resident = OrderedDict()  # session_id -> session dict, least recently used first
+        self._last_access = {}
+        self._sizes = {}  # resident sessions only; _resident_bytes is their running total
+        self._resident_bytes = 0
+        self._persisted = set()  # resident sessions with a copy on disk, safe to evict
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, embeddings, chain_factory: Callable[[FAISS], Any], default_dir: str) -> "SessionStore":
+        """
+        Build a store from RAG_SESSION_* environment variables. Without
+        RAG_SESSION_DIR, sessions go to a private directory named after default_dir.
+        """
+        return cls(
+            os.getenv("RAG_SESSION_DIR") or private_dir(default_dir),
+            embeddings,
+            chain_factory,
+            memory_budget_bytes=int(float(os.getenv("RAG_SESSION_MEMORY_BUDGET_MB", 256)) * 1024 * 1024),
+            idle_seconds=float(os.getenv("RAG_SESSION_IDLE_SECONDS", 1800)),
+        )
+
+    def _session_dir(self, session_id: str) -> str:
+        return os.path.join(self.storage_dir, hashlib.sha256(session_id.encode("utf-8")).hexdigest())
+
+    def _on_disk(self, session_id: str) -> bool:
+        return os.path.exists(os.path.join(self._session_dir(session_id), "session.json"))
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._resident or self._on_disk(session_id)
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            session = self._resident.get(session_id)
+            if session is not None:
+                self._touch(session_id)
+                return session
+            if not self._on_disk(session_id):
+                raise KeyError(session_id)
+
+        # Disk reads happen outside the store lock so other sessions are not blocked
+        session = self._load(session_id)
+        size = self._estimate_size(session)
+        with self._lock:
+            self.loads += 1
+            resident = self._resident.get(session_id)
+            if resident is not None:
+                # Another thread loaded or persisted it meanwhile
+                self._touch(session_id)
+                return resident
+            self._persisted.add(session_id)
+            self._admit(session_id, session, size)
+            return session
+
+    def setdefault(self, session_id: str, default: Dict[str, Any]) -> Dict[str, Any]:
+        while True:
+            try:
+                return self[session_id]
+            except KeyError:
+                pass
+            with self._lock:
+                session = self._resident.get(session_id)
+                if session is not None:
+                    self._touch(session_id)
+                    return session
+                if not self._on_disk(session_id):
+                    self._admit(session_id, default, self._estimate_size(default))
+                    return default
+            # Persisted and evicted since the lookup above; load it outside the lock
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            found = self._drop(session_id)
+            session_dir = self._session_dir(session_id)
+            if os.path.isdir(session_dir):
+                shutil.rmtree(session_dir, ignore_errors=True)
+                found = True
+            if not found:
+                raise KeyError(session_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            on_disk = {name for name in os.listdir(self.storage_dir)
+                       if os.path.isdir(os.path.join(self.storage_dir, name))}
+            resident = {os.path.basename(self._session_dir(sid)) for sid in self._resident}
+            return len(on_disk | resident)
+
+    def resident_count(self) -> int:
+        with self._lock:
+            return len(self._resident)
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return self._resident_bytes
+
+    def resident_vectors(self) -> int:
+        with self._lock:
+            return sum(session["vector_store"].index.ntotal for session in self._resident.values()
+                       if session.get("vector_store") is not None)
+
+    def ensure_writable(self, session_id: str, session: Dict[str, Any]) -> None:
+        """
+        Replace a memory-mapped index with an owned copy before it is modified.
+        Adding to a memory-mapped faiss index aborts the process.
+        Callers must hold the session's lock.
+        """
+        if session.get("mmapped"):
+            vector_store = session["vector_store"]
+            # A VectorMatrix copies its rows on add, so only faiss indexes need reading back in
+            if not isinstance(vector_store.index, VectorMatrix):
+                vector_store.index = faiss.read_index(os.path.join(self._session_dir(session_id), "index.faiss"))
+            session["mmapped"] = False
+
+    def persist(self, session_id: str, session: Dict[str, Any]) -> None:
+        """
+        Write a session's index and fingerprints to disk, then enforce the memory budget.
+        The given dict becomes the resident copy even if the session was evicted
+        while the caller was modifying it. Callers must hold the session's lock.
+        """
+        session_dir = self._session_dir(session_id)
+        os.makedirs(session_dir, exist_ok=True)
+
+        vector_store = session.get("vector_store")
+        if vector_store is not None:
+            # Write to temporary names and swap them in so a memory-mapped copy
+            # of the previous index is never truncated underneath a reader.
+            # Small sessions' NumPy matrices are saved as index.npy, faiss indexes as index.faiss
+            index_path = os.path.join(session_dir, "index.faiss")
+            matrix_path = os.path.join(session_dir, "index.npy")
+            if isinstance(vector_store.index, VectorMatrix):
+                with open(matrix_path + ".tmp", "wb") as f:
+                    np.save(f, vector_store.index.matrix)
+                os.replace(matrix_path + ".tmp", matrix_path)
+            else:
+                faiss.write_index(vector_store.index, index_path + ".tmp")
+                os.replace(index_path + ".tmp", index_path)
+                if os.path.exists(matrix_path):
+                    # The session outgrew brute force since its last write
+                    os.remove(matrix_path)
+            ids = [vector_store.index_to_docstore_id[position] for position in range(len(vector_store.index_to_docstore_id))]
+            documents = {}
+            for doc_id in ids:
+                doc = vector_store.docstore.search(doc_id)
+                documents[doc_id] = {"page_content": doc.page_content, "metadata": doc.metadata}
+            docstore_path = os.path.join(session_dir, "docstore.json")
+            with open(docstore_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"ids": ids, "documents": documents}, f)
+            os.replace(docstore_path + ".tmp", docstore_path)
+
+        meta = {}
+        for key in PERSISTED_KEYS:
+            if key in session:
+                value = session[key]
+                meta[key] = sorted(value) if key in _SET_KEYS else value
+        meta_path = os.path.join(session_dir, "session.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        size = self._estimate_size(session)
+        with self._lock:
+            self._persisted.add(session_id)
+            self._admit(session_id, session, size)
+
+    def _load(self, session_id: str) -> Dict[str, Any]:
+        session_dir = self._session_dir(session_id)
+        if os.path.exists(os.path.join(session_dir, "index.pkl")):
+            # Written by a release that pickled the docstore; unpickling is not safe, so start over
+            logger.warning(f"Discarding session {session_id} stored in the old pickle format")
+            shutil.rmtree(session_dir, ignore_errors=True)
+            raise KeyError(session_id)
+        with open(os.path.join(session_dir, "session.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        session = {key: set(value) if key in _SET_KEYS else value for key, value in meta.items()}
+
+        index_path = os.path.join(session_dir, "index.faiss")
+        matrix_path = os.path.join(session_dir, "index.npy")
+        index = None
+        if os.path.exists(matrix_path):
+            index, mmapped = VectorMatrix(np.load(matrix_path, mmap_mode="r")), True
+        elif os.path.exists(index_path):
+            mmapped = False
+            if _MMAP_FLAG is not None:
+                try:
+                    index, mmapped = faiss.read_index(index_path, _MMAP_FLAG), True
+                except RuntimeError:
+                    index = None
+            if index is None:
+                index = faiss.read_index(index_path)
+        if index is not None:
+            with open(os.path.join(session_dir, "docstore.json"), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            docstore = InMemoryDocstore({
+                doc_id: Document(id=doc_id, page_content=doc["page_content"], metadata=doc["metadata"])
+                for doc_id, doc in stored["documents"].items()
+            })
+            index_to_docstore_id = dict(enumerate(stored["ids"]))
+            vector_store = FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+            session["vector_store"] = vector_store
+            session["mmapped"] = mmapped
+            session["qa_chain"] = self.chain_factory(vector_store)
+
+        logger.info(f"Loaded session {session_id} from {session_dir}")
+        return session
+
+    @staticmethod
+    def _estimate_size(session: Dict[str, Any]) -> int:
+        """Approximate resident bytes: owned vectors plus stored chunk and document text."""
+        size = len(session.get("document_content") or "") + len(session.get("last_document_content") or "")
+        size += 64 * (len(session.get("document_hashes", ())) + len(session.get("chunk_hashes", ())))
+        vector_store = session.get("vector_store")
+        if vector_store is not None:
+            if not session.get("mmapped"):
+                size += vector_store.index.ntotal * vector_store.index.d * 4
+            for doc in getattr(vector_store.docstore, "_dict", {}).values():
+                size += len(doc.page_content)
+        return size
+
+    def _admit(self, session_id: str, session: Dict[str, Any], size: int) -> None:
+        """Make session the resident copy with the given size. Callers hold the store lock."""
+        self._resident_bytes += size - self._sizes.get(session_id, 0)
+        self._sizes[session_id] = size
+        self._resident[session_id] = session
+        self._touch(session_id)
+
+    def _drop(self, session_id: str) -> bool:
+        """Forget a resident session; True if it was resident. Callers hold the store lock."""
+        self._resident_bytes -= self._sizes.pop(session_id, 0)
+        self._last_access.pop(session_id, None)
+        self._persisted.discard(session_id)
+        return self._resident.pop(session_id, None) is not None
+
+    def _touch(self, session_id: str) -> None:
+        self._resident.move_to_end(session_id)
+        self._last_access[session_id] = time.monotonic()
+        self._evict(keep=session_id)
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Drop idle sessions, then least recently used ones until within budget."""
+        now = time.monotonic()
+        excess = self._resident_bytes - self.memory_budget_bytes
+        victims = []
+        # Least recently used first, so once a session is neither idle nor needed
+        # for the budget none of the later ones are either
+        for session_id in self._resident:
+            idle = self.idle_seconds and now - self._last_access[session_id] > self.idle_seconds
+            if not idle and excess <= 0:
+                break
+            if session_id == keep or session_id not in self._persisted:
+                # Never persisted (e.g. persist failed or still being built); keep it rather than lose data
+                continue
+            victims.append(session_id)
+            excess -= self._sizes.get(session_id, 0)
+        for session_id in victims:
+            self._drop(session_id)
+            self.evictions += 1
+            logger.info(f"Evicted session {session_id} from memory")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self),
+                "resident_sessions": len(self._resident),
+                "resident_bytes": self._resident_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -55,6 +55,21 @@ def test_agent_functionality():
         print(f"❌ Error testing class structure: {e}")
         return False
     
+    # Test 2: Local payment extraction (no API key or network needed)
+    try:
+        from payment_extractor import extract_payment_fields, unresolved_fields
+        details, confidence = extract_payment_fields(test_document)
+        missing = unresolved_fields(confidence)
+        if missing:
+            print(f"❌ Local extractor could not resolve: {', '.join(missing)}")
+            return False
+        print("✅ Payment details extracted locally:")
+        for field in ('payment_amount', 'currency', 'payment_date', 'transaction_id', 'status'):
+            print(f"  - {field}: {details[field]} (confidence {confidence[field]:.2f})")
+    except Exception as e:
+        print(f"❌ Error in local payment extraction: {e}")
+        return False
+
     print("\n" + "=" * 50)
     print("📋 Agent Capabilities Overview:")
     print("=" * 50)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the liveness/readiness split and the lazily imported OCR engine
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest #@UnresolvedImport
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import python_service
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(python_service, "WARMUP", True)
+    for name in python_service.subsystems:
+        monkeypatch.setitem(python_service.subsystems, name, "pending")
+    return python_service.app.test_client()
+
+
+def test_live_before_agent_is_ready(client):
+    response = client.get("/health/live")
+    assert response.status_code == 200
+
+
+def test_not_ready_before_agent_is_ready(client):
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.get_json()["ready"] is False
+
+
+def test_ready_once_llm_and_embeddings_are(client, monkeypatch):
+    monkeypatch.setitem(python_service.subsystems, "llm", "ready")
+    monkeypatch.setitem(python_service.subsystems, "embeddings", "ready")
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    # OCR and docx are reported but do not gate readiness
+    assert response.get_json()["subsystems"]["ocr"] == "pending"
+
+
+def test_pending_is_ready_without_warm_up(client, monkeypatch):
+    monkeypatch.setattr(python_service, "WARMUP", False)
+    assert client.get("/health/ready").status_code == 200
+
+
+def test_failed_agent_is_not_ready(client, monkeypatch):
+    monkeypatch.setitem(python_service.subsystems, "llm", "failed")
+    monkeypatch.setitem(python_service.subsystems, "embeddings", "ready")
+    assert client.get("/health/ready").status_code == 503
+
+
+def test_ocr_state_comes_from_an_import_attempt(client, monkeypatch):
+    monkeypatch.setattr(python_service, "_ocr_engine", None)
+    # A None entry makes the import fail as if the OCR stack were missing
+    monkeypatch.setitem(sys.modules, "ocr_engine", None)
+    assert python_service.check_ocr() is False
+    assert client.get("/health/ready").get_json()["subsystems"]["ocr"] == "unavailable"
+
+
+def test_startup_does_not_import_ocr_stack():
+    # A fresh interpreter, since other tests may have imported these already
+    code = ("import sys, python_service; "
+            "print(sorted(m for m in ('ocr_engine', 'page_extractor', 'pytesseract', 'pypdfium2') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[]"
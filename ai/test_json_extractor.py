@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for JSON extraction from LLM responses
+"""
+
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from json_extractor import SCHEMAS, extract_json
+
+
+def test_pure_json():
+    assert extract_json('{"a": 1}') == {"a": 1}
+
+
+def test_object_in_prose_and_fences():
+    assert extract_json('Here you go: {"a": {"b": "}"}} Thanks') == {"a": {"b": "}"}}
+    assert extract_json('```json\n{"a": 1}\n```') == {"a": 1}
+
+
+def test_unmatched_brace_in_prose_does_not_hide_later_object():
+    assert extract_json('Note: wrap in {braces. Result: {"a": 1}') == {"a": 1}
+
+
+def test_truncated_response_recovers_inner_object():
+    text = 'Result: {"outer": {"status": "Paid"}, "rest": [1, 2'
+    assert extract_json(text) == {"status": "Paid"}
+
+
+def test_top_level_array_without_schema():
+    assert extract_json('[{"a": 1}, {"b": 2}]') == [{"a": 1}, {"b": 2}]
+
+
+def test_top_level_array_with_schema_uses_its_object():
+    result = extract_json('[{"status": "Paid"}]', SCHEMAS["extract_payment_details"])
+    assert result["status"] == "Paid"
+    assert "missing payment_amount" in result["schema_warnings"]
+
+
+def test_no_json():
+    assert extract_json("no json {here") == {"raw_response": "no json {here"}
+
+
+def test_many_unclosed_braces_stay_linear():
+    # Rescans are budgeted; the object after the first few braces is still found
+    text = "{" * 3 + '{"a": 1}' + "{" * 200000
+    assert extract_json(text) == {"a": 1}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the rule-based payment extractor: amount parsing and status negation
+"""
+
+import os
+import sys
+
+import pytest #@UnresolvedImport
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from payment_extractor import MIN_CONFIDENCE, extract_payment_fields, unresolved_fields
+
+
+@pytest.mark.parametrize("text, amount, currency", [
+    ("Amount: $1,250.00", "1250.00", "USD"),
+    ("Amount: ₹1,25,000.00", "125000.00", "INR"),
+    ("Amount: 1.250,00 EUR", "1250.00", "EUR"),
+    ("Grand total: 1.250.000 EUR", "1250000.00", "EUR"),
+    ("Total: 12,50 EUR", "12.50", "EUR"),
+    ("Total: 45", "45.00", ""),
+])
+def test_amount_formats(text, amount, currency):
+    details, confidence = extract_payment_fields(text)
+    assert details["payment_amount"] == amount
+    assert details["currency"] == currency
+    assert confidence["payment_amount"] >= MIN_CONFIDENCE
+
+
+def test_ambiguous_amount_goes_to_llm():
+    # 99.999 is either 99999 with a dot for grouping or three decimal places
+    details, confidence = extract_payment_fields("Grand total: 99.999 EUR")
+    assert details["payment_amount"] == "99999.00"
+    assert "payment_amount" in unresolved_fields(confidence)
+
+
+@pytest.mark.parametrize("text", ["Total: $1,234.567", "Amount: 1234567.891 USD", "Total: 1,2345"])
+def test_number_is_not_cut_out_of_a_longer_one(text):
+    details, confidence = extract_payment_fields(text)
+    assert details["payment_amount"] == ""
+    assert "payment_amount" in unresolved_fields(confidence)
+
+
+@pytest.mark.parametrize("text, status", [
+    ("Status: Paid", "Paid"),
+    ("Status: Unpaid", "Pending"),
+    ("Payment Status: Refunded", "Refunded"),
+])
+def test_status_keywords(text, status):
+    details, confidence = extract_payment_fields(text)
+    assert details["status"] == status
+    assert "status" not in unresolved_fields(confidence)
+
+
+@pytest.mark.parametrize("text", [
+    "Status: Not paid",
+    "Status: Payment not completed",
+    "Status: No payment received",
+    "Status: Unsettled",
+    "Status: Hasn't been paid",
+])
+def test_negated_status_goes_to_llm(text):
+    details, confidence = extract_payment_fields(text)
+    assert details["status"] != "Paid"
+    assert "status" in unresolved_fields(confidence)
+
+
+def test_unlabelled_negated_keyword_is_ignored():
+    details, _ = extract_payment_fields("Invoice INV-001\nThis invoice has not been paid.")
+    assert details["status"] == ""
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tests for RAGAgent's per-session locking: sessions never wait on each other, and a
+query only holds its session's lock for retrieval, not while the LLM generates
+"""
+
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest #@UnresolvedImport
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DOCUMENT = """
+Invoice INV-2024-001
+Amount: $1,250.00
+Transaction ID: TXN-123456789
+Status: Paid
+"""
+
+
+class BlockingLLM:
+    """Chat model stand-in whose invoke() waits until the test releases it"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def invoke(self, prompt):
+        self.started.set()
+        assert self.release.wait(10)
+        return SimpleNamespace(content="The invoice was paid.")
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAG_EMBEDDING_BACKEND", "hashing")
+    monkeypatch.setenv("RAG_SESSION_DIR", str(tmp_path / "sessions"))
+    monkeypatch.setenv("RAG_EMBEDDING_CACHE_DIR", str(tmp_path / "embeddings"))
+    monkeypatch.setenv("RAG_CACHE_DB_PATH", "")
+    monkeypatch.setenv("RAG_ANSWER_CACHE_MAX_ENTRIES", "0")
+    from rag_agent import RAGAgent
+    return RAGAgent(api_key="offline-test")
+
+
+def run_in_thread(fn, *args, **kwargs):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", fn(*args, **kwargs)), daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_lock_is_per_session(agent):
+    assert agent.session_lock("a") is agent.session_lock("a")
+    assert agent.session_lock("a") is not agent.session_lock("b")
+
+
+def test_other_sessions_do_not_wait(agent):
+    with agent.session_lock("a"):
+        thread, result = run_in_thread(agent.add_documents, [DOCUMENT], session_id="b")
+        thread.join(10)
+        assert not thread.is_alive()
+    assert result["value"]["chunks_added"] > 0
+
+
+def test_same_session_waits(agent):
+    with agent.session_lock("a"):
+        thread, _ = run_in_thread(agent.add_documents, [DOCUMENT], session_id="a")
+        thread.join(0.2)
+        assert thread.is_alive()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_query_generates_outside_the_session_lock(agent):
+    agent.add_documents([DOCUMENT], session_id="a")
+    # Swapped in after the session's chain is built, which needs a real chat model
+    agent.llm = BlockingLLM()
+    query, answer = run_in_thread(agent.query, "What is the overall status of this invoice?", session_id="a")
+    assert agent.llm.started.wait(10)
+    try:
+        # Generation is still running; an upload to the same session must not wait for it
+        upload, _ = run_in_thread(agent.add_documents, ["Late fee: $25.00"], session_id="a")
+        upload.join(10)
+        assert not upload.is_alive()
+    finally:
+        agent.llm.release.set()
+    query.join(10)
+    assert answer["value"] == {"answer": "The invoice was paid."}
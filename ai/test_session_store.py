@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for the disk-backed session store: eviction, reload and the private default directory
+"""
+
+import os
+import stat
+import sys
+
+import pytest #@UnresolvedImport
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_community.docstore.in_memory import InMemoryDocstore #@UnresolvedImport
+from langchain_community.vectorstores import FAISS #@UnresolvedImport
+
+from embedding_backends import HashingEmbeddings, VectorMatrix
+from session_store import SessionStore, private_dir
+
+TEXTS = ["Invoice INV-001 total 1250 USD", "Payment received by wire transfer", "Due date 15 January"]
+
+
+def make_session(embeddings, texts=TEXTS):
+    vector_store = FAISS(embeddings, VectorMatrix(), InMemoryDocstore(), {})
+    vector_store.add_texts(texts)
+    return {"vector_store": vector_store, "document_content": texts[0], "document_hashes": {"h1"}}
+
+
+@pytest.fixture
+def embeddings():
+    return HashingEmbeddings(64)
+
+
+def test_evicted_session_reloads_from_disk(tmp_path, embeddings):
+    # A budget this small keeps only the session touched last resident
+    store = SessionStore(str(tmp_path), embeddings, lambda vector_store: "chain", memory_budget_bytes=1)
+    store.persist("a", make_session(embeddings))
+    store.persist("b", make_session(embeddings, ["Another document"]))
+    assert store.resident_count() == 1
+    assert store.evictions == 1
+    assert len(store) == 2
+
+    session = store["a"]
+    assert store.loads == 1
+    assert session["qa_chain"] == "chain"
+    assert session["document_hashes"] == {"h1"}
+    assert session["document_content"] == TEXTS[0]
+    vector_store = session["vector_store"]
+    assert isinstance(vector_store.index, VectorMatrix)
+    assert vector_store.similarity_search("wire transfer payment", k=1)[0].page_content == TEXTS[1]
+
+
+def test_reloaded_session_accepts_new_chunks(tmp_path, embeddings):
+    store = SessionStore(str(tmp_path), embeddings, lambda vector_store: None, memory_budget_bytes=1)
+    store.persist("a", make_session(embeddings))
+    store.persist("b", make_session(embeddings))
+    session = store["a"]
+    store.ensure_writable("a", session)
+    session["vector_store"].add_texts(["Late fee 25 USD"])
+    store.persist("a", session)
+    store.persist("b", store["b"])
+    assert store["a"]["vector_store"].index.ntotal == 4
+
+
+def test_docstore_is_json_not_pickle(tmp_path, embeddings):
+    store = SessionStore(str(tmp_path), embeddings, lambda vector_store: None)
+    store.persist("a", make_session(embeddings))
+    files = set(os.listdir(store._session_dir("a")))
+    assert "docstore.json" in files
+    assert "index.pkl" not in files
+
+
+def test_old_pickle_session_is_discarded(tmp_path, embeddings):
+    store = SessionStore(str(tmp_path), embeddings, lambda vector_store: None, memory_budget_bytes=1)
+    store.persist("a", make_session(embeddings))
+    store.persist("b", make_session(embeddings))
+    with open(os.path.join(store._session_dir("a"), "index.pkl"), "wb") as f:
+        f.write(b"not loaded")
+    with pytest.raises(KeyError):
+        store["a"]
+    assert "a" not in store
+    assert store.setdefault("a", {"fresh": True}) == {"fresh": True}
+
+
+def test_delete_removes_session(tmp_path, embeddings):
+    store = SessionStore(str(tmp_path), embeddings, lambda vector_store: None)
+    store.persist("a", make_session(embeddings))
+    del store["a"]
+    assert "a" not in store
+    with pytest.raises(KeyError):
+        del store["a"]
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX ownership checks")
+def test_private_dir_is_owned_and_closed(tmp_path):
+    path = private_dir(str(tmp_path / "rag_sessions"))
+    assert path.endswith(f"-{os.getuid()}")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+    assert private_dir(str(tmp_path / "rag_sessions")) == path
+
+    os.chmod(path, 0o755)
+    with pytest.raises(PermissionError):
+        private_dir(str(tmp_path / "rag_sessions"))
@@ -0,0 +1,239 @@
+"""
+Lightweight per-request tracing.
+
+python_service opens a root span for every request (and JobQueue for every
+background job); stage_timer() blocks and explicit span() blocks inside it
+become nested child spans. Spans follow the request onto worker threads when
+the work is submitted through bind().
+
+Tracing is off unless RAG_TRACE_DIR is set. Each finished trace is then written
+there as one file: plain JSON by default, or OTLP/JSON (an
+ExportTraceServiceRequest, loadable by OpenTelemetry collectors and Jaeger)
+with RAG_TRACE_FORMAT=otlp. RAG_TRACE_MIN_DURATION_MS keeps only slow traces.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_DIR = os.getenv("RAG_TRACE_DIR")
+TRACE_FORMAT = os.getenv("RAG_TRACE_FORMAT", "json").lower()
+TRACE_MIN_DURATION_MS = float(os.getenv("RAG_TRACE_MIN_DURATION_MS", 0))
+SERVICE_NAME = os.getenv("RAG_TRACE_SERVICE_NAME", "rag-python-service")
+
+_current = contextvars.ContextVar("rag_current_span", default=None)
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.thread = threading.current_thread().name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.add(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.start_ns / 1e9).isoformat(),
+            "offset_ms": round((self.start_ns - self.trace.root.start_ns) / 1e6, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "thread": self.thread,
+            "attributes": self.attributes,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []  # finished spans, in end order
+        self._lock = threading.Lock()
+        self.root = Span(self, name, None, attributes)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "duration_ms": round(self.root.duration_ms, 3),
+            "spans": [span.to_dict() for span in spans],
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [{
+                    "traceId": self.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 2 if span is self.root else 1,  # SERVER / INTERNAL
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": _otlp_attributes({**span.attributes, "thread.name": span.thread}),
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                } for span in spans],
+            }],
+        }]}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": typed})
+    return encoded
+
+
+def enabled() -> bool:
+    return bool(TRACE_DIR)
+
+
+def start_trace(name: str, **attributes) -> Optional[Trace]:
+    """Open a trace whose root span becomes the current span; None when tracing is off."""
+    if not enabled():
+        return None
+    trace = Trace(name, attributes)
+    _current.set(trace.root)
+    return trace
+
+
+def end_trace(trace: Optional[Trace], error: Optional[BaseException] = None) -> None:
+    """Close the root span, clear the current span and export the trace."""
+    if trace is None:
+        return
+    _current.set(None)
+    trace.root.end(error)
+    if trace.root.duration_ms >= TRACE_MIN_DURATION_MS:
+        try:
+            export(trace)
+        except Exception as e:
+            logger.warning(f"Could not export trace {trace.trace_id}: {e}")
+
+
+def export(trace: Trace, directory: Optional[str] = None, fmt: Optional[str] = None) -> str:
+    """Write a trace to directory as JSON or OTLP/JSON and return the file path."""
+    directory = directory or TRACE_DIR
+    fmt = fmt or TRACE_FORMAT
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.fromtimestamp(trace.root.start_ns / 1e9).strftime("%Y%m%dT%H%M%S")
+    suffix = ".otlp.json" if fmt == "otlp" else ".json"
+    path = os.path.join(directory, f"{stamp}-{trace.trace_id}{suffix}")
+    payload = trace.to_otlp() if fmt == "otlp" else trace.to_dict()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, default=str)
+    os.replace(tmp_path, path)
+    return path
+
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Optional[Trace]]:
+    """Run the enclosed block as its own trace (used for background jobs)."""
+    previous = _current.get()
+    current = start_trace(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        end_trace(current, e)
+        raise
+    else:
+        end_trace(current)
+    finally:
+        _current.set(previous)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace.trace_id if span else None
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """
+    Open a child of the current span without making it current; the caller
+    must end() it. Used where a span starts and ends in separate callbacks.
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Record the enclosed block as a child of the current span; a no-op outside a trace."""
+    child = start_span(name, **attributes)
+    if child is None:
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    fn bound to a copy of the caller's context, so spans it opens on an
+    executor thread nest under the caller's span. Bind once per submission:
+    a context cannot run on two threads at once.
+    """
+    return partial(contextvars.copy_context().run, fn)
@@ -70,7 +70,7 @@ class PythonRAGClient {
     }
   }
 
-  async queryDocuments(question, context = '', documents = []) {
+  async queryDocuments(question, context = '', documents = [], sessionId = null) {
     try {
       const payload = {
         question: question,
@@ -81,6 +81,10 @@ class PythonRAGClient {
         payload.documents = documents;
       }
 
+      if (sessionId) {
+        payload.sessionId = sessionId;
+      }
+
       const response = await this.client.post('/query', payload);
       return response.data;
     } catch (error) {
@@ -89,6 +93,40 @@ class PythonRAGClient {
     }
   }
 
+  // Queue a long-running analysis on the Python service; resolves with the job record
+  async submitAnalysisJob(analysis, documentText) {
+    try {
+      const response = await this.client.post(`/jobs/analyze/${analysis}`, {
+        document_text: documentText
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Analysis job submission failed:', error.message);
+      throw new Error(`Analysis job submission failed: ${error.response?.data?.error || error.message}`);
+    }
+  }
+
+  // Long-poll a job; each request waits up to waitSeconds server-side, well under the axios timeout
+  async waitForJob(jobId, waitSeconds = 20, maxAttempts = 30) {
+    for (let attempt = 0; attempt < maxAttempts; attempt++) {
+      const response = await this.client.get(`/jobs/${jobId}`, { params: { wait: waitSeconds } });
+      const job = response.data;
+      if (job.status === 'succeeded') {
+        return job.result;
+      }
+      if (job.status === 'failed') {
+        throw new Error(`Job ${jobId} failed: ${job.error}`);
+      }
+    }
+    throw new Error(`Job ${jobId} did not finish in time`);
+  }
+
+  // Comprehensive analysis through the job queue, immune to the 30 second request timeout
+  async analyzeComprehensiveAsync(documentText) {
+    const job = await this.submitAnalysisJob('comprehensive', documentText);
+    return this.waitForJob(job.jobId);
+  }
+
   // Convenience method for comprehensive document analysis
   async analyzeDocument(documentText) {
     try {
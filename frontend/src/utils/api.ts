@@ -47,17 +47,21 @@ export const uploadDocument = async (formData: FormData, token: string) => {
 };
 
 // AI Service API calls
-export const clearAIContext = async () => {
+export const clearAIContext = async (sessionId?: string) => {
   const response = await fetch(`${AI_SERVICE_URL}/clear-context`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ sessionId }),
   });
   return response.json();
 };
 
-export const uploadToAI = async (file: File) => {
+export const uploadToAI = async (file: File, sessionId?: string) => {
   const formData = new FormData();
   formData.append('file', file);
+  if (sessionId) {
+    formData.append('sessionId', sessionId);
+  }
   
   const response = await fetch(`${AI_SERVICE_URL}/upload`, {
     method: 'POST',
@@ -66,11 +70,11 @@ export const uploadToAI = async (file: File) => {
   return response.json();
 };
 
-export const chatWithAI = async (message: string) => {
+export const chatWithAI = async (message: string, sessionId?: string) => {
   const response = await fetch(`${AI_SERVICE_URL}/chat`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ message }),
+    body: JSON.stringify({ message, sessionId }),
   });
   return response.json();
 };